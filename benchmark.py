@@ -0,0 +1,701 @@
+#!/usr/bin/env python3
+
+""" Benchmarks for the table operations (exercise1.py) and the Kanadia immigration office (exercise2.py)
+
+Generates synthetic EMPLOYEES-shaped tables and traveller files in the format of test_jsons/ and times the
+operators and the decide pipeline on them.
+
+Usage:
+    python3 benchmark.py suite [--sizes 1000,10000,100000] [--output results.json]
+    python3 benchmark.py validator [--travellers N]
+    python3 benchmark.py records [--travellers N]
+    python3 benchmark.py incremental [--travellers N]
+    python3 benchmark.py dedup [--travellers N] [--resubmit-share S]
+    python3 benchmark.py parallel [--travellers N] [--processes P]
+    python3 benchmark.py product-selection [--rows N] [--processes P]
+    python3 benchmark.py sinks [--travellers N]
+
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import platform
+import tempfile
+import tracemalloc
+
+from exercise1 import selection, projection, cross_product, join, order_by, top_k, iter_order_by, group_by, \
+    Condition, IndexedTable, write_table, MappedTable, iter_parallel_product_selection
+from exercise2 import decide, decide_iter, decide_parallel, decide_person, CompiledValidator, CountryIndex, SINKS, \
+    DecisionStats, load_travellers, decide_typed, \
+    IncrementalDecider, Deduplicator, decide_deduplicated
+
+__author__ = "Darius Chow and Ryan Prance, Adopted from: Susan Sim"
+__email__ = "darius.chow@mail.utoronto.ca, ryan.prance@mail.utoronto.ca, ses@drsusansim.org"
+__copyright__ = "Adopted from: 2015 Susan Sim"
+__license__ = "MIT License"
+
+COUNTRIES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "countries.json")
+ALPHANUMERIC = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+SURNAMES = ["Smith", "Black", "Verdi", "White", "Brown", "Mori", "Chow", "Prance", "Sim", "Nguyen", "Garcia",
+            "Kowalski", "Okafor", "Tanaka", "Dubois", "Rossi"]
+FIRST_NAMES = ["Mary", "Lucy", "Nico", "Mark", "Ryan", "Darius", "Susan", "Ana", "Omar", "Yuki", "Lea", "Ivan"]
+DEPARTMENTS = ["sales", "production", "marketing", "research", "finance", "legal", "support", "logistics"]
+# Above this many rows, the suite only runs the streaming benchmarks, whose inputs and outputs are not held in memory
+IN_MEMORY_MAX_ROWS = 1000000
+# Above this many rows, peak memory is not measured, since that takes one more run under tracemalloc
+TRACED_MAX_ROWS = 100000
+
+
+#####################
+# DATA GENERATORS ##
+#####################
+def generate_employees(n, seed=0):
+    """
+    Generates a table shaped like EMPLOYEES in exercise1.py.
+
+    :param n: number of rows
+    :param seed: seed of the random number generator
+    :return: A table in the form of a list of lists with the header ["Surname", "FirstName", "Age", "Salary"]
+    """
+    return list(iter_employees(n, seed))
+
+
+def iter_employees(n, seed=0):
+    """
+    Same as generate_employees, one row at a time, for tables larger than memory.
+
+    :return: a generator yielding the header followed by n rows
+    """
+    rng = random.Random(seed)
+    yield ["Surname", "FirstName", "Age", "Salary"]
+    for _ in range(n):
+        yield [rng.choice(SURNAMES), rng.choice(FIRST_NAMES), rng.randint(18, 70), rng.randrange(1000, 10000, 100)]
+
+
+def generate_assignments():
+    """
+    :return: A table shaped like R1 in exercise1.py, assigning each surname to a department, with the header
+      ["Surname", "Department"]
+    """
+    table = [["Surname", "Department"]]
+    for index, surname in enumerate(SURNAMES):
+        table.append([surname, DEPARTMENTS[index % len(DEPARTMENTS)]])
+    return table
+
+
+def random_code(rng, groups):
+    """
+    Makes a random passport (5 groups) or visa (2 groups) number.
+
+    :param rng: a random.Random
+    :param groups: number of dash separated groups of five alphanumeric characters
+    :return: string
+    """
+    return "-".join("".join(rng.choice(ALPHANUMERIC) for _ in range(5)) for _ in range(groups))
+
+
+def random_location(rng, country):
+    """
+    Makes a location dictionary in the given country.
+
+    :param rng: a random.Random
+    :param country: a country code
+    :return: a dictionary with city, region and country
+    """
+    return {"city": "City" + str(rng.randint(1, 500)), "region": "R" + str(rng.randint(1, 50)),
+            "country": country}
+
+
+def generate_travellers(n, countries, seed=0, kan_share=0.33, advisory_share=0.1, invalid_share=0.04):
+    """
+    Generates n travellers. The rest of the travellers, after the returning Kanadia citizens, are visitors; most
+    of those carry a visa, of which some are expired.
+
+    :param n: number of travellers
+    :param countries: a dictionary of country_codes, as read from countries.json
+    :param seed: seed of the random number generator
+    :param kan_share: fraction of returning Kanadia citizens
+    :param advisory_share: fraction of travellers coming from a country with a medical advisory
+    :param invalid_share: fraction of travellers with a missing field or an unknown location
+    :return: a generator of traveller dictionaries
+    """
+    rng = random.Random(seed)
+    codes = sorted(countries)
+    advisory_codes = [code for code in codes if countries[code]["medical_advisory"] != ""]
+    clear_codes = [code for code in codes if countries[code]["medical_advisory"] == ""]
+    today = datetime.date.today()
+
+    for _ in range(n):
+        returning = rng.random() < kan_share
+        home = "KAN" if returning else rng.choice(codes)
+        origin = rng.choice(advisory_codes if rng.random() < advisory_share else clear_codes)
+        person = {"passport": random_code(rng, 5),
+                  "first_name": "FIRST" + str(rng.randint(1, 1000)),
+                  "last_name": "LAST" + str(rng.randint(1, 1000)),
+                  "birth_date": "19%02d-%02d-%02d" % (rng.randint(0, 99), rng.randint(1, 12), rng.randint(1, 28)),
+                  "home": random_location(rng, home),
+                  "entry_reason": "returning" if returning else "visiting",
+                  "from": random_location(rng, origin)}
+        if rng.random() < 0.2:
+            person["via"] = random_location(rng, rng.choice(clear_codes))
+        if not returning and rng.random() < 0.8:
+            issued = today - datetime.timedelta(days=rng.randint(0, 4 * 365))
+            person["visa"] = {"code": random_code(rng, 2), "date": issued.isoformat()}
+        roll = rng.random()
+        if roll < invalid_share / 2:
+            del person[rng.choice(["passport", "birth_date", "from"])]
+        elif roll < invalid_share:
+            person["from"]["country"] = "XYZ"
+        yield person
+
+
+def with_resubmissions(travellers, share, seed=0):
+    """
+    Repeats some travellers, the way kiosks submit an application again after a timeout.
+
+    :param travellers: an iterable of traveller dictionaries
+    :param share: fraction of travellers submitted twice
+    :param seed: seed of the random number generator
+    :return: a generator of traveller dictionaries
+    """
+    rng = random.Random(seed)
+    for person in travellers:
+        yield person
+        if rng.random() < share:
+            yield person
+
+
+def write_travellers(file_name, travellers):
+    """
+    Writes travellers to a JSON array file without holding them all in memory.
+
+    :param file_name: name of the file to write
+    :param travellers: an iterable of traveller dictionaries
+    """
+    with open(file_name, "w") as traveller_file:
+        traveller_file.write("[\n")
+        for index, person in enumerate(travellers):
+            if index > 0:
+                traveller_file.write(",\n")
+            traveller_file.write(json.dumps(person))
+        traveller_file.write("\n]\n")
+
+
+#################
+# MEASUREMENT ##
+#################
+def percentile(values, q):
+    """
+    :param values: a non-empty list of numbers
+    :param q: percentile, between 0 and 100
+    :return: the nearest-rank percentile of values
+    """
+    ordered = sorted(values)
+    rank = max(int(round(q / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def peak_memory(function):
+    """
+    :param function: a function taking no arguments
+    :return: the peak number of bytes allocated by Python while running function
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure_calls(name, size, function, repeat):
+    """
+    Times an operator called on a whole table.
+
+    :param name: name of the benchmark
+    :param size: number of input rows
+    :param function: a function taking no arguments that runs the operator once
+    :param repeat: number of timed calls
+    :return: a result dictionary; latencies are per call. A few calls are too few for a tail percentile, so the
+      fastest, median and slowest calls are reported (latency_p99 is None). Peak memory is None above
+      TRACED_MAX_ROWS.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {"benchmark": name,
+            "size": size,
+            "repeat": repeat,
+            "throughput": size / percentile(timings, 50),
+            "latency_unit": "call",
+            "latency_min": min(timings),
+            "latency_p50": percentile(timings, 50),
+            "latency_p99": None,
+            "latency_max": max(timings),
+            "peak_memory": peak_memory(function) if size <= TRACED_MAX_ROWS else None}
+
+
+def measure_records(name, size, make_iterator):
+    """
+    Times a pipeline producing one result per record.
+
+    :param name: name of the benchmark
+    :param size: number of input records
+    :param make_iterator: a function taking no arguments that returns an iterator with one item per record
+    :return: a result dictionary; latencies are the time taken to produce each record. Peak memory is None above
+      TRACED_MAX_ROWS.
+    """
+    timings = []
+    start = last = time.perf_counter()
+    for _ in make_iterator():
+        now = time.perf_counter()
+        timings.append(now - last)
+        last = now
+    total = last - start
+    return {"benchmark": name,
+            "size": size,
+            "repeat": 1,
+            "throughput": size / total if total > 0 else 0.0,
+            "latency_unit": "record",
+            "latency_min": min(timings) if timings else 0.0,
+            "latency_p50": percentile(timings, 50) if timings else 0.0,
+            "latency_p99": percentile(timings, 99) if timings else 0.0,
+            "latency_max": max(timings) if timings else 0.0,
+            "peak_memory": peak_memory(lambda: sum(1 for _ in make_iterator())) if size <= TRACED_MAX_ROWS else None}
+
+
+#################
+# BENCHMARKS ##
+#################
+def bench_tables(size, repeat=3):
+    """
+    Benchmarks the exercise1 operators on an EMPLOYEES-shaped table. Above IN_MEMORY_MAX_ROWS, only the operators
+    that stream their input (top_k and iter_order_by) are run.
+
+    :param size: number of rows
+    :param repeat: number of timed calls per operator
+    :return: list of result dictionaries
+    """
+    streaming = [measure_calls("top_k", size, lambda: top_k(iter_employees(size), "Salary", 10), repeat),
+                 measure_records("iter_order_by", size,
+                                 lambda: iter_order_by(iter_employees(size), "Salary", True, max(size // 10, 1)))]
+    if size > IN_MEMORY_MAX_ROWS:
+        return streaming
+    employees = generate_employees(size)
+    assignments = generate_assignments()
+
+    def filter_employees(row):
+        return row[-2] >= 30 and row[-1] > 3500
+
+    indexed_employees = IndexedTable(employees)
+    indexed_employees.create_index("Surname")
+    indexed_employees.create_index("Age", "sorted")
+
+    results = [measure_calls("selection", size, lambda: selection(employees, filter_employees), repeat),
+               measure_calls("selection_scan", size, lambda: selection(employees, Condition("Age", "==", 30)), repeat),
+               measure_calls("selection_hash", size,
+                             lambda: selection(indexed_employees, Condition("Surname", "==", "Smith")), repeat),
+               measure_calls("selection_sorted", size,
+                             lambda: selection(indexed_employees, Condition("Age", "==", 30)), repeat),
+               measure_calls("projection", size, lambda: projection(employees, ["Surname", "Salary"]), repeat),
+               measure_calls("cross_product", size, lambda: cross_product(employees, assignments[:5]), repeat),
+               measure_calls("join", size, lambda: join(employees, assignments, "Surname"), repeat),
+               measure_calls("group_by", size,
+                             lambda: group_by(employees, "Surname", [("avg", "Salary"), ("count", "*")]), repeat),
+               measure_calls("order_by", size, lambda: order_by(employees, "Salary", descending=True), repeat)]
+    results += streaming
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        table_file = os.path.join(tmp_dir, "employees.tbl")
+        write_table(employees, table_file)
+        with MappedTable(table_file) as mapped_employees:
+            results += [measure_calls("mapped_selection_scan", size,
+                                      lambda: selection(mapped_employees, Condition("Age", "==", 30)), repeat),
+                        measure_calls("mapped_projection", size,
+                                      lambda: projection(mapped_employees, ["Surname", "Salary"]), repeat)]
+    return results
+
+
+def bench_decide(size, countries, tmp_dir, **mix):
+    """
+    Benchmarks the decide pipeline on a synthetic traveller file. Above IN_MEMORY_MAX_ROWS, decide (which loads the
+    whole file) is skipped and only decide_iter is run.
+
+    :param size: number of travellers
+    :param countries: a dictionary of country_codes, as read from countries.json
+    :param tmp_dir: directory for the traveller file
+    :param mix: keyword arguments of generate_travellers setting the mix of travellers
+    :return: list of result dictionaries
+    """
+    input_file = os.path.join(tmp_dir, "travellers_" + str(size) + ".json")
+    write_travellers(input_file, generate_travellers(size, countries, **mix))
+    try:
+        results = [measure_records("decide_iter", size, lambda: decide_iter(input_file, COUNTRIES_FILE))]
+        if size <= IN_MEMORY_MAX_ROWS:
+            results.insert(0, measure_calls("decide", size, lambda: decide(input_file, COUNTRIES_FILE), 1))
+        return results
+    finally:
+        os.remove(input_file)
+
+
+def run_suite(sizes, repeat, **mix):
+    """
+    Runs the table and decide benchmarks for every size.
+
+    :param sizes: list of numbers of rows / travellers
+    :param repeat: number of timed calls per table operator
+    :param mix: keyword arguments of generate_travellers setting the mix of travellers
+    :return: a dictionary describing the run, with the list of results
+    """
+    with open(COUNTRIES_FILE, "r") as countries_file:
+        countries = json.loads(countries_file.read())
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            results.extend(bench_tables(size, repeat))
+            results.extend(bench_decide(size, countries, tmp_dir, **mix))
+    return {"timestamp": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "mix": mix,
+            "results": results}
+
+
+def bench_validator(travellers, countries):
+    """
+    Measures the per-traveller cost of decide_person (which builds a CompiledValidator for each traveller) and of
+    one CompiledValidator, with and without DecisionStats instrumentation.
+
+    :param travellers: list of traveller dictionaries
+    :param countries: a dictionary of country_codes, as read from countries.json
+    :return: list of (label, microseconds per traveller)
+    """
+    index = CountryIndex(countries)
+    start = time.perf_counter()
+    expected = [decide_person(person, index) for person in travellers]
+    helpers = time.perf_counter() - start
+
+    start = time.perf_counter()
+    validator = CompiledValidator(index)
+    decisions = [validator.decide(person) for person in travellers]
+    compiled = time.perf_counter() - start
+    assert decisions == expected
+
+    start = time.perf_counter()
+    validator = CompiledValidator(index, stats=DecisionStats())
+    decisions = [validator.decide(person) for person in travellers]
+    instrumented = time.perf_counter() - start
+    assert decisions == expected
+
+    return [("decide_person", helpers * 1e6 / len(travellers)),
+            ("CompiledValidator", compiled * 1e6 / len(travellers)),
+            ("CompiledValidator+stats", instrumented * 1e6 / len(travellers))]
+
+
+def bench_records(input_file, countries):
+    """
+    Compares travellers held as dictionaries (json.loads) with Traveller records (load_travellers): memory held per
+    traveller once the file is loaded, per-traveller cost of deciding them in memory, and time to decide the file.
+
+    :param input_file: name of a traveller file
+    :param countries: a dictionary of country_codes, as read from countries.json
+    :return: list of (label, dictionaries, records)
+    """
+    def loaded_size(load):
+        tracemalloc.start()
+        try:
+            people = load()
+            return people, tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+
+    def load_dictionaries():
+        with open(input_file, "r") as citizen_file:
+            return json.loads(citizen_file.read())
+
+    index = CountryIndex(countries)
+    people, dictionary_bytes = loaded_size(load_dictionaries)
+    records, record_bytes = loaded_size(lambda: load_travellers(input_file, index))
+
+    validator = CompiledValidator(index)
+    start = time.perf_counter()
+    expected = [validator.decide(person) for person in people]
+    dictionary_decide = time.perf_counter() - start
+    start = time.perf_counter()
+    assert [validator.decide(record) for record in records] == expected
+    record_decide = time.perf_counter() - start
+    start = time.perf_counter()
+    assert validator.decide_batch(people) == expected
+    dictionary_batch = time.perf_counter() - start
+    start = time.perf_counter()
+    assert validator.decide_batch(records) == expected
+    record_batch = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assert decide(input_file, COUNTRIES_FILE) == expected
+    dictionary_file = time.perf_counter() - start
+    start = time.perf_counter()
+    assert decide_typed(input_file, COUNTRIES_FILE) == expected
+    record_file = time.perf_counter() - start
+
+    return [("bytes/traveller", dictionary_bytes / len(people), record_bytes / len(records)),
+            ("decide us/traveller", dictionary_decide * 1e6 / len(people), record_decide * 1e6 / len(records)),
+            ("batch us/traveller", dictionary_batch * 1e6 / len(people), record_batch * 1e6 / len(records)),
+            ("file seconds", dictionary_file, record_file)]
+
+
+def bench_incremental(travellers, countries):
+    """
+    Compares deciding every traveller again with IncrementalDecider after the medical advisory of one country (and
+    then of every country) changes.
+
+    :param travellers: list of traveller dictionaries
+    :param countries: a dictionary of country_codes, as read from countries.json
+    :return: list of (change, travellers decided again, seconds to decide everyone, seconds incrementally, flips)
+    """
+    decider = IncrementalDecider(travellers, countries)
+    code = sorted(countries)[0]
+    one = dict(countries)
+    one[code] = dict(countries[code], medical_advisory="" if countries[code].get("medical_advisory") else "EBOLA")
+    every = dict((code, dict(countries[code], medical_advisory="EBOLA")) for code in countries)
+
+    results = []
+    for label, new_countries in (("one country", one), ("every country", every), ("back", countries)):
+        start = time.perf_counter()
+        validator = CompiledValidator(CountryIndex(new_countries))
+        expected = [validator.decide(record) for record in decider.travellers]
+        full = time.perf_counter() - start
+
+        start = time.perf_counter()
+        flips = decider.update(new_countries)
+        incremental = time.perf_counter() - start
+        assert decider.decisions == expected
+        results.append((label, decider.recomputed, full, incremental, len(flips)))
+    return results
+
+
+def bench_dedup(input_file):
+    """
+    Times decide_iter and decide_deduplicated on the same file.
+
+    :param input_file: name of a traveller file
+    :return: list of (label, seconds), and the counts of the Deduplicator
+    """
+    start = time.perf_counter()
+    expected = list(decide_iter(input_file, COUNTRIES_FILE))
+    results = [("decide_iter", time.perf_counter() - start)]
+
+    deduplicator = Deduplicator()
+    start = time.perf_counter()
+    decisions = decide_deduplicated(input_file, COUNTRIES_FILE, deduplicator=deduplicator)
+    results.append(("decide_deduplicated", time.perf_counter() - start))
+    assert decisions == expected
+    return results, deduplicator.counts
+
+
+def bench_parallel(input_file, process_counts):
+    """
+    Times decide and decide_parallel with each number of processes on the same file. The CPU time of the calling
+    process is reported too: it bounds the speedup decide_parallel can reach with any number of cores, since
+    that work is not shared among the workers.
+
+    :param input_file: name of a traveller file
+    :param process_counts: list of numbers of worker processes
+    :return: list of (label, seconds, speedup over decide, CPU seconds of the calling process)
+    """
+    start = time.perf_counter()
+    start_cpu = time.process_time()
+    expected = decide(input_file, COUNTRIES_FILE)
+    baseline = time.perf_counter() - start
+    results = [("decide", baseline, 1.0, time.process_time() - start_cpu)]
+
+    for processes in process_counts:
+        start = time.perf_counter()
+        start_cpu = time.process_time()
+        decisions = decide_parallel(input_file, COUNTRIES_FILE, processes=processes)
+        elapsed = time.perf_counter() - start
+        parent_cpu = time.process_time() - start_cpu
+        assert decisions == expected
+        results.append(("decide_parallel x" + str(processes), elapsed, baseline / elapsed, parent_cpu))
+    return results
+
+
+def bench_product_selection(size, process_counts):
+    """
+    Times a selection over the cross-product of an EMPLOYEES-shaped table with itself, with selection over
+    cross_product and with iter_parallel_product_selection on each number of processes. Only the filtered product
+    runs in parallel, so the whole product is not timed here.
+
+    :param size: number of rows of each table
+    :param process_counts: list of numbers of worker processes
+    :return: list of (label, seconds, speedup over selection of cross_product, rows)
+    """
+    employees = generate_employees(size)
+    condition = Condition("Age", "==", 30)
+    results = []
+    start = time.perf_counter()
+    rows = len(selection(cross_product(employees, employees), condition) or [None]) - 1
+    baseline = time.perf_counter() - start
+    results.append(("selection", baseline, 1.0, rows))
+    for processes in process_counts:
+        start = time.perf_counter()
+        count = sum(1 for row in iter_parallel_product_selection(employees, employees, condition, processes)) - 1
+        elapsed = time.perf_counter() - start
+        assert count == rows
+        results.append(("parallel selection x" + str(processes), elapsed, baseline / elapsed, count))
+    return results
+
+
+def bench_sinks(travellers, countries, tmp_dir):
+    """
+    Measures how fast each output sink writes decisions.
+
+    :param travellers: list of traveller dictionaries
+    :param countries: a dictionary of country_codes, as read from countries.json
+    :param tmp_dir: directory for the output files
+    :return: list of (format, records per second, megabytes per second, file size in bytes)
+    """
+    validator = CompiledValidator(countries)
+    records = [(index, person.get("passport"), validator.decide(person)) for index, person in enumerate(travellers)]
+    results = []
+    for name in sorted(SINKS):
+        file_name = os.path.join(tmp_dir, "decisions." + name)
+        start = time.perf_counter()
+        with SINKS[name](file_name) as sink:
+            for index, passport, decision in records:
+                sink.write(index, passport, decision)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(file_name)
+        results.append((name, len(records) / elapsed, size / elapsed / 1e6, size))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command")
+
+    suite = commands.add_parser("suite", help="benchmark the table operators and the decide pipeline")
+    suite.add_argument("--sizes", default="1000,10000,100000",
+                       help="comma separated numbers of rows and travellers, e.g. 1000,100000,10000000; above "
+                            "1000000 only the streaming benchmarks run")
+    suite.add_argument("--repeat", type=int, default=3, help="timed calls per table operator")
+    suite.add_argument("--kan-share", type=float, default=0.33, help="fraction of returning Kanadia citizens")
+    suite.add_argument("--advisory-share", type=float, default=0.1,
+                       help="fraction of travellers from a country with a medical advisory")
+    suite.add_argument("--invalid-share", type=float, default=0.04,
+                       help="fraction of travellers with missing fields or unknown locations")
+    suite.add_argument("--output", help="file to write the results to as JSON (default: standard output)")
+
+    validator = commands.add_parser("validator", help="per-traveller cost of the rule helpers and the validator")
+    validator.add_argument("--travellers", type=int, default=100000, help="number of in-memory travellers")
+
+    records = commands.add_parser("records", help="memory and decide cost of Traveller records against dictionaries")
+    records.add_argument("--travellers", type=int, default=200000, help="number of synthetic travellers")
+
+    incremental = commands.add_parser("incremental", help="re-deciding travellers after a change of countries")
+    incremental.add_argument("--travellers", type=int, default=200000, help="number of in-memory travellers")
+
+    dedup = commands.add_parser("dedup", help="deciding a file with resubmitted applications once per application")
+    dedup.add_argument("--travellers", type=int, default=1000000, help="number of synthetic travellers")
+    dedup.add_argument("--resubmit-share", type=float, default=0.05, help="fraction of applications submitted twice")
+
+    parallel = commands.add_parser("parallel", help="scaling of decide_parallel with the number of processes")
+    parallel.add_argument("--travellers", type=int, default=1000000, help="number of synthetic travellers")
+    parallel.add_argument("--processes", type=int, default=os.cpu_count(), help="maximum number of worker processes")
+
+    product = commands.add_parser("product-selection",
+                                  help="scaling of iter_parallel_product_selection with the number of processes")
+    product.add_argument("--rows", type=int, default=2000, help="number of rows of each table")
+    product.add_argument("--processes", type=int, default=os.cpu_count(), help="maximum number of worker processes")
+
+    sinks = commands.add_parser("sinks", help="write throughput of the decision output sinks")
+    sinks.add_argument("--travellers", type=int, default=1000000, help="number of decisions written")
+
+    args = parser.parse_args()
+    with open(COUNTRIES_FILE, "r") as countries_file:
+        countries = json.loads(countries_file.read())
+
+    if args.command == "suite":
+        sizes = [int(size) for size in args.sizes.split(",")]
+        report = run_suite(sizes, args.repeat, kan_share=args.kan_share, advisory_share=args.advisory_share,
+                           invalid_share=args.invalid_share)
+        if args.output:
+            with open(args.output, "w") as output_file:
+                json.dump(report, output_file, indent=2)
+        else:
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        for result in report["results"]:
+            tail = "" if result["latency_p99"] is None else "  p99 %.6fs" % result["latency_p99"]
+            sys.stderr.write("%-16s %10d %14.0f/s  min %.6fs  p50 %.6fs%s  max %.6fs  peak %s bytes\n" %
+                             (result["benchmark"], result["size"], result["throughput"], result["latency_min"],
+                              result["latency_p50"], tail, result["latency_max"], result["peak_memory"]))
+
+    elif args.command == "validator":
+        travellers = list(generate_travellers(args.travellers, countries))
+        print("%-24s %10s" % ("validator", "us/person"))
+        for label, micros in bench_validator(travellers, countries):
+            print("%-24s %10.2f" % (label, micros))
+
+    elif args.command == "records":
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_file = os.path.join(tmp_dir, "travellers.json")
+            write_travellers(input_file, generate_travellers(args.travellers, countries))
+            print("%-22s %14s %14s" % ("measure", "dictionaries", "Travellers"))
+            for label, dictionaries, travellers in bench_records(input_file, countries):
+                print("%-22s %14.2f %14.2f" % (label, dictionaries, travellers))
+
+    elif args.command == "incremental":
+        travellers = list(generate_travellers(args.travellers, countries))
+        print("%-14s %10s %12s %12s %8s" % ("change", "decided", "full s", "delta s", "flips"))
+        for label, recomputed, full, incremental, flips in bench_incremental(travellers, countries):
+            print("%-14s %10d %12.4f %12.4f %8d" % (label, recomputed, full, incremental, flips))
+
+    elif args.command == "dedup":
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_file = os.path.join(tmp_dir, "travellers.json")
+            write_travellers(input_file, with_resubmissions(generate_travellers(args.travellers, countries),
+                                                            args.resubmit_share))
+            results, counts = bench_dedup(input_file)
+            print("%-22s %10s" % ("run", "seconds"))
+            for label, seconds in results:
+                print("%-22s %10.3f" % (label, seconds))
+            print(", ".join("%s %d" % (status, counts[status]) for status in sorted(counts)))
+
+    elif args.command == "parallel":
+        process_counts = sorted(set([1, 2, 4, 8, args.processes]))
+        process_counts = [p for p in process_counts if p <= args.processes]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_file = os.path.join(tmp_dir, "travellers.json")
+            write_travellers(input_file, generate_travellers(args.travellers, countries))
+            print("%-22s %10s %8s %12s" % ("run", "seconds", "speedup", "parent cpu s"))
+            for label, seconds, speedup, parent_cpu in bench_parallel(input_file, process_counts):
+                print("%-22s %10.3f %8.2f %12.3f" % (label, seconds, speedup, parent_cpu))
+
+    elif args.command == "product-selection":
+        process_counts = sorted(set([1, 2, 4, 8, args.processes]))
+        process_counts = [p for p in process_counts if p <= args.processes]
+        print("%-22s %10s %8s %12s" % ("run", "seconds", "speedup", "rows"))
+        for label, seconds, speedup, rows in bench_product_selection(args.rows, process_counts):
+            print("%-22s %10.3f %8.2f %12d" % (label, seconds, speedup, rows))
+
+    elif args.command == "sinks":
+        travellers = list(generate_travellers(args.travellers, countries))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            print("%-8s %14s %10s %14s" % ("format", "records/s", "MB/s", "bytes"))
+            for name, records, megabytes, size in bench_sinks(travellers, countries, tmp_dir):
+                print("%-8s %14.0f %10.1f %14d" % (name, records, megabytes, size))
+
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,25 @@
 This module performs table operations on database tables
 implemented as lists of lists. """
 
+import os
+import sys
+import mmap
+import heapq
+import multiprocessing
+import bisect
+import json
+import struct
+import pickle
+import tempfile
+from array import array
+from itertools import islice
+from operator import itemgetter, eq, ne, lt, le, gt, ge
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 __author__ = "Darius Chow and Ryan Prance, Adopted from: Susan Sim"
 __email__ = "darius.chow@mail.utoronto.ca, ryan.prance@mail.utoronto.ca, ses@drsusansim.org"
 __copyright__ = "Adopted from: 2015 Susan Sim"
@@ -23,6 +42,31 @@ R1 = [["Employee", "Department"],
       ["Smith", "sales"],
       ["Black", "production"],
       ["White", "production"]]
+R2 = [["Department", "Head"],
+      ["production", "Mori"],
+      ["sales", "Brown"]]
+
+# Number of temporary files the streaming set operators spread their inputs over
+SPILL_PARTITIONS = 64
+# Rows iter_order_by sorts in memory at a time, and number of sorted runs it merges at a time
+SORT_RUN_ROWS = 1000000
+SORT_MERGE_FAN_IN = 64
+# Groups iter_group_by holds in memory before spilling partial aggregates to temporary files
+GROUP_BY_MAX_GROUPS = 1000000
+# Aggregate functions of group_by
+AGGREGATES = ("count", "sum", "min", "max", "avg")
+# Rows turned into Python lists at a time when a MappedTable is scanned row by row
+MAPPED_CHUNK_ROWS = 65536
+BINARY_TABLE_MAGIC = b"KTBL"
+# Distinct values a dictionary column of a binary table can hold: its codes are 32-bit
+DICTIONARY_MAX_VALUES = 2 ** 32
+# Rows of the left table a worker process of parallel_product_selection takes at a time
+PRODUCT_PARTITION_ROWS = 1000
+# Comparison operators of a Condition, besides "between"
+CONDITION_OPERATORS = {"==": eq, "!=": ne, "<": lt, "<=": le, ">": gt, ">=": ge}
+
+# Right table and condition of an iter_parallel_product_selection worker process, set once by init_product_worker
+PRODUCT_WORKER = None
 
 
 def remove_duplicates(l):
@@ -66,6 +110,14 @@ class UnknownAttributeException(Exception):
     pass
 
 
+class IncompatibleSchemaException(UnknownAttributeException):
+    """
+    Raised when attempting set operations on tables
+    whose attributes do not match
+    """
+    pass
+
+
 def selection(t, f):
     """
     Perform select operation on table t that satisfy condition f.
@@ -83,14 +135,23 @@ def selection(t, f):
     
     :param t: A table in the form of a list of lists with the first item being a list of strings denoting the
       attribute names
-    :param f: A function that takes in a row of a table (denoted by a list) and returns a boolean.
+    :param f: A function that takes in a row of a table (denoted by a list) and returns a boolean, or a Condition,
+      answered with an index of t if t is an IndexedTable with one on the attribute of the condition.
     :return: A table with only those rows for which when applied the function f, returns True. Otherwise, if the
       resulting table is empty, None is returned.
     """
+    if isinstance(t, MappedTable):
+        return t.selection(f)
     new = []
     if len(t) < 1:
         return None
     new.append(t[0])
+    if isinstance(f, Condition):
+        rows = t.lookup(f) if isinstance(t, IndexedTable) else None
+        if rows is not None:
+            new.extend(rows)
+            return new if len(new) > 1 else None
+        f = f.bind(t[0])
     for row_index in range(1, len(t)):
         if f(t[row_index]) is True:
             new.append(t[row_index])
@@ -115,6 +176,8 @@ def projection(t, r):
     :return: A table in the form of a list of lists with the first item being a list of strings denoting the list of
       attributes. Otherwise, if the table is empty, None is returned.
     """
+    if isinstance(t, MappedTable):
+        return t.projection(r)
     if r == [] or t == [] or len(t) < 2:
         return None
 
@@ -158,20 +221,2136 @@ def cross_product(t1, t2):
       are in the table, None is returned
     """
 
-    copy_table1 = deep_copy(t1)
-    copy_table2 = deep_copy(t2)
+    # The inputs are only read, so they need no copying: the header and every row of the result are new lists
+    new = [list(t1[0]) + list(t2[0])]
+    right_rows = t2[1:]
+    for row in t1[1:]:
+        for i in right_rows:
+            new.append(row + i)
+    if len(new) < 2:
+        return None
+
+    return new
 
-    new = []
 
-    # create new schema
-    for category in copy_table2[0]:
-        copy_table1[0].append(category)
-    new.append(copy_table1[0])
-    # make table content
-    for row in copy_table1[1:]:
-        for i in copy_table2[1:]:
-            new.append(row + i)
+def cross_product_view(t1, t2):
+    """
+    Return the cross-product of tables t1 and t2 without building it. Each row of the result is a ProductRow pointing
+    at a row of t1 and a row of t2, created when it is accessed; neither table is copied or modified. The result can
+    be passed to selection and projection like a list of lists, and to_rows turns it into one.
+
+    :param t1: A table as denoted by a list of lists with the first list item representing the attributes in the form
+      of a list of strings.
+    :param t2: A table as denoted by a list of lists with the first list item representing the attributes in the form
+      of a list of strings.
+    :return: A ProductView. Otherwise, if no rows are in the table, None is returned
+    """
+    if len(t1) < 2 or len(t2) < 2:
+        return None
+    return ProductView(t1, t2)
+
+
+class ProductView(object):
+    """
+    The cross-product of two tables, indexed like a list of lists whose first item is the header.
+    """
+
+    def __init__(self, t1, t2):
+        self.left = t1
+        self.right = t2
+        self.header = list(t1[0]) + list(t2[0])
+        self.right_size = len(t2) - 1
+
+    def __len__(self):
+        return 1 + (len(self.left) - 1) * self.right_size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index == 0:
+            return self.header
+        if index < 0 or index >= len(self):
+            raise IndexError("ProductView index out of range")
+        left_index, right_index = divmod(index - 1, self.right_size)
+        return ProductRow(self.left[left_index + 1], self.right[right_index + 1])
+
+    def __iter__(self):
+        yield self.header
+        right_rows = self.right[1:]
+        for row in self.left[1:]:
+            for i in right_rows:
+                yield ProductRow(row, i)
+
+    def to_rows(self):
+        """
+        :return: the cross-product as a list of lists, as returned by cross_product
+        """
+        return [self.header] + [row + i for row in self.left[1:] for i in self.right[1:]]
+
+
+class ProductRow(object):
+    """
+    A row of a cross-product: the concatenation of a left and a right row, without copying either.
+    """
+    __slots__ = ("left", "right")
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+    def __len__(self):
+        return len(self.left) + len(self.right)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.to_list()[index]
+        split = len(self.left)
+        if index < 0:
+            index += split + len(self.right)
+        if index < 0:
+            raise IndexError("ProductRow index out of range")
+        if index < split:
+            return self.left[index]
+        return self.right[index - split]
+
+    def __iter__(self):
+        for value in self.left:
+            yield value
+        for value in self.right:
+            yield value
+
+    def __eq__(self, other):
+        if isinstance(other, (list, ProductRow)):
+            return self.to_list() == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __add__(self, other):
+        if isinstance(other, (list, ProductRow)):
+            return self.to_list() + list(other)
+        return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, list):
+            return other + self.to_list()
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self.to_list())
+
+    def to_list(self):
+        """
+        :return: the row as a new list
+        """
+        return self.left + self.right
+
+
+def materialize(t):
+    """
+    Turn a table whose rows may be views (such as ProductRow) into a list of lists.
+
+    :param t: A table such as a ProductView, or the result of selection or projection on one.
+    :return: A table in the form of a list of lists. None is returned unchanged.
+    """
+    if t is None:
+        return None
+    return [list(row) for row in t]
+
+
+def join(t1, t2, on, engine="auto"):
+    """
+    Perform an equi-join of tables t1 and t2 on the attribute(s) named in on. The result is the same as selecting,
+    from cross_product(t1, t2), the rows where the join attributes of both sides are equal, but it is computed in
+    linear time instead of materializing the whole product.
+
+    Example:
+    > R1 = [["Employee", "Department"], ["Smith", "sales"], ["Black", "production"]]
+    > R2 = [["Department", "Head"], ["production", "Mori"], ["sales", "Brown"]]
+    > join(R1, R2, "Department")
+    [["Employee", "Department", "Department", "Head"], ["Smith", "sales", "sales", "Brown"],
+     ["Black", "production", "production", "Mori"]]
+
+    :param t1: A table in the form of a list of lists with the first item being a list of strings denoting the
+      attribute names.
+    :param t2: A table in the same format as t1.
+    :param on: An attribute name, or a list of attribute names, present in both tables.
+    :param engine: "hash", "merge", or "auto" to merge tables that are both already sorted on the join attributes
+      (merge_join then needs no hash table and its sorts take linear time) and hash them otherwise; merge_join has to
+      copy and sort both tables, and fails on values that cannot be compared, where hash_join does not.
+    :return: A table (list of lists) with the attributes of t1 followed by those of t2. Otherwise, if no rows are in
+      the table, None is returned.
+    """
+    if engine == "auto":
+        key1, key2 = join_keys(t1, t2, on)
+        if sorted_on(t1, key1) and sorted_on(t2, key2):
+            engine = "merge"
+        else:
+            engine = "hash"
+
+    if engine == "hash":
+        return hash_join(t1, t2, on)
+    elif engine == "merge":
+        return merge_join(t1, t2, on)
+    else:
+        raise ValueError("Unknown join engine: " + str(engine))
+
+
+def hash_join(t1, t2, on):
+    """
+    Perform an equi-join of tables t1 and t2 by building a hash table on the smaller table and probing it with the
+    rows of the other one. See join.
+
+    :param t1: A table in the form of a list of lists with the first item being a list of strings denoting the
+      attribute names.
+    :param t2: A table in the same format as t1.
+    :param on: An attribute name, or a list of attribute names, present in both tables.
+    :return: A table (list of lists) with the attributes of t1 followed by those of t2. Otherwise, if no rows are in
+      the table, None is returned.
+    """
+    if len(t1) < 2 or len(t2) < 2:
+        return None
+    key1, key2 = join_keys(t1, t2, on)
+    new = [t1[0] + t2[0]]
+
+    if len(t1) <= len(t2):
+        buckets = {}
+        for row in t1[1:]:
+            buckets.setdefault(key1(row), []).append(row)
+        for row in t2[1:]:
+            for match in buckets.get(key2(row), ()):
+                new.append(match + row)
+    else:
+        buckets = {}
+        for row in t2[1:]:
+            buckets.setdefault(key2(row), []).append(row)
+        for row in t1[1:]:
+            for match in buckets.get(key1(row), ()):
+                new.append(row + match)
+
     if len(new) < 2:
         return None
+    return new
+
+
+def merge_join(t1, t2, on):
+    """
+    Perform an equi-join of tables t1 and t2 by sorting both tables on the join attributes and merging them. Values
+    of the join attributes must be comparable with each other. See join.
+
+    :param t1: A table in the form of a list of lists with the first item being a list of strings denoting the
+      attribute names.
+    :param t2: A table in the same format as t1.
+    :param on: An attribute name, or a list of attribute names, present in both tables.
+    :return: A table (list of lists) with the attributes of t1 followed by those of t2. Otherwise, if no rows are in
+      the table, None is returned.
+    """
+    if len(t1) < 2 or len(t2) < 2:
+        return None
+    key1, key2 = join_keys(t1, t2, on)
+    new = [t1[0] + t2[0]]
+
+    left = sorted(t1[1:], key=key1)
+    right = sorted(t2[1:], key=key2)
+    i = 0
+    j = 0
+    while i < len(left) and j < len(right):
+        left_key = key1(left[i])
+        right_key = key2(right[j])
+        if left_key < right_key:
+            i += 1
+        elif right_key < left_key:
+            j += 1
+        else:
+            # Find the run of equal keys on each side and output their product
+            i_end = i + 1
+            while i_end < len(left) and key1(left[i_end]) == left_key:
+                i_end += 1
+            j_end = j + 1
+            while j_end < len(right) and key2(right[j_end]) == right_key:
+                j_end += 1
+            for row in left[i:i_end]:
+                for match in right[j:j_end]:
+                    new.append(row + match)
+            i = i_end
+            j = j_end
 
+    if len(new) < 2:
+        return None
     return new
+
+
+def sorted_on(t, key):
+    """
+    :param t: A table in the form of a list of lists with the first item being a list of strings denoting the
+      attribute names.
+    :param key: a function taking a row of t and returning its join key, see join_keys
+    :return: True if the rows of t are sorted on key, False if they are not or the keys cannot be compared. Stops at
+      the first row out of order.
+    """
+    rows = islice(t, 1, None)
+    for row in rows:
+        previous = key(row)
+        break
+    else:
+        return True
+    try:
+        for row in rows:
+            current = key(row)
+            if current < previous:
+                return False
+            previous = current
+    except TypeError:
+        return False
+    return True
+
+
+def join_keys(t1, t2, on):
+    """
+    Build the functions extracting the join attributes from the rows of t1 and t2.
+
+    :param t1: A table in the form of a list of lists with the first item being a list of strings denoting the
+      attribute names.
+    :param t2: A table in the same format as t1.
+    :param on: An attribute name, or a list of attribute names, present in both tables.
+    :return: a pair of functions taking a row of t1 (respectively t2) and returning its join key.
+    """
+    if isinstance(on, str):
+        on = [on]
+    if len(on) == 0:
+        raise ValueError("No join attributes given")
+    for attr in on:
+        if attr not in t1[0] or attr not in t2[0]:
+            raise UnknownAttributeException
+
+    return itemgetter(*[t1[0].index(attr) for attr in on]), itemgetter(*[t2[0].index(attr) for attr in on])
+
+
+####################
+# COLUMNAR TABLES ##
+####################
+class Table(object):
+    """
+    A table stored column by column instead of row by row. Numeric columns (all ints within int64 range, or all
+    floats) are typed arrays: NumPy arrays when NumPy is installed, array.array otherwise. Other columns are lists.
+
+    Example:
+    > t = Table.from_rows(EMPLOYEES)
+    > t.project(["Surname", "Age"]).to_rows()
+    [["Surname", "Age"], ["Smith", 25], ["Black", 40], ["Verdi", 36], ["Smith", 40]]
+    > t.select((t["Age"] >= 30) & (t["Salary"] > 3500)).to_rows()   # with NumPy
+    [["Surname", "FirstName", "Age", "Salary"], ["Verdi", "Nico", 36, 4500], ["Smith", "Mark", 40, 3900]]
+    """
+
+    def __init__(self, attributes, columns):
+        """
+        :param attributes: A list of strings denoting the attribute names.
+        :param columns: A list with one column (a sequence of values) per attribute, all of the same length.
+        """
+        self.attributes = list(attributes)
+        self.columns = list(columns)
+
+    @classmethod
+    def from_rows(cls, t):
+        """
+        Convert a table in the form of a list of lists to a Table.
+
+        :param t: A table in the form of a list of lists with the first item being a list of strings denoting the
+          attribute names.
+        :return: A Table
+        """
+        attributes = t[0]
+        columns = []
+        for index in range(len(attributes)):
+            columns.append(make_column([row[index] for row in t[1:]]))
+        return cls(attributes, columns)
+
+    def to_rows(self):
+        """
+        Convert the Table back to a list of lists.
+
+        :return: A table in the form of a list of lists with the first item being a list of strings denoting the
+          attribute names.
+        """
+        columns = [column_values(column) for column in self.columns]
+        return [list(self.attributes)] + [list(row) for row in zip(*columns)]
+
+    def __len__(self):
+        """
+        :return: the number of rows
+        """
+        if len(self.columns) == 0:
+            return 0
+        return len(self.columns[0])
+
+    def __getitem__(self, attr):
+        """
+        :param attr: an attribute name
+        :return: the column of that attribute
+        """
+        if attr not in self.attributes:
+            raise UnknownAttributeException
+        return self.columns[self.attributes.index(attr)]
+
+    def project(self, r):
+        """
+        Perform projection using the attributes subset r. The columns are shared with this table, not copied.
+
+        :param r: A list of attributes denoted by a list of strings.
+        :return: A Table. Otherwise, if no attributes are given or the table is empty, None is returned.
+        """
+        if r == [] or len(self) == 0:
+            return None
+        attributes = []
+        for attr in r:
+            if attr not in self.attributes:
+                raise UnknownAttributeException
+            if attr not in attributes:
+                attributes.append(attr)
+        return Table(attributes, [self[attr] for attr in attributes])
+
+    def select(self, mask):
+        """
+        Perform select operation with a vectorized predicate.
+
+        :param mask: A sequence of booleans, one per row, or a function that takes this Table and returns one
+          (e.g. lambda t: t["Age"] >= 30 when NumPy is installed).
+        :return: A Table with only those rows whose mask value is True. Otherwise, if the resulting table is empty,
+          None is returned.
+        """
+        if callable(mask):
+            mask = mask(self)
+        if numpy is not None:
+            mask = numpy.asarray(mask, dtype=bool)
+            if not mask.any():
+                return None
+            columns = [select_column(column, mask) for column in self.columns]
+        else:
+            keep = [index for index, value in enumerate(mask) if value]
+            if len(keep) == 0:
+                return None
+            columns = [select_column(column, keep) for column in self.columns]
+        return Table(self.attributes, columns)
+
+
+def make_column(values):
+    """
+    Store the values of a column in the most compact form available.
+
+    :param values: a list
+    :return: a typed array for numeric values, the list itself otherwise
+    """
+    if len(values) == 0:
+        return values
+    kinds = set(type(value) for value in values)
+    if kinds == set([int]) and -2 ** 63 <= min(values) and max(values) < 2 ** 63:
+        typecode = "q"
+    elif kinds == set([float]):
+        typecode = "d"
+    else:
+        # Mixed ints and floats, or ints out of int64 range, would not convert back to the same values
+        return values
+    if numpy is not None:
+        return numpy.array(values, dtype={"q": numpy.int64, "d": numpy.float64}[typecode])
+    return array(typecode, values)
+
+
+def column_values(column):
+    """
+    :param column: a column of a Table
+    :return: the values of the column as a list of Python objects
+    """
+    if isinstance(column, list):
+        return column
+    return column.tolist()
+
+
+def select_column(column, keep):
+    """
+    Pick some of the rows of a column.
+
+    :param column: a column of a Table
+    :param keep: a NumPy boolean mask, or (without NumPy) a list of the row indices to keep
+    :return: a column of the same kind with only the kept rows
+    """
+    if isinstance(column, DictionaryColumn):
+        return column.select(keep)
+    if numpy is not None:
+        if isinstance(column, list):
+            return [value for value, selected in zip(column, keep) if selected]
+        return column[keep]
+    if isinstance(column, list):
+        return [column[index] for index in keep]
+    if isinstance(column, memoryview):
+        return array(column.format, [column[index] for index in keep])
+    return array(column.typecode, [column[index] for index in keep])
+
+
+#################
+# QUERY PLANS ##
+#################
+def query(t):
+    """
+    Start a lazy query on table t. Operators called on the query only record a plan; nothing is computed until
+    run is called, at which point selections are pushed below products and joins, columns that are not needed are
+    dropped early, and rows are streamed through generators.
+
+    Example:
+    > q = query(R1).product(R2).select(lambda a, b: a == b, on=["Department", "Head"]).project(["Employee"])
+    > q.run()
+    > print(q.explain())
+
+    :param t: A table in the form of a list of lists with the first item being a list of strings denoting the
+      attribute names.
+    :return: A Query
+    """
+    return Query(ScanNode(t))
+
+
+class Query(object):
+    """
+    A lazily evaluated query. Every operator returns a new Query; the original is left unchanged.
+    """
+
+    def __init__(self, node):
+        """
+        :param node: the root node of the plan
+        """
+        self.node = node
+
+    def select(self, f, on=None):
+        """
+        Record a select operation. Without on, f takes a whole row like the function given to selection, and the
+        selection stays where it is in the plan. With on, f takes the values of the listed attributes as arguments,
+        which lets the selection be pushed down to the input holding those attributes.
+
+        :param f: A function returning a boolean.
+        :param on: An optional list of the attribute names whose values are passed to f.
+        :return: A Query
+        """
+        return Query(SelectNode(self.node, f, on))
+
+    def project(self, r):
+        """
+        Record a projection on the attributes subset r.
+
+        :param r: A list of attributes denoted by a list of strings.
+        :return: A Query
+        """
+        return Query(ProjectNode(self.node, r))
+
+    def product(self, other):
+        """
+        Record a cross-product with another table or query.
+
+        :param other: A table (list of lists) or a Query
+        :return: A Query
+        """
+        return Query(ProductNode(self.node, as_node(other)))
+
+    def join(self, other, on):
+        """
+        Record an equi-join with another table or query. See join.
+
+        :param other: A table (list of lists) or a Query
+        :param on: An attribute name, or a list of attribute names, present in both inputs.
+        :return: A Query
+        """
+        return Query(JoinNode(self.node, as_node(other), on))
+
+    def optimize(self):
+        """
+        :return: a pair (root node of the rewritten plan, list of strings describing each rewrite)
+        """
+        log = []
+        node = push_selections(self.node, log)
+        node = prune_columns(node, None, log)
+        return node, log
+
+    def run(self):
+        """
+        Evaluate the query.
+
+        :return: A table (list of lists) with the first list depicting the attributes of the table. Otherwise, if the
+          result has no rows or no attributes, None is returned.
+        """
+        node = self.optimize()[0]
+        if len(node.attributes) == 0:
+            return None
+        new = [list(node.attributes)]
+        new.extend(node.rows())
+        if len(new) < 2:
+            return None
+        return new
+
+    def explain(self):
+        """
+        :return: A string showing the rewrites applied to the plan and the plan that run evaluates.
+        """
+        node, log = self.optimize()
+        lines = ["Rewrites:"]
+        if len(log) == 0:
+            lines.append("  (none)")
+        for entry in log:
+            lines.append("  " + entry)
+        lines.append("Plan:")
+        lines.extend(node.describe(1))
+        return "\n".join(lines)
+
+
+def as_node(t):
+    """
+    :param t: A table (list of lists) or a Query
+    :return: the plan node of the query, or a scan of the table
+    """
+    if isinstance(t, Query):
+        return t.node
+    return ScanNode(t)
+
+
+class PlanNode(object):
+    """
+    A node of a query plan. attributes lists the names of the columns of the rows produced by rows().
+    """
+    attributes = []
+    children = ()
+
+    def rows(self):
+        """
+        :return: a generator of rows (lists), without the header
+        """
+        raise NotImplementedError
+
+    def label(self):
+        """
+        :return: a one line description of the node
+        """
+        raise NotImplementedError
+
+    def describe(self, depth=0):
+        """
+        :return: a list of lines describing the subtree rooted at this node
+        """
+        lines = ["  " * depth + self.label()]
+        for child in self.children:
+            lines.extend(child.describe(depth + 1))
+        return lines
+
+
+class ScanNode(PlanNode):
+    """
+    Reads the rows of a table.
+    """
+
+    def __init__(self, t):
+        self.table = t
+        if len(t) > 0:
+            self.attributes = list(t[0])
+
+    def rows(self):
+        for row in self.table[1:]:
+            yield row
+
+    def label(self):
+        return "scan[" + ", ".join(self.attributes) + "] (" + str(max(len(self.table) - 1, 0)) + " rows)"
+
+
+class SelectNode(PlanNode):
+    """
+    Keeps the rows for which a predicate returns True.
+    """
+
+    def __init__(self, child, f, on=None):
+        if on is not None:
+            for attr in on:
+                if attr not in child.attributes:
+                    raise UnknownAttributeException
+            on = list(on)
+        self.child = child
+        self.children = (child,)
+        self.f = f
+        self.on = on
+        self.attributes = child.attributes
+
+    def rows(self):
+        f = self.f
+        if self.on is None:
+            for row in self.child.rows():
+                if f(row) is True:
+                    yield row
+        else:
+            indexes = [self.attributes.index(attr) for attr in self.on]
+            for row in self.child.rows():
+                if f(*[row[index] for index in indexes]) is True:
+                    yield row
+
+    def label(self):
+        if self.on is None:
+            return "select[row]"
+        return "select[" + ", ".join(self.on) + "]"
+
+
+class ProjectNode(PlanNode):
+    """
+    Keeps some of the columns. Repeated attributes are only kept once, as in projection.
+    """
+
+    def __init__(self, child, r, pruning=False):
+        attributes = []
+        for attr in r:
+            if attr not in child.attributes:
+                raise UnknownAttributeException
+            if attr not in attributes:
+                attributes.append(attr)
+        self.child = child
+        self.children = (child,)
+        self.attributes = attributes
+        self.pruning = pruning
+
+    def rows(self):
+        indexes = [self.child.attributes.index(attr) for attr in self.attributes]
+        for row in self.child.rows():
+            yield [row[index] for index in indexes]
+
+    def label(self):
+        if self.pruning:
+            return "prune[" + ", ".join(self.attributes) + "]"
+        return "project[" + ", ".join(self.attributes) + "]"
+
+
+class ProductNode(PlanNode):
+    """
+    Cross-product of two inputs. The right input is materialized, the left one is streamed.
+    """
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.children = (left, right)
+        self.attributes = left.attributes + right.attributes
+
+    def with_children(self, left, right):
+        return ProductNode(left, right)
+
+    def rows(self):
+        right_rows = list(self.right.rows())
+        for row in self.left.rows():
+            for i in right_rows:
+                yield row + i
+
+    def label(self):
+        return "product"
+
+
+class JoinNode(ProductNode):
+    """
+    Equi-join of two inputs: a hash table is built on the right input and probed with the streamed left rows.
+    """
+
+    def __init__(self, left, right, on):
+        ProductNode.__init__(self, left, right)
+        if isinstance(on, str):
+            on = [on]
+        for attr in on:
+            if attr not in left.attributes or attr not in right.attributes:
+                raise UnknownAttributeException
+        self.on = list(on)
+
+    def with_children(self, left, right):
+        return JoinNode(left, right, self.on)
+
+    def rows(self):
+        left_key = itemgetter(*[self.left.attributes.index(attr) for attr in self.on])
+        right_key = itemgetter(*[self.right.attributes.index(attr) for attr in self.on])
+        buckets = {}
+        for i in self.right.rows():
+            buckets.setdefault(right_key(i), []).append(i)
+        for row in self.left.rows():
+            for i in buckets.get(left_key(row), ()):
+                yield row + i
+
+    def label(self):
+        return "join[" + ", ".join(self.on) + "]"
+
+
+def push_selections(node, log):
+    """
+    Rewrite a plan so that every selection naming its attributes sits as close to the scans as possible.
+
+    :param node: root of the plan
+    :param log: list to which a description of each rewrite is appended
+    :return: root of the rewritten plan
+    """
+    if isinstance(node, SelectNode):
+        return push_select(SelectNode(push_selections(node.child, log), node.f, node.on), log)
+    elif isinstance(node, ProjectNode):
+        return ProjectNode(push_selections(node.child, log), node.attributes, node.pruning)
+    elif isinstance(node, ProductNode):
+        return node.with_children(push_selections(node.left, log), push_selections(node.right, log))
+    return node
+
+
+def push_select(node, log):
+    """
+    Move a selection below its child when the child allows it.
+
+    :param node: a SelectNode whose subtree has already been rewritten
+    :param log: list to which a description of each rewrite is appended
+    :return: the rewritten subtree
+    """
+    if node.on is None:
+        return node
+    child = node.child
+    if isinstance(child, ProductNode):
+        # Attribute names resolve to their first occurrence, which is on the left whenever the left has them
+        if all(attr in child.left.attributes for attr in node.on):
+            log.append(node.label() + " pushed into left input of " + child.label())
+            return child.with_children(push_select(SelectNode(child.left, node.f, node.on), log), child.right)
+        if all(attr not in child.left.attributes for attr in node.on):
+            log.append(node.label() + " pushed into right input of " + child.label())
+            return child.with_children(child.left, push_select(SelectNode(child.right, node.f, node.on), log))
+    elif isinstance(child, ProjectNode):
+        return ProjectNode(push_select(SelectNode(child.child, node.f, node.on), log), child.attributes,
+                           child.pruning)
+    elif isinstance(child, SelectNode):
+        pushed = push_select(SelectNode(child.child, node.f, node.on), log)
+        if not (isinstance(pushed, SelectNode) and pushed.child is child.child):
+            return SelectNode(pushed, child.f, child.on)
+    return node
+
+
+def prune_columns(node, required, log):
+    """
+    Rewrite a plan so that the inputs of products and joins only carry the columns used above them.
+
+    :param node: root of the plan
+    :param required: set of attribute names used above node, or None if every column is used
+    :param log: list to which a description of each rewrite is appended
+    :return: root of the rewritten plan
+    """
+    if isinstance(node, SelectNode):
+        if node.on is None or required is None:
+            child_required = None
+        else:
+            child_required = required | set(node.on)
+        return SelectNode(prune_columns(node.child, child_required, log), node.f, node.on)
+    elif isinstance(node, ProjectNode):
+        return ProjectNode(prune_columns(node.child, set(node.attributes), log), node.attributes, node.pruning)
+    elif isinstance(node, ProductNode):
+        left_required = right_required = required
+        if required is not None:
+            # Above the product, a name shared by both inputs always refers to the left column
+            right_required = required - set(node.left.attributes)
+            if isinstance(node, JoinNode):
+                left_required = required | set(node.on)
+                right_required = right_required | set(node.on)
+        left = prune_input(node.left, left_required, "left input of " + node.label(), log)
+        right = prune_input(node.right, right_required, "right input of " + node.label(), log)
+        return node.with_children(left, right)
+    return node
+
+
+def prune_input(node, required, name, log):
+    """
+    Drop the columns of an input of a product or join that are not required.
+
+    :param node: an input of a product or join
+    :param required: set of attribute names used above the product, or None if every column is used
+    :param name: description of the input, for the log
+    :param log: list to which a description of each rewrite is appended
+    :return: the rewritten input
+    """
+    if required is None:
+        return prune_columns(node, None, log)
+    kept = [attr for attr in node.attributes if attr in required]
+    node = prune_columns(node, set(kept), log)
+    if len(set(kept)) < len(node.attributes):
+        dropped = [attr for attr in node.attributes if attr not in kept]
+        if len(dropped) == 0:
+            dropped = ["repeated " + ", ".join(kept)]
+        log.append("dropped columns " + ", ".join(dropped) + " from " + name)
+        node = ProjectNode(node, kept, pruning=True)
+    return node
+
+
+####################
+# SET OPERATIONS ##
+####################
+def union(t1, t2):
+    """
+    Return the rows that are in t1 or in t2, without duplicates.
+
+    Example:
+    > union([["A", "B"], [1, 2]], [["A", "B"], [1, 2], [3, 4]])
+    [["A", "B"], [1, 2], [3, 4]]
+
+    :param t1: A table in the form of a list of lists with the first item being a list of strings denoting the
+      attribute names.
+    :param t2: A table with the same attributes as t1, possibly in a different order.
+    :return: A table with the attributes of t1. Otherwise, if the resulting table is empty, None is returned.
+    """
+    return set_operation(t1, t2, "union")
+
+
+def intersection(t1, t2):
+    """
+    Return the rows that are in both t1 and t2, without duplicates.
+
+    :param t1: A table in the form of a list of lists with the first item being a list of strings denoting the
+      attribute names.
+    :param t2: A table with the same attributes as t1, possibly in a different order.
+    :return: A table with the attributes of t1. Otherwise, if the resulting table is empty, None is returned.
+    """
+    return set_operation(t1, t2, "intersection")
+
+
+def difference(t1, t2):
+    """
+    Return the rows that are in t1 but not in t2, without duplicates.
+
+    :param t1: A table in the form of a list of lists with the first item being a list of strings denoting the
+      attribute names.
+    :param t2: A table with the same attributes as t1, possibly in a different order.
+    :return: A table with the attributes of t1. Otherwise, if the resulting table is empty, None is returned.
+    """
+    return set_operation(t1, t2, "difference")
+
+
+def set_operation(t1, t2, operation):
+    """
+    Perform union, intersection or difference on two tables held in memory, using a hash set of the rows. Rows come
+    out in the order they first appear in t1, then t2.
+
+    :param t1: A table in the form of a list of lists with the first item being a list of strings denoting the
+      attribute names.
+    :param t2: A table with the same attributes as t1, possibly in a different order.
+    :param operation: "union", "intersection" or "difference"
+    :return: A table with the attributes of t1. Otherwise, if the resulting table is empty, None is returned.
+    """
+    if len(t1) < 1 or len(t2) < 1:
+        raise IncompatibleSchemaException
+    reorder = compatible_columns(t1[0], t2[0])
+    new = [t1[0]]
+    for row in hashed_set_operation(t1[1:], reorder_rows(t2[1:], reorder), operation):
+        new.append(row)
+    if len(new) < 2:
+        return None
+    return new
+
+
+def iter_union(t1, t2, partitions=SPILL_PARTITIONS):
+    """
+    Streaming union for tables larger than memory. See iter_set_operation.
+    """
+    return iter_set_operation(t1, t2, "union", partitions)
+
+
+def iter_intersection(t1, t2, partitions=SPILL_PARTITIONS):
+    """
+    Streaming intersection for tables larger than memory. See iter_set_operation.
+    """
+    return iter_set_operation(t1, t2, "intersection", partitions)
+
+
+def iter_difference(t1, t2, partitions=SPILL_PARTITIONS):
+    """
+    Streaming difference for tables larger than memory. See iter_set_operation.
+    """
+    return iter_set_operation(t1, t2, "difference", partitions)
+
+
+def iter_set_operation(t1, t2, operation, partitions=SPILL_PARTITIONS):
+    """
+    Perform union, intersection or difference on two tables given as iterables of rows, for inputs larger than
+    memory. Both inputs are first spread over temporary files by the hash of each row, so equal rows land in the
+    same partition; each pair of partitions is then combined in memory. Only one partition is held in memory at a
+    time. Rows come out grouped by partition, not in input order.
+
+    :param t1: An iterable of rows whose first item is a list of strings denoting the attribute names.
+    :param t2: An iterable of rows with the same attributes as t1, possibly in a different order.
+    :param operation: "union", "intersection" or "difference"
+    :param partitions: number of temporary files per input
+    :return: A generator yielding the attributes of t1 followed by the rows of the result.
+    """
+    rows1 = iter(t1)
+    rows2 = iter(t2)
+    header1 = next(rows1, None)
+    header2 = next(rows2, None)
+    if header1 is None or header2 is None:
+        raise IncompatibleSchemaException
+    reorder = compatible_columns(header1, header2)
+    yield header1
+
+    with tempfile.TemporaryDirectory() as directory:
+        files1 = spill_partitions(rows1, partitions, os.path.join(directory, "left"))
+        files2 = spill_partitions(reorder_rows(rows2, reorder), partitions, os.path.join(directory, "right"))
+        for file1, file2 in zip(files1, files2):
+            for row in hashed_set_operation(read_spilled(file1), read_spilled(file2), operation):
+                yield row
+
+
+def hashed_set_operation(rows1, rows2, operation):
+    """
+    :param rows1: an iterable of rows
+    :param rows2: an iterable of rows, with the same attributes in the same order as rows1
+    :param operation: "union", "intersection" or "difference"
+    :return: a generator of the distinct rows of the result
+    """
+    if operation == "union":
+        seen = set()
+        for rows in (rows1, rows2):
+            for row in rows:
+                key = tuple(row)
+                if key not in seen:
+                    seen.add(key)
+                    yield row
+    elif operation in ("intersection", "difference"):
+        keep = operation == "intersection"
+        other = set(tuple(row) for row in rows2)
+        seen = set()
+        for row in rows1:
+            key = tuple(row)
+            if key not in seen and (key in other) == keep:
+                seen.add(key)
+                yield row
+    else:
+        raise ValueError("Unknown set operation: " + str(operation))
+
+
+def compatible_columns(attributes1, attributes2):
+    """
+    Check that two tables have the same attributes.
+
+    :param attributes1: the attribute names of the first table
+    :param attributes2: the attribute names of the second table
+    :return: None if the attributes are in the same order, otherwise the position in the second table of each
+      attribute of the first one.
+    :raises IncompatibleSchemaException: if the tables do not have the same attributes
+    """
+    if list(attributes1) == list(attributes2):
+        return None
+    if sorted(attributes1) != sorted(attributes2) or len(set(attributes1)) != len(attributes1):
+        raise IncompatibleSchemaException
+    return [list(attributes2).index(attr) for attr in attributes1]
+
+
+def reorder_rows(rows, reorder):
+    """
+    :param rows: an iterable of rows
+    :param reorder: None, or the position of each output column in the rows
+    :return: an iterable of rows with their columns in the order given by reorder
+    """
+    if reorder is None:
+        return rows
+    return ([row[index] for index in reorder] for row in rows)
+
+
+def spill_partitions(rows, partitions, prefix):
+    """
+    Write rows to temporary files, choosing the file of each row from its hash.
+
+    :param rows: an iterable of rows
+    :param partitions: number of files
+    :param prefix: path prefix of the files
+    :return: list of the file names
+    """
+    names = [prefix + "." + str(number) for number in range(partitions)]
+    files = [open(name, "wb") for name in names]
+    try:
+        for row in rows:
+            pickle.dump(row, files[hash(tuple(row)) % partitions], pickle.HIGHEST_PROTOCOL)
+    finally:
+        for spill_file in files:
+            spill_file.close()
+    return names
+
+
+def read_spilled(name):
+    """
+    :param name: name of a file written by spill_partitions
+    :return: a generator of the rows in the file
+    """
+    with open(name, "rb") as spill_file:
+        while True:
+            try:
+                yield pickle.load(spill_file)
+            except EOFError:
+                return
+
+
+##############
+# GROUP BY ##
+##############
+def group_by(t, keys, aggregates):
+    """
+    Group the rows of table t by the attribute(s) in keys and compute aggregates over each group, in a single pass
+    using a hash table of the groups. Groups come out in the order they first appear in t.
+
+    Example:
+    > group_by(EMPLOYEES, "Surname", [("avg", "Salary"), ("count", "*")])
+    [["Surname", "avg(Salary)", "count(*)"], ["Smith", 2950.0, 2], ["Black", 3000.0, 1], ["Verdi", 4500.0, 1]]
+
+    :param t: A table in the form of a list of lists with the first item being a list of strings denoting the
+      attribute names.
+    :param keys: An attribute name, or a list of attribute names, to group by; an empty list puts every row in one
+      group.
+    :param aggregates: A list of (function, attribute) pairs, where function is one of AGGREGATES; "*" stands for
+      the whole row in ("count", "*").
+    :return: A table with the key attributes followed by one attribute per aggregate, e.g. "avg(Salary)", and one row
+      per group. Otherwise, if the table has no rows, None is returned.
+    """
+    if len(t) < 2:
+        return None
+    header, key, columns = aggregate_plan(t[0], keys, aggregates)
+    groups = {}
+    hash_aggregate(iter(t[1:]), key, columns, groups)
+    return [header] + [group_row(group, states, columns) for group, states in groups.items()]
+
+
+def iter_group_by(t, keys, aggregates, max_groups=GROUP_BY_MAX_GROUPS, partitions=SPILL_PARTITIONS):
+    """
+    Streaming group_by, for inputs with more groups than fit in memory. Rows are aggregated in a hash table as in
+    group_by; whenever it holds max_groups groups, their partial aggregates are written to temporary files, chosen by
+    the hash of the group, and the table is emptied. Each file is then read back in turn and its partial aggregates
+    combined, so only about max_groups groups (per file) are held in memory at a time. Without spilling, groups come
+    out in the order they first appear; otherwise they come out grouped by file.
+
+    :param t: An iterable of rows whose first item is a list of strings denoting the attribute names.
+    :param keys: An attribute name, or a list of attribute names, to group by.
+    :param aggregates: A list of (function, attribute) pairs. See group_by.
+    :param max_groups: number of groups held in memory before spilling
+    :param partitions: number of temporary files
+    :return: A generator yielding the attributes of the result followed by one row per group.
+    """
+    rows = iter(t)
+    attributes = next(rows, None)
+    if attributes is None:
+        return
+    header, key, columns = aggregate_plan(attributes, keys, aggregates)
+    yield header
+
+    groups = {}
+    if not hash_aggregate(rows, key, columns, groups, max_groups):
+        for group, states in groups.items():
+            yield group_row(group, states, columns)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        names = [os.path.join(directory, "groups." + str(number)) for number in range(partitions)]
+        files = [open(name, "wb") for name in names]
+        try:
+            more = True
+            while more:
+                for group, states in groups.items():
+                    pickle.dump((group, states), files[hash(group) % partitions], pickle.HIGHEST_PROTOCOL)
+                groups = {}
+                more = hash_aggregate(rows, key, columns, groups, max_groups)
+            for group, states in groups.items():
+                pickle.dump((group, states), files[hash(group) % partitions], pickle.HIGHEST_PROTOCOL)
+        finally:
+            for spill_file in files:
+                spill_file.close()
+
+        for name in names:
+            groups = {}
+            for group, states in read_spilled(name):
+                if group in groups:
+                    groups[group] = [aggregate_combine(function, state, other) for (function, _), state, other
+                                     in zip(columns, groups[group], states)]
+                else:
+                    groups[group] = states
+            for group, states in groups.items():
+                yield group_row(group, states, columns)
+
+
+def aggregate_plan(attributes, keys, aggregates):
+    """
+    Check the attributes of group_by.
+
+    :param attributes: the attribute names of the table
+    :param keys: An attribute name, or a list of attribute names, to group by.
+    :param aggregates: A list of (function, attribute) pairs.
+    :return: (header, key, columns): the attributes of the result, a function taking a row and returning its group
+      as a tuple, and the (function, position) of each aggregate (position is None for "*").
+    """
+    if isinstance(keys, str):
+        keys = [keys]
+    attributes = list(attributes)
+    for attr in keys:
+        if attr not in attributes:
+            raise UnknownAttributeException
+    positions = [attributes.index(attr) for attr in keys]
+
+    header = list(keys)
+    columns = []
+    for function, attr in aggregates:
+        if function not in AGGREGATES:
+            raise ValueError("Unknown aggregate function: " + str(function))
+        if attr == "*" and function == "count":
+            position = None
+        elif attr in attributes:
+            position = attributes.index(attr)
+        else:
+            raise UnknownAttributeException
+        header.append(function + "(" + attr + ")")
+        columns.append((function, position))
+
+    if len(positions) > 1:
+        key = itemgetter(*positions)
+    elif len(positions) == 1:
+        position = positions[0]
+
+        def key(row):
+            return row[position],
+    else:
+        def key(row):
+            return ()
+    return header, key, columns
+
+
+def hash_aggregate(rows, key, columns, groups, max_groups=None):
+    """
+    Add rows to a hash table of partial aggregates.
+
+    :param rows: an iterator of rows
+    :param key: a function taking a row and returning its group
+    :param columns: the (function, position) of each aggregate
+    :param groups: a dictionary mapping each group to the list of its aggregates' states; updated in place
+    :param max_groups: stop after the row creating this many groups; None to read every row
+    :return: True if it stopped before the end of rows, False otherwise
+    """
+    for row in rows:
+        group = key(row)
+        states = groups.get(group)
+        if states is None:
+            groups[group] = [aggregate_start(function, row, position) for function, position in columns]
+            if max_groups is not None and len(groups) >= max_groups:
+                return True
+        else:
+            for index, (function, position) in enumerate(columns):
+                states[index] = aggregate_update(function, states[index], row, position)
+    return False
+
+
+def aggregate_start(function, row, position):
+    """
+    :return: the state of an aggregate over a group holding only row
+    """
+    if function == "count":
+        return 1
+    if function == "avg":
+        return [row[position], 1]
+    return row[position]
+
+
+def aggregate_update(function, state, row, position):
+    """
+    :return: the state of an aggregate after adding row to its group
+    """
+    if function == "count":
+        return state + 1
+    value = row[position]
+    if function == "sum":
+        return state + value
+    if function == "min":
+        return value if value < state else state
+    if function == "max":
+        return value if state < value else state
+    state[0] += value
+    state[1] += 1
+    return state
+
+
+def aggregate_combine(function, state, other):
+    """
+    :return: the state of an aggregate over the union of two parts of a group, given the state of each part
+    """
+    if function in ("count", "sum"):
+        return state + other
+    if function == "min":
+        return other if other < state else state
+    if function == "max":
+        return other if state < other else state
+    return [state[0] + other[0], state[1] + other[1]]
+
+
+def group_row(group, states, columns):
+    """
+    :return: the row of the result of group_by for a group
+    """
+    row = list(group)
+    for (function, position), state in zip(columns, states):
+        if function == "avg":
+            row.append(state[0] / state[1])
+        else:
+            row.append(state)
+    return row
+
+
+#############
+# SORTING ##
+#############
+def order_by(t, attrs, descending=False):
+    """
+    Sort the rows of table t by the attribute(s) in attrs, keeping the header first. The sort is stable: rows with
+    equal values keep the order they have in t.
+
+    Example:
+    > order_by(EMPLOYEES, ["Age", "Surname"], descending=[True, False])
+    [["Surname", "FirstName", "Age", "Salary"], ["Black", "Lucy", 40, 3000], ["Smith", "Mark", 40, 3900],
+     ["Verdi", "Nico", 36, 4500], ["Smith", "Mary", 25, 2000]]
+
+    :param t: A table in the form of a list of lists with the first item being a list of strings denoting the
+      attribute names.
+    :param attrs: An attribute name, or a list of attribute names; rows are ordered by the first one, then by the
+      second one, and so on.
+    :param descending: True to sort in descending order, or a list with one boolean per attribute in attrs.
+    :return: A table with the rows of t in order. Otherwise, if the table has no rows, None is returned.
+    """
+    if len(t) < 2:
+        return None
+    key, reverse = sort_key(t[0], attrs, descending)
+    return [t[0]] + sorted(t[1:], key=key, reverse=reverse)
+
+
+def top_k(t, attrs, k, descending=True):
+    """
+    Return the first k rows of t ordered by attrs, the same rows as order_by(t, attrs, descending)[:k + 1]. Only
+    the best k rows seen so far are kept, in a heap, so t can be a stream of rows larger than memory.
+
+    Example:
+    > top_k(EMPLOYEES, "Salary", 2)
+    [["Surname", "FirstName", "Age", "Salary"], ["Verdi", "Nico", 36, 4500], ["Smith", "Mark", 40, 3900]]
+
+    :param t: An iterable of rows whose first item is a list of strings denoting the attribute names, such as a
+      table.
+    :param attrs: An attribute name, or a list of attribute names. See order_by.
+    :param k: number of rows to return
+    :param descending: True (the default) for the rows with the largest values, or a list with one boolean per
+      attribute in attrs.
+    :return: A table with at most k rows, in order. Otherwise, if the table has no rows, None is returned.
+    """
+    rows = iter(t)
+    header = next(rows, None)
+    if header is None:
+        return None
+    key, reverse = sort_key(header, attrs, descending)
+    if reverse:
+        best = heapq.nlargest(k, rows, key=key)
+    else:
+        best = heapq.nsmallest(k, rows, key=key)
+    if len(best) == 0:
+        return None
+    return [header] + best
+
+
+def iter_order_by(t, attrs, descending=False, run_size=SORT_RUN_ROWS, fan_in=SORT_MERGE_FAN_IN):
+    """
+    External merge sort, for tables larger than memory. Rows are read run_size at a time; each run is sorted in
+    memory and, unless the whole table fits in one run, written to a temporary file. The runs are then merged,
+    fan_in at a time, so that at most run_size rows plus one row per open run are held in memory. The order is the
+    same as that of order_by.
+
+    :param t: An iterable of rows whose first item is a list of strings denoting the attribute names.
+    :param attrs: An attribute name, or a list of attribute names. See order_by.
+    :param descending: True to sort in descending order, or a list with one boolean per attribute in attrs.
+    :param run_size: number of rows sorted in memory at a time
+    :param fan_in: maximum number of runs merged at a time
+    :return: A generator yielding the attributes of t followed by its rows in order.
+    """
+    rows = iter(t)
+    header = next(rows, None)
+    if header is None:
+        return
+    key, reverse = sort_key(header, attrs, descending)
+    yield header
+
+    run = sorted(islice(rows, run_size), key=key, reverse=reverse)
+    if len(run) < run_size:
+        for row in run:
+            yield row
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        names = []
+        while run:
+            names.append(spill_run(run, os.path.join(directory, "run." + str(len(names)))))
+            run = sorted(islice(rows, run_size), key=key, reverse=reverse)
+
+        count = len(names)
+        while len(names) > fan_in:
+            merged = []
+            for start in range(0, len(names), fan_in):
+                group = names[start:start + fan_in]
+                name = os.path.join(directory, "run." + str(count))
+                count += 1
+                merged.append(spill_run(merge_runs(group, key, reverse), name))
+                for run_name in group:
+                    os.remove(run_name)
+            names = merged
+
+        for row in merge_runs(names, key, reverse):
+            yield row
+
+
+def sort_key(attributes, attrs, descending):
+    """
+    Build the sort key of order_by, top_k and iter_order_by.
+
+    :param attributes: the attribute names of the table
+    :param attrs: An attribute name, or a list of attribute names, to sort by.
+    :param descending: a boolean, or a list with one boolean per attribute in attrs
+    :return: a pair (key, reverse): a function taking a row and returning its sort key, and whether to sort in
+      reverse order.
+    """
+    if isinstance(attrs, str):
+        attrs = [attrs]
+    if len(attrs) == 0:
+        raise ValueError("No sort attributes given")
+    for attr in attrs:
+        if attr not in attributes:
+            raise UnknownAttributeException
+    positions = [list(attributes).index(attr) for attr in attrs]
+
+    if isinstance(descending, bool):
+        return itemgetter(*positions), descending
+    descending = [bool(value) for value in descending]
+    if len(descending) != len(positions):
+        raise ValueError("Expected one descending value per sort attribute")
+    if len(set(descending)) == 1:
+        return itemgetter(*positions), descending[0]
+
+    directions = list(zip(positions, descending))
+
+    def key(row):
+        return tuple(Descending(row[index]) if reverse else row[index] for index, reverse in directions)
+    return key, False
+
+
+class Descending(object):
+    """
+    Wraps a value so that it sorts in reverse order, for sort keys mixing ascending and descending attributes.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    __hash__ = None
+
+
+def spill_run(rows, name):
+    """
+    Write sorted rows to a temporary file, to be read back with read_spilled.
+
+    :param rows: an iterable of rows
+    :param name: name of the file
+    :return: name
+    """
+    with open(name, "wb") as run_file:
+        for row in rows:
+            pickle.dump(row, run_file, pickle.HIGHEST_PROTOCOL)
+    return name
+
+
+def merge_runs(names, key, reverse):
+    """
+    :param names: names of files written by spill_run, each sorted by key; ties are kept in the order of the files
+    :param key: the sort key
+    :param reverse: True if the files are sorted in reverse order
+    :return: a generator of the rows of all the files, in order
+    """
+    return heapq.merge(*[read_spilled(name) for name in names], key=key, reverse=reverse)
+
+
+#############
+# INDEXES ##
+#############
+class Condition(object):
+    """
+    A selection predicate in a form indexes recognize: attribute, comparison operator, value. selection (and
+    IndexedTable) accept a Condition in place of a function; on a table without a suitable index, it is checked
+    against every row, like any function.
+
+    Example:
+    > selection(EMPLOYEES, Condition("Age", ">=", 30))
+    [["Surname", "FirstName", "Age", "Salary"], ["Black", "Lucy", 40, 3000], ["Verdi", "Nico", 36, 4500],
+     ["Smith", "Mark", 40, 3900]]
+    """
+
+    def __init__(self, attr, op, value):
+        """
+        :param attr: an attribute name
+        :param op: one of CONDITION_OPERATORS, or "between" for low <= value <= high
+        :param value: the value to compare with, or a (low, high) pair for "between"
+        """
+        if op not in CONDITION_OPERATORS and op != "between":
+            raise ValueError("Unknown comparison operator: " + str(op))
+        self.attr = attr
+        self.op = op
+        self.value = value
+
+    def bind(self, attributes):
+        """
+        :param attributes: the attribute names of a table
+        :return: a function taking a row of the table and returning True if it satisfies the condition
+        """
+        if self.attr not in attributes:
+            raise UnknownAttributeException
+        position = list(attributes).index(self.attr)
+        if self.op == "between":
+            low, high = self.value
+
+            def check(row):
+                return low <= row[position] <= high
+        else:
+            compare = CONDITION_OPERATORS[self.op]
+            value = self.value
+
+            def check(row):
+                return compare(row[position], value)
+        return check
+
+    def matches(self, value):
+        """
+        :param value: a value of the attribute
+        :return: True if the value satisfies the condition
+        """
+        if self.op == "between":
+            return self.value[0] <= value <= self.value[1]
+        return CONDITION_OPERATORS[self.op](value, self.value)
+
+
+class IndexedTable(list):
+    """
+    A table (list of lists, header first) that keeps secondary indexes on some of its attributes, used by selection
+    with a Condition: a HashIndex answers equality conditions, a SortedIndex answers equality and range conditions.
+    Rows added with append or extend are added to the indexes; any other change to the list rebuilds the indexes the
+    next time they are used. Rows must not be modified in place while indexed.
+
+    Example:
+    > employees = IndexedTable(EMPLOYEES)
+    > employees.create_index("Surname")
+    > employees.create_index("Age", "sorted")
+    > selection(employees, Condition("Surname", "==", "Smith"))
+    """
+
+    def __init__(self, rows=()):
+        """
+        :param rows: A table in the form of a list of lists with the first item being a list of strings denoting the
+          attribute names.
+        """
+        list.__init__(self, rows)
+        self.indexes = {}
+        self.stale = False
+
+    def create_index(self, attr, kind="hash"):
+        """
+        :param attr: an attribute name
+        :param kind: "hash" (equality only) or "sorted" (equality and ranges; the values must be comparable)
+        :return: the new index
+        """
+        if len(self) < 1 or attr not in self[0]:
+            raise UnknownAttributeException
+        if kind not in INDEX_KINDS:
+            raise ValueError("Unknown index kind: " + str(kind))
+        index = INDEX_KINDS[kind](self, list(self[0]).index(attr))
+        self.indexes.setdefault(attr, []).append(index)
+        return index
+
+    def drop_index(self, attr):
+        """
+        :param attr: an attribute name; all of its indexes are dropped
+        """
+        self.indexes.pop(attr, None)
+
+    def lookup(self, condition):
+        """
+        :param condition: a Condition
+        :return: the rows satisfying the condition, in table order, or None if no index can answer it
+        """
+        if self.stale:
+            self.reindex()
+        for index in self.indexes.get(condition.attr, ()):
+            row_numbers = index.find(condition.op, condition.value)
+            if row_numbers is not None:
+                return [self[row_number] for row_number in row_numbers]
+        return None
+
+    def reindex(self):
+        """
+        Rebuild every index from the current rows.
+        """
+        for attr in self.indexes:
+            self.indexes[attr] = [type(index)(self, index.position) for index in self.indexes[attr]]
+        self.stale = False
+
+    def append(self, row):
+        list.append(self, row)
+        if len(self) > 1 and not self.stale:
+            for indexes in self.indexes.values():
+                for index in indexes:
+                    index.add(len(self) - 1, row)
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+
+def invalidates_indexes(name):
+    """
+    :param name: name of a list method changing the list
+    :return: the method, marking the indexes of the IndexedTable to be rebuilt
+    """
+    method = getattr(list, name)
+
+    def changed(self, *args):
+        self.stale = True
+        return method(self, *args)
+    changed.__name__ = name
+    return changed
+
+
+for list_method in ("__setitem__", "__delitem__", "__iadd__", "__imul__", "insert", "pop", "remove", "clear",
+                    "sort", "reverse"):
+    setattr(IndexedTable, list_method, invalidates_indexes(list_method))
+
+
+class HashIndex(object):
+    """
+    Maps each value of an attribute to the numbers of the rows holding it, for equality conditions.
+    """
+
+    def __init__(self, t, position):
+        """
+        :param t: a table
+        :param position: position of the indexed attribute in the rows
+        """
+        self.position = position
+        self.rows = {}
+        for row_number in range(1, len(t)):
+            self.add(row_number, t[row_number])
+
+    def add(self, row_number, row):
+        self.rows.setdefault(row[self.position], []).append(row_number)
+
+    def find(self, op, value):
+        """
+        :return: the numbers of the matching rows in increasing order, or None if the operator is not supported
+        """
+        if op != "==":
+            return None
+        return self.rows.get(value, [])
+
+
+class SortedIndex(object):
+    """
+    Keeps the values of an attribute sorted, with the number of the row holding each, for equality and range
+    conditions found by binary search.
+    """
+
+    def __init__(self, t, position):
+        """
+        :param t: a table
+        :param position: position of the indexed attribute in the rows
+        """
+        self.position = position
+        entries = sorted((t[row_number][position], row_number) for row_number in range(1, len(t)))
+        self.values = [value for value, row_number in entries]
+        self.row_numbers = [row_number for value, row_number in entries]
+
+    def add(self, row_number, row):
+        at = bisect.bisect_right(self.values, row[self.position])
+        self.values.insert(at, row[self.position])
+        self.row_numbers.insert(at, row_number)
+
+    def find(self, op, value):
+        """
+        :return: the numbers of the matching rows in increasing order, or None if the operator is not supported
+        """
+        values = self.values
+        if op == "==":
+            start, end = bisect.bisect_left(values, value), bisect.bisect_right(values, value)
+        elif op == "<":
+            start, end = 0, bisect.bisect_left(values, value)
+        elif op == "<=":
+            start, end = 0, bisect.bisect_right(values, value)
+        elif op == ">":
+            start, end = bisect.bisect_right(values, value), len(values)
+        elif op == ">=":
+            start, end = bisect.bisect_left(values, value), len(values)
+        elif op == "between":
+            start, end = bisect.bisect_left(values, value[0]), bisect.bisect_right(values, value[1])
+        else:
+            return None
+        return sorted(self.row_numbers[start:end])
+
+
+# Index classes of IndexedTable.create_index, by kind
+INDEX_KINDS = {"hash": HashIndex, "sorted": SortedIndex}
+
+
+###################
+# BINARY TABLES ##
+###################
+def write_table(t, file_name):
+    """
+    Write table t to a binary file that MappedTable opens without reading it into memory. The file starts with a JSON
+    header (the attribute names, the number of rows and, for each column, its kind and where its data starts),
+    followed by one fixed-width block per column: 64-bit integers for columns of ints, 64-bit floats for columns
+    of floats, and for any other column 32-bit codes into a dictionary of its distinct values. A dictionary is a
+    block of its own: the 64-bit offsets of its values, then the values, each a tag byte and UTF-8 text (see
+    encode_value), so that MappedTable only decodes the values it reads.
+
+    Example:
+    > write_table(EMPLOYEES, "employees.tbl")
+    > read_table("employees.tbl") == EMPLOYEES
+    True
+
+    :param t: A table in the form of a list of lists with the first item being a list of strings denoting the
+      attribute names. Values of columns that are not all ints or all floats must be None, bools, ints, floats or
+      strings.
+    :param file_name: the name of the file to write
+    :raises TypeError: if a value cannot be written
+    :raises ValueError: if a column has more than DICTIONARY_MAX_VALUES distinct values
+    """
+    attributes = list(t[0])
+    rows = len(t) - 1
+    blocks = []
+    schema = []
+    offset = 0
+    for index in range(len(attributes)):
+        kind, block, values = binary_column([row[index] for row in t[1:]])
+        column = {"kind": kind, "offset": offset}
+        blocks.append(block)
+        offset += len(block) + (-len(block) % 8)
+        if values is not None:
+            block = dictionary_block(values)
+            column.update(values=offset, distinct=len(values))
+            blocks.append(block)
+            offset += len(block) + (-len(block) % 8)
+        schema.append(column)
+    header = json.dumps({"attributes": attributes, "rows": rows, "columns": schema,
+                         "byteorder": sys.byteorder}).encode("utf-8")
+    with open(file_name, "wb") as table_file:
+        table_file.write(BINARY_TABLE_MAGIC + struct.pack("<Q", len(header)) + header)
+        table_file.write(b"\0" * (-table_file.tell() % 8))
+        for block in blocks:
+            table_file.write(block + b"\0" * (-len(block) % 8))
+
+
+def binary_column(values):
+    """
+    :param values: the values of a column, as a list
+    :return: the kind of the column ("q", "d" or "I"), its data as bytes, and its dictionary of distinct values
+      (None for "q" and "d")
+    :raises ValueError: if a column of kind "I" has more than DICTIONARY_MAX_VALUES distinct values, which its
+      codes cannot tell apart
+    """
+    kinds = set(type(value) for value in values)
+    if kinds == set([int]) and -2 ** 63 <= min(values) and max(values) < 2 ** 63:
+        return "q", array("q", values).tobytes(), None
+    if kinds == set([float]):
+        return "d", array("d", values).tobytes(), None
+    codes = {}
+    distinct = []
+    block = array("I")
+    for value in values:
+        # Keyed by type too, so that 1, 1.0 and True stay distinct values
+        key = (type(value), value)
+        code = codes.get(key)
+        if code is None:
+            if len(distinct) == DICTIONARY_MAX_VALUES:
+                raise ValueError("A column has more than " + str(DICTIONARY_MAX_VALUES) + " distinct values")
+            code = codes[key] = len(distinct)
+            distinct.append(value)
+        block.append(code)
+    return "I", block.tobytes(), distinct
+
+
+def dictionary_block(values):
+    """
+    :param values: the distinct values of a column
+    :return: the dictionary as bytes: len(values) + 1 64-bit offsets, where value i is stored from offset i to
+      offset i + 1 of the bytes that follow them, then the encoded values
+    """
+    encoded = [encode_value(value) for value in values]
+    offsets = array("Q", [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    return offsets.tobytes() + b"".join(encoded)
+
+
+def encode_value(value):
+    """
+    :param value: None, a bool, an int, a float or a string
+    :return: the value as bytes: b"s" and the UTF-8 string, or b"j" and the UTF-8 JSON text of any other value,
+      which keeps its type when it is read back by decode_value
+    :raises TypeError: for values of any other type
+    """
+    if type(value) is str:
+        return b"s" + value.encode("utf-8")
+    if value is None or type(value) in (bool, int, float):
+        return b"j" + json.dumps(value).encode("utf-8")
+    raise TypeError("Cannot write a value of type " + type(value).__name__ + " to a binary table")
+
+
+def decode_value(data):
+    """
+    :param data: a value as bytes, as returned by encode_value
+    :return: the value
+    """
+    if data[:1] == b"s":
+        return data[1:].decode("utf-8")
+    return json.loads(data[1:].decode("utf-8"))
+
+
+def read_table(file_name):
+    """
+    :param file_name: the name of a file written by write_table
+    :return: the table in the form of a list of lists with the first item being a list of strings denoting the
+      attribute names
+    """
+    t = MappedTable(file_name)
+    try:
+        return t.to_rows()
+    finally:
+        t.close()
+
+
+class MappedTable(Table):
+    """
+    A Table whose columns are read straight from a file written by write_table, through mmap: numeric columns are
+    NumPy arrays (memoryviews without NumPy) over the mapped file, other columns are DictionaryColumns. selection and
+    projection accept a MappedTable and only turn into Python objects the columns they need and the rows they keep;
+    a Condition is checked against the column of its attribute alone, and only once per distinct value for
+    dictionary columns. Other operators take read_table(file_name) instead.
+
+    Example:
+    > write_table(EMPLOYEES, "employees.tbl")
+    > with MappedTable("employees.tbl") as t:
+    >     selection(t, Condition("Age", ">=", 40))
+    [["Surname", "FirstName", "Age", "Salary"], ["Black", "Lucy", 40, 3000], ["Smith", "Mark", 40, 3900]]
+    """
+
+    def __init__(self, file_name):
+        """
+        :param file_name: the name of a file written by write_table
+        """
+        with open(file_name, "rb") as table_file:
+            self.map = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(BINARY_TABLE_MAGIC)] != BINARY_TABLE_MAGIC:
+            self.map.close()
+            raise ValueError(file_name + " is not a binary table")
+        start = len(BINARY_TABLE_MAGIC) + 8
+        header_size = struct.unpack("<Q", self.map[len(BINARY_TABLE_MAGIC):start])[0]
+        header = json.loads(self.map[start:start + header_size].decode("utf-8"))
+        if header["byteorder"] != sys.byteorder:
+            self.map.close()
+            raise ValueError(file_name + " was written on a " + header["byteorder"] + "-endian machine")
+        data = start + header_size
+        data += -data % 8
+        rows = header["rows"]
+        columns = []
+        for schema in header["columns"]:
+            column = self.mapped_column(schema["kind"], data + schema["offset"], rows)
+            if "values" in schema:
+                column = DictionaryColumn(column, MappedValues(self.map, data + schema["values"], schema["distinct"]))
+            columns.append(column)
+        Table.__init__(self, header["attributes"], columns)
+
+    def mapped_column(self, kind, offset, rows):
+        """
+        :param kind: "q", "d" or "I"
+        :param offset: where the data of the column starts in the file
+        :param rows: the number of rows
+        :return: the column as a read-only NumPy array, or memoryview without NumPy
+        """
+        if numpy is not None:
+            dtype = {"q": numpy.int64, "d": numpy.float64, "I": numpy.uint32}[kind]
+            return numpy.frombuffer(self.map, dtype=dtype, count=rows, offset=offset)
+        return memoryview(self.map)[offset:offset + rows * array(kind).itemsize].cast(kind)
+
+    def close(self):
+        """
+        Unmap the file. Columns taken from this table must not be used, and views of them (such as the columns of a
+        project of this table) must have been dropped, before it is closed.
+        """
+        self.columns = []
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def rows(self, chunk=MAPPED_CHUNK_ROWS):
+        """
+        :param chunk: rows turned into Python lists at a time
+        :return: an iterator over the rows, each a list
+        """
+        for rows in self.row_chunks(chunk):
+            for row in rows:
+                yield row
+
+    def row_chunks(self, chunk=MAPPED_CHUNK_ROWS):
+        """
+        :param chunk: number of rows per list
+        :return: an iterator over lists of at most chunk consecutive rows, each row a list
+        """
+        for start in range(0, len(self), chunk):
+            columns = [column_values(column[start:start + chunk]) for column in self.columns]
+            yield [list(row) for row in zip(*columns)]
+
+    def mask(self, condition):
+        """
+        :param condition: a Condition on an attribute of this table
+        :return: the rows satisfying the condition, in the form Table.select takes
+        """
+        column = self[condition.attr]
+        if isinstance(column, DictionaryColumn):
+            return column.mask(condition)
+        bounds = condition.value if condition.op == "between" else (condition.value,)
+        if numpy is not None and all(type(value) in (int, float) for value in bounds):
+            if condition.op == "between":
+                return (column >= bounds[0]) & (column <= bounds[1])
+            return CONDITION_OPERATORS[condition.op](column, condition.value)
+        return [condition.matches(value) for value in column_values(column)]
+
+    def selection(self, f):
+        """
+        Perform selection (see selection) on this table.
+
+        :param f: A function that takes in a row of the table and returns a boolean, or a Condition
+        :return: A table in the form of a list of lists, or None if no row is selected
+        """
+        if isinstance(f, Condition):
+            selected = self.select(self.mask(f))
+            return None if selected is None else selected.to_rows()
+        new = [list(self.attributes)]
+        for row in self.rows():
+            if f(row) is True:
+                new.append(row)
+        if len(new) <= 1:
+            return None
+        return new
+
+    def projection(self, r):
+        """
+        Perform projection (see projection) on this table.
+
+        :param r: A list of attributes denoted by a list of strings.
+        :return: A table in the form of a list of lists, or None if no attributes are given or the table is empty
+        """
+        projected = self.project(r)
+        return None if projected is None else projected.to_rows()
+
+
+class MappedValues(object):
+    """
+    The distinct values of a dictionary column of a MappedTable, read from a dictionary block (see dictionary_block)
+    of the mapped file. Each value is decoded the first time it is read, and kept; the offsets are read from the
+    file as they are needed, so no view of it is held.
+    """
+
+    def __init__(self, data, offset, count):
+        """
+        :param data: the mapped file
+        :param offset: where the dictionary block starts in the file
+        :param count: the number of distinct values
+        """
+        self.data = data
+        self.offset = offset
+        self.start = offset + (count + 1) * 8
+        self.count = count
+        self.decoded = {}
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, code):
+        """
+        :param code: the code of a value
+        :return: the value
+        """
+        try:
+            return self.decoded[code]
+        except KeyError:
+            if not 0 <= code < self.count:
+                raise IndexError("No value has code " + str(code))
+            start, end = struct.unpack_from("=QQ", self.data, self.offset + code * 8)
+            value = self.decoded[code] = decode_value(self.data[self.start + start:self.start + end])
+            return value
+
+    def __iter__(self):
+        for code in range(self.count):
+            yield self[code]
+
+
+class DictionaryColumn(object):
+    """
+    A column stored as codes into a list of its distinct values.
+    """
+
+    def __init__(self, codes, values):
+        """
+        :param codes: a NumPy array, memoryview or array.array of unsigned ints, one per row
+        :param values: the distinct values of the column, as a list or MappedValues
+        """
+        self.codes = codes
+        self.values = values
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        """
+        :param index: a row number, or a slice
+        :return: the value of that row, or a DictionaryColumn of those rows
+        """
+        if isinstance(index, slice):
+            return DictionaryColumn(self.codes[index], self.values)
+        return self.values[self.codes[index]]
+
+    def tolist(self):
+        """
+        :return: the values of the column as a list of Python objects
+        """
+        values = self.values
+        return [values[code] for code in self.codes.tolist()]
+
+    def select(self, keep):
+        """
+        :param keep: a NumPy boolean mask, or (without NumPy) a list of the row indices to keep
+        :return: a DictionaryColumn with only the kept rows
+        """
+        if numpy is not None:
+            return DictionaryColumn(self.codes[keep], self.values)
+        codes = self.codes
+        return DictionaryColumn(array("I", [codes[index] for index in keep]), self.values)
+
+    def mask(self, condition):
+        """
+        :param condition: a Condition, checked once per distinct value
+        :return: a NumPy boolean mask, or (without NumPy) a list of booleans, one per row
+        """
+        matches = [condition.matches(value) is True for value in self.values]
+        if numpy is not None:
+            return numpy.array(matches, dtype=bool)[self.codes]
+        return [matches[code] for code in self.codes]
+
+
+#######################
+# PARALLEL PRODUCTS ##
+#######################
+def parallel_product_selection(t1, t2, f, processes=None, partition_rows=PRODUCT_PARTITION_ROWS):
+    """
+    Return the rows of the cross-product of tables t1 and t2 that satisfy condition f, checked by a pool of worker
+    processes. See iter_parallel_product_selection.
+
+    Example:
+    > parallel_product_selection(R1, R2, Condition("Employee", "==", "Smith"))
+    [["Employee", "Department", "Department", "Head"], ["Smith", "sales", "production", "Mori"],
+     ["Smith", "sales", "sales", "Brown"]]
+
+    :param t1: A table as denoted by a list of lists with the first list item representing the attributes in the form
+      of a list of strings.
+    :param t2: A table as denoted by a list of lists with the first list item representing the attributes in the form
+      of a list of strings.
+    :param f: a function or Condition as taken by selection
+    :param processes: number of worker processes; defaults to the number of CPUs
+    :param partition_rows: rows of t1 a worker takes at a time
+    :return: A table (list of lists) with the first list depicting the attributes of the table, in the order
+      selection(cross_product(t1, t2), f) returns them. Otherwise, if no rows are in the table, None is returned
+    """
+    new = list(iter_parallel_product_selection(t1, t2, f, processes, partition_rows))
+    if len(new) < 2:
+        return None
+    return new
+
+
+def iter_parallel_product_selection(t1, t2, f, processes=None, partition_rows=PRODUCT_PARTITION_ROWS):
+    """
+    Stream the rows of the cross-product of tables t1 and t2 that satisfy condition f. t1 is split into partitions
+    of partition_rows rows, each combined with every row of t2 and filtered by one of a pool of worker processes. t2
+    is not sent to the workers: it is written once to a temporary binary table (see write_table) that every worker
+    maps as a MappedTable and turns into rows MAPPED_CHUNK_ROWS at a time, so only the kept rows of a partition are
+    held in full. Rows are yielded in input order as soon as the partition they belong to is done.
+
+    Only the filtered product runs in parallel: the workers check f, and send back only the rows it keeps. The whole
+    product has nothing to check, and sending every row back would cost more than building it, so f is required;
+    use cross_product or cross_product_view for the whole product. Where new processes are spawned rather than
+    forked (Windows, macOS), f must be picklable: a Condition or a module-level function.
+
+    :param t1: A table as denoted by a list of lists with the first list item representing the attributes in the form
+      of a list of strings.
+    :param t2: A table as denoted by a list of lists with the first list item representing the attributes in the form
+      of a list of strings.
+    :param f: a function or Condition as taken by selection
+    :param processes: number of worker processes; defaults to the number of CPUs
+    :param partition_rows: rows of t1 a worker takes at a time
+    :return: a generator of the header, then the rows, each a list
+    :raises ValueError: if f is None
+    """
+    if f is None:
+        raise ValueError("No condition given: use cross_product for the whole cross-product")
+    header = list(t1[0]) + list(t2[0])
+    if isinstance(f, Condition):
+        f.bind(header)
+    yield header
+    if len(t1) < 2 or len(t2) < 2:
+        return
+    handle, right_file = tempfile.mkstemp(suffix=".tbl")
+    os.close(handle)
+    try:
+        write_table(t2, right_file)
+        partitions = (t1[start:start + partition_rows] for start in range(1, len(t1), partition_rows))
+        with multiprocessing.Pool(processes, initializer=init_product_worker,
+                                  initargs=(right_file, header, f)) as pool:
+            for rows in pool.imap(product_partition, partitions):
+                for row in rows:
+                    yield row
+    finally:
+        os.remove(right_file)
+
+
+def init_product_worker(right_file, header, f):
+    """
+    Maps the right table of an iter_parallel_product_selection worker process from its binary table. The table stays
+    mapped until the process exits.
+
+    :param right_file: the name of the binary table holding the right table
+    :param header: the attributes of the cross-product
+    :param f: a function or Condition on rows of the cross-product
+    """
+    global PRODUCT_WORKER
+    check = f.bind(header) if isinstance(f, Condition) else f
+    PRODUCT_WORKER = (MappedTable(right_file), check)
+
+
+def product_partition(left_rows):
+    """
+    Combines a partition of the left table with the right table in an iter_parallel_product_selection worker
+    process.
+
+    :param left_rows: a list of rows of the left table
+    :return: the rows of the cross-product of the partition with the right table that satisfy the condition
+    """
+    right, check = PRODUCT_WORKER
+    kept = [[] for row in left_rows]
+    for right_rows in right.row_chunks(MAPPED_CHUNK_ROWS):
+        for row, new in zip(left_rows, kept):
+            for i in right_rows:
+                joined = row + i
+                if check(joined) is True:
+                    new.append(joined)
+    return [joined for new in kept for joined in new]
@@ -6,9 +6,24 @@ Computer-based immigration office for Kanadia
 
 """
 
+import os
 import re
+import sys
+import csv
 import json
+import time
+import asyncio
 import datetime
+import functools
+import threading
+import multiprocessing
+from operator import attrgetter
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 __author__ = "Darius Chow and Ryan Prance, Adopted from: Susan Sim"
 __email__ = "darius.chow@mail.utoronto.ca, ryan.prance@mail.utoronto.ca, ses@drsusansim.org"
@@ -23,29 +38,133 @@ REQUIRED_FIELDS = ["passport", "first_name", "last_name",
                    "birth_date", "home", "entry_reason", "from"]
 LOCATION_FIELDS = ("home", "from", "via")
 REQUIRED_FIELDS_LOCATION = ("city", "region", "country")
+TRAVELLER_FIELDS = frozenset(REQUIRED_FIELDS)
+LOCATION_KEYS = frozenset(REQUIRED_FIELDS_LOCATION)
+STREAM_CHUNK_SIZE = 64 * 1024
+JSON_WHITESPACE = " \t\n\r"
+JSON_DELIMITERS = JSON_WHITESPACE + ",]"
+JSON_TOKEN_REGEX = re.compile(r'[\[\]{}", \t\n\r]')
+JSON_STRING_END_REGEX = re.compile(r'["\\]')
+JSON_SEPARATOR_REGEX = re.compile(rb',[ \t\n\r]*\{')
+PARALLEL_CHUNK_SIZE = 1024 * 1024
+PASSPORT_REGEX = re.compile(r'^([\dA-Za-z]{5}-){4}[\dA-Za-z]{5}$')
+VISA_REGEX = re.compile(r'^[\dA-Za-z]{5}-[\dA-Za-z]{5}$')
+DATE_REGEX = re.compile(r'^\d{4}(-\d{2}){2}$')
+HOME_COUNTRY_CODE = "KAN"
+DATE_CACHE_SIZE = 4096
+SERVICE_BATCH_SIZE = 256
+SERVICE_BATCH_DELAY = 0.002
+SERVICE_MAX_PENDING = 10000
+SINK_BUFFER_SIZE = 1024 * 1024
+RULE_SAMPLE_SIZE = 1000
+DEDUP_MAX_PASSPORTS = 10000
+# Size of the Bloom filter of passports a Deduplicator no longer keeps: 2 MiB, about 0.05% false positives for a
+# million passports
+DEDUP_FILTER_BITS = 2 ** 24
+DEDUP_FILTER_HASHES = 7
+
+# One byte per decision in the binary output format, after the BINARY_MAGIC header
+DECISION_CODES = {"Accept": 1, "Reject": 2, "Quarantine": 3}
+DECISION_NAMES = dict((code, name) for name, code in DECISION_CODES.items())
+BINARY_MAGIC = b"KDEC"
+
+# Names of the DECISION_RULES timed by DecisionStats, in the order decide applies them
+RULES = ("required_fields_exist", "unknown_location_exists", "has_valid_visa",
+         "travelled_via_country_with_medical_advisory")
+
+# What a Deduplicator found out about an application, see Deduplicator.decide
+DUPLICATE_NEW = "new"
+DUPLICATE_EXACT = "duplicate"
+DUPLICATE_CONFLICT = "conflict"
+DUPLICATE_POSSIBLE = "possible duplicate"
+
+# Per-country decision flags of a CountryIndex
+VISA_REQUIRED = 1
+TRANSIT_VISA_REQUIRED = 2
+MEDICAL_ADVISORY = 4
+HOME_COUNTRY = 8
+
+# Flag given by CompiledValidator.country_flags to countries not in its table, such as countries removed from the
+# table after Travellers were read against it
+UNKNOWN_LOCATION = 16
+
+# Integer id of every country code of a CountryIndex that Travellers were read against, see country_id, and the
+# code of each id (id 0 stands for no location). Only codes of countries tables are interned, so these stay as small
+# as the tables whatever codes the travellers carry.
+COUNTRY_IDS = {}
+COUNTRY_CODES = [None]
+COUNTRY_IDS_LOCK = threading.Lock()
+
+# CountriesProvider of each countries file loaded by load_country_index
+COUNTRY_PROVIDERS = {}
+
+# Validator of a decide_parallel worker process, built once by init_worker
+WORKER_VALIDATOR = None
 
 #####################
 # HELPER FUNCTIONS ##
 #####################
 
 
-def is_more_than_x_years_ago(x, date_string):
+def is_more_than_x_years_ago(x, date_string, reference_date=None):
     """
-    Check if date is less than x years ago.
+    Check if date is more than x years ago, i.e. on or before the same day x years before the reference date.
 
     :param x: int representing years
     :param date_string: a date string in format "YYYY-mm-dd"
-    :return: True if date is less than x years ago; False otherwise.
+    :param reference_date: the date to count back from, as a datetime.date or a "YYYY-mm-dd" string; defaults to
+      today
+    :return: True if date is more than x years ago; False otherwise.
     """
+    return parse_date(date_string) <= years_before(as_reference_date(reference_date), x)
 
-    now = datetime.datetime.now()
-    x_years_ago = now.replace(year=now.year - x)
-    date = datetime.datetime.strptime(date_string, '%Y-%m-%d')
 
-    return (date - x_years_ago).total_seconds() < 0
+def parse_date(date_string):
+    """
+    Parses a date in format "YYYY-mm-dd". Well formed dates are sliced directly; anything else goes through strptime,
+    so the same strings are accepted and rejected as with strptime.
 
+    :param date_string: a date string in format "YYYY-mm-dd"
+    :return: a datetime.date
+    :raises ValueError: if the string is not a valid date
+    """
+    if len(date_string) == 10 and date_string[4] == "-" and date_string[7] == "-":
+        digits = date_string[:4] + date_string[5:7] + date_string[8:]
+        if digits.isdigit() and digits.isascii():
+            try:
+                return datetime.date(int(date_string[:4]), int(date_string[5:7]), int(date_string[8:]))
+            except ValueError:
+                pass
+    return datetime.datetime.strptime(date_string, '%Y-%m-%d').date()
 
-def decide(input_file, countries_file):
+
+def as_reference_date(reference_date):
+    """
+    :param reference_date: None (meaning today), a datetime.date, a datetime.datetime or a "YYYY-mm-dd" string
+    :return: a datetime.date
+    """
+    if reference_date is None:
+        return datetime.date.today()
+    if isinstance(reference_date, str):
+        return parse_date(reference_date)
+    if isinstance(reference_date, datetime.datetime):
+        return reference_date.date()
+    return reference_date
+
+
+def years_before(date, x):
+    """
+    :param date: a datetime.date
+    :param x: int representing years
+    :return: the same day x years earlier (February 28 if date is February 29 and that year is not a leap year)
+    """
+    try:
+        return date.replace(year=date.year - x)
+    except ValueError:
+        return date.replace(year=date.year - x, day=28)
+
+
+def decide(input_file, countries_file, reference_date=None, stats=None):
     """
     Decides whether a traveller's entry into Kanadia should be accepted according to business rules. If a traveller has
     any of the required information fields (first_name, last_name, birth_date, passport, home, from, and entry_reason)
@@ -63,49 +182,364 @@ def decide(input_file, countries_file):
     :param countries_file: The name of a JSON formatted file that contains
         country data, such as whether an entry or transit visa is required,
         and whether there is currently a medical advisory
+    :param reference_date: the date visas are checked against, as a datetime.date
+        or a "YYYY-mm-dd" string; defaults to today. The same date is used for
+        every traveller in the file.
+    :param stats: an optional DecisionStats recording rule timings and the
+        reason for each decision
     :return: List of strings. Possible values of strings are:
-        "Accept", "Reject", and "Quarantine"
+        "Accept", "Reject", and "Quarantine". Each is a Decision, which also
+        records the version of the countries table it was made with.
     """
     with open(input_file, "r") as citizen_file:
         citizen_content = citizen_file.read()
     citizen_json = json.loads(citizen_content)
+    validator = CompiledValidator(load_country_index(countries_file), reference_date=reference_date, stats=stats)
+
+    decisions = []
+    for person in citizen_json:
+        decisions.append(validator.decide(person))
+
+    return decisions
+
+
+def decide_iter(input_file, countries_file, chunk_size=STREAM_CHUNK_SIZE, reference_date=None, stats=None):
+    """
+    Streaming version of decide. The input file is parsed one traveller at a time and each decision is yielded as
+    soon as it is made, so memory use stays flat no matter how large the file is. The decisions (and their order)
+    are identical to those returned by decide.
+
+    :param input_file: The name of a JSON formatted file that contains cases to decide
+    :param countries_file: The name of a JSON formatted file that contains country data
+    :param chunk_size: number of characters read from the input file at a time
+    :param reference_date: the date visas are checked against; defaults to today. See decide.
+    :param stats: an optional DecisionStats. See decide.
+    :return: a generator of strings. Possible values of strings are: "Accept", "Reject", and "Quarantine"
+    """
+    validator = CompiledValidator(load_country_index(countries_file), reference_date=reference_date, stats=stats)
+    with open(input_file, "r") as citizen_file:
+        for person in iter_json_array(citizen_file, chunk_size):
+            yield validator.decide(person)
+
+
+def decide_parallel(input_file, countries_file, processes=None, chunk_size=PARALLEL_CHUNK_SIZE,
+                    reference_date=None):
+    """
+    Parallel version of decide. The input file is split into byte ranges of chunk_size, and each worker process of a
+    pool reads and parses its own ranges, so the parent process neither parses travellers nor sends them to the
+    workers. A range holds the travellers whose separating comma lies in it (see decide_range). The countries table
+    is sent to each worker once, when the worker starts. Decisions are returned in input order and are identical to
+    those returned by decide; a file that cannot be split this way (for instance one whose travellers are not all
+    JSON objects) is decided in the parent process instead.
+
+    :param input_file: The name of a JSON formatted file that contains cases to decide
+    :param countries_file: The name of a JSON formatted file that contains country data
+    :param processes: number of worker processes; defaults to the number of CPUs
+    :param chunk_size: number of bytes of the input file a worker reads at a time
+    :param reference_date: the date visas are checked against; defaults to today. See decide.
+    :return: List of strings. Possible values of strings are: "Accept", "Reject", and "Quarantine"
+    """
+    countries = load_country_index(countries_file)
+    reference_date = as_reference_date(reference_date)
+    bounds = json_array_bounds(input_file)
+    decisions = []
+    if bounds is not None:
+        size = bounds[1] + 1
+        ranges = [(input_file, start, min(start + chunk_size, size)) + bounds for start in range(0, size, chunk_size)]
+        with multiprocessing.Pool(processes, initializer=init_worker,
+                                  initargs=(countries, reference_date)) as pool:
+            for range_decisions in pool.imap(decide_range, ranges):
+                if range_decisions is None:
+                    bounds = None
+                    break
+                decisions.extend(range_decisions)
+    if bounds is None:
+        validator = CompiledValidator(countries, reference_date=reference_date)
+        with open(input_file, "r") as citizen_file:
+            decisions = [validator.decide(person) for person in iter_json_array(citizen_file)]
+    return decisions
+
+
+def json_array_bounds(input_file):
+    """
+    :param input_file: The name of a file holding a JSON array
+    :return: the byte offsets of the opening '[' and of the closing ']' of the array, or None if the file does not
+      start with '[' and end with ']'
+    """
+    with open(input_file, "rb") as citizen_file:
+        head = citizen_file.read(STREAM_CHUNK_SIZE)
+        citizen_file.seek(max(0, os.path.getsize(input_file) - STREAM_CHUNK_SIZE))
+        tail_start = citizen_file.tell()
+        tail = citizen_file.read()
+    stripped_head = head.lstrip(JSON_WHITESPACE.encode())
+    stripped_tail = tail.rstrip(JSON_WHITESPACE.encode())
+    if not stripped_head.startswith(b"[") or not stripped_tail.endswith(b"]"):
+        return None
+    array_start = len(head) - len(stripped_head)
+    array_end = tail_start + len(stripped_tail) - 1
+    if array_end <= array_start:
+        return None
+    return array_start, array_end
+
+
+def init_worker(countries, reference_date):
+    """
+    Builds the validator of a decide_parallel worker process.
+
+    :param countries: a CountryIndex
+    :param reference_date: the datetime.date visas are checked against
+    """
+    global WORKER_VALIDATOR
+    WORKER_VALIDATOR = CompiledValidator(countries, reference_date=reference_date)
+
+
+def decide_range(task):
+    """
+    Reads, parses and decides the travellers of a byte range of the input file in a decide_parallel worker process.
+
+    A range owns the travellers that follow a separator starting in it, a separator being a comma followed by the
+    '{' of the next traveller (the first range also owns the traveller after the opening '['). Such a comma can also
+    appear inside a traveller, in a string or a nested array; the text between two separators is then not a list of
+    complete JSON values, so the range fails to parse and None is returned for decide_parallel to fall back on
+    deciding the file in order.
+
+    :param task: (input_file, start, end, array_start, array_end), byte offsets of the range and of the brackets of
+      the array
+    :return: List of strings, one decision per traveller of the range, or None if the range could not be parsed
+    """
+    input_file, start, end, array_start, array_end = task
+    if end <= array_start:
+        return []
+    with open(input_file, "rb") as citizen_file:
+        citizen_file.seek(start)
+        data = citizen_file.read(end - start)
+        separator = JSON_SEPARATOR_REGEX.search(data, end - start)
+        while separator is None and start + len(data) <= array_end:
+            # The separator after the range may be far: read on, doubling the amount read
+            more = citizen_file.read(max(len(data), STREAM_CHUNK_SIZE))
+            if len(more) == 0:
+                break
+            data += more
+            separator = JSON_SEPARATOR_REGEX.search(data, end - start)
+    stop = array_end - start if separator is None or separator.start() + start > array_end else separator.start()
+    if start <= array_start:
+        first = array_start - start
+    else:
+        separator = JSON_SEPARATOR_REGEX.search(data, 0, stop)
+        first = stop if separator is None else separator.start()
+    if first >= stop:
+        return []
+    try:
+        people = json.loads(b"[" + data[first + 1:stop] + b"]")
+    except ValueError:
+        return None
+    return [WORKER_VALIDATOR.decide(person) for person in people]
+
+
+def decide_to_sink(input_file, countries_file, sink, reference_date=None, stats=None):
+    """
+    Streams decisions for the travellers in the input file straight to an output sink, along with each traveller's
+    index in the file and passport number. The sink is closed at the end.
+
+    Example:
+    > decide_to_sink("travellers.json", "countries.json", BinarySink("decisions.bin"))
+
+    :param input_file: The name of a JSON formatted file that contains cases to decide
+    :param countries_file: The name of a JSON formatted file that contains country data
+    :param sink: an object with write(index, passport, decision) and close() methods, such as a JsonLinesSink,
+      CsvSink or BinarySink
+    :param reference_date: the date visas are checked against; defaults to today. See decide.
+    :param stats: an optional DecisionStats. See decide.
+    :return: the number of decisions written
+    """
+    validator = CompiledValidator(load_country_index(countries_file), reference_date=reference_date, stats=stats)
+    count = 0
+    try:
+        with open(input_file, "r") as citizen_file:
+            for person in iter_json_array(citizen_file):
+                passport = person.get("passport") if isinstance(person, dict) else None
+                sink.write(count, passport, validator.decide(person))
+                count += 1
+    finally:
+        sink.close()
+    return count
+
+
+def decide_person(person, countries, reference_date=None, engine=None):
+    """
+    Decides whether a single traveller's entry into Kanadia should be accepted. See decide for the business rules.
+
+    :param person: a person's application in the form of a dictionary
+    :param countries: a dictionary of country_codes with information like if a country has a medical advisory or not,
+      or a CountryIndex.
+    :param reference_date: the date visas are checked against; defaults to today
+    :param engine: the RuleEngine to decide with; defaults to DECISION_ENGINE
+    :return: "Accept", "Reject" or "Quarantine", as decided by the DECISION_RULES. Deciding many travellers is
+      faster with one CompiledValidator.
+    """
+    return CompiledValidator(countries, reference_date=reference_date, engine=engine).decide(person)
+
+
+def load_countries(countries_file):
+    """
+    Reads the countries file.
+
+    :param countries_file: The name of a JSON formatted file that contains country data
+    :return: a dictionary of country_codes with information like if a country has a medical advisory or not.
+    """
     with open(countries_file, "r") as countries_file:
         countries_content = countries_file.read()
-    countries = json.loads(countries_content)
+    return json.loads(countries_content)
 
-    decisions = []
 
-    for person in citizen_json:
-        reject = False
-        quarantine = False
-        accept = False
-        if not required_fields_exist(person):
-            reject = True
-        elif unknown_location_exists(person, countries):
-            reject = True
-        else:
-            if person["home"]["country"] == "KAN":  # if visitor's home is Kanadia (KAN)
-                accept = True
-            elif not visitor_from_country_requiring_visa(person, countries):
-                accept = True
-            elif visitor_from_country_requiring_visa(person, countries) and has_valid_visa(person):
-                accept = True
-            else:
-                reject = True
+def load_country_index(countries_file):
+    """
+    Reads the countries file into a CountryIndex. The index is cached by a CountriesProvider, and only rebuilt if the
+    file has changed since it was last read.
+
+    :param countries_file: The name of a JSON formatted file that contains country data
+    :return: a CountryIndex
+    """
+    path = os.path.abspath(countries_file)
+    provider = COUNTRY_PROVIDERS.get(path)
+    if provider is None:
+        provider = COUNTRY_PROVIDERS.setdefault(path, CountriesProvider(path))
+    return provider.current()
 
-            if travelled_via_country_with_medical_advisory(person, countries):
-                quarantine = True
 
-        if reject:
-            decisions.append("Reject")
-        elif quarantine:
-            decisions.append("Quarantine")
-        elif accept:
-            decisions.append("Accept")
+def file_signature(path):
+    """
+    :param path: name of a file
+    :return: a tuple that changes whenever the file is replaced or rewritten (inode, modification time and size)
+    """
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def iter_json_array(json_file, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Incrementally parses a file holding a top-level JSON array, yielding one element at a time. Only the element
+    being parsed (plus at most one chunk) is kept in memory.
+
+    :param json_file: an open text file
+    :param chunk_size: number of characters read at a time
+    :return: a generator of the decoded array elements
+    :raises ValueError: if the file is not a well formed JSON array
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    state = "open"  # one of: "open" ('[' due), "first" (value or ']'), "value", "separator" (',' or ']')
+    # Where json_value_end stopped in an element that does not fit in the buffer yet, None otherwise
+    scan = None
+
+    while True:
+        while pos < len(buf) and buf[pos] in JSON_WHITESPACE:
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                raise ValueError("Unexpected end of JSON array")
+            buf = json_file.read(chunk_size)
+            pos = 0
+            eof = len(buf) == 0
+            continue
+
+        char = buf[pos]
+        if state == "open":
+            if char != "[":
+                raise ValueError("Expected a JSON array")
+            state = "first"
+            pos += 1
+        elif char == "]" and state in ("first", "separator"):
+            # Like json.loads, accept nothing but whitespace after the array
+            rest = buf[pos + 1:]
+            while True:
+                if rest.strip(JSON_WHITESPACE):
+                    raise ValueError("Extra data after JSON array")
+                if eof:
+                    return
+                rest = json_file.read(chunk_size)
+                eof = len(rest) == 0
+        elif state == "separator":
+            if char != ",":
+                raise ValueError("Expected ',' or ']' in JSON array")
+            state = "value"
+            pos += 1
         else:
-            raise
+            if scan is None:
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    if eof:
+                        raise
+                    end = None
+                # A number, true, false or null is only complete once the character after it has been read
+                if end is not None and (eof or isinstance(item, (str, list, dict)) or
+                                        (end < len(buf) and buf[end] in JSON_DELIMITERS)):
+                    yield item
+                    state = "separator"
+                    pos = end
+                    continue
+                scan = (pos, 0, False)
+            end, scan = json_value_end(buf, scan)
+            if end is None and not eof:
+                # Read at least as much as is buffered, so that a large element is copied a bounded number of times
+                more = json_file.read(max(chunk_size, len(buf) - pos))
+                eof = len(more) == 0
+                buf = buf[pos:] + more
+                scan = (scan[0] - pos,) + scan[1:]
+                pos = 0
+                continue
+            scan = None
+            item, end = decoder.raw_decode(buf, pos)
+            yield item
+            state = "separator"
+            pos = end
 
-    return decisions
+
+def json_value_end(buf, scan):
+    """
+    Finds where a JSON value ends, continuing from where an earlier call stopped on a shorter buffer.
+
+    :param buf: the buffer holding the value
+    :param scan: (position to continue from, depth of nested arrays and objects, whether inside a string)
+    :return: the position after the value, or None if the buffer ends first; and the scan to continue from (None if
+      the end was found)
+    """
+    pos, depth, in_string = scan
+    while True:
+        if in_string:
+            match = JSON_STRING_END_REGEX.search(buf, pos)
+            if match is None:
+                return None, (len(buf), depth, True)
+            if match.group() == "\\":
+                if match.end() == len(buf):
+                    return None, (match.start(), depth, True)
+                pos = match.end() + 1
+                continue
+            in_string = False
+            pos = match.end()
+            if depth == 0:
+                return pos, None
+        else:
+            match = JSON_TOKEN_REGEX.search(buf, pos)
+            if match is None:
+                return None, (len(buf), depth, False)
+            char = match.group()
+            pos = match.end()
+            if char == '"':
+                in_string = True
+            elif char in "[{":
+                depth += 1
+            elif char in "]}":
+                if depth == 0:
+                    return match.start(), None
+                depth -= 1
+                if depth == 0:
+                    return pos, None
+            elif depth == 0:
+                return match.start(), None
 
 
 def valid_passport_format(passport_number):
@@ -116,8 +550,7 @@ def valid_passport_format(passport_number):
     :param passport_number: string that represents a passport or visa number
     :return: True, if the string conforms to the valid regular expression, False otherwise.
     """
-    valid_regex = re.compile(r'^([\dA-Za-z]{5}-){4}[\dA-Za-z]{5}$')
-    valid_regex_match = valid_regex.search(passport_number)
+    valid_regex_match = PASSPORT_REGEX.search(passport_number)
     valid = True
     if valid_regex_match is None:
         valid = False
@@ -127,19 +560,32 @@ def valid_passport_format(passport_number):
 def travelled_via_country_with_medical_advisory(person, countries):
     """
     Checks to see if the traveller came from or through a country with a medical advisory
-    :param person: a person's application in the form of a dictionary. It is assumed that there is no missing
-    of required information and that the locations they travelled from or through are valid locations (in countries)
-    :param countries: a dictionary of country_codes with information like if a country has a medical advisory or not.
+    :param person: a person's application in the form of a dictionary, or a Traveller. It is assumed that there is
+    no missing of required information and that the locations they travelled from or through are valid locations
+    (in countries)
+    :param countries: a dictionary of country_codes with information like if a country has a medical advisory or not,
+    or a CountryIndex.
     :return: Returns True if the person travelled from or through a country with a medical advisory, False otherwise.
     """
-    travelled_through_country_with_medical_advisory = False
+    if isinstance(countries, CountryIndex):
+        flags = countries.flags
+        if isinstance(person, Traveller):
+            country_codes = person.travel_countries()
+        else:
+            country_codes = [person[item]['country'] for item in LOCATION_FIELDS[1:] if item in person]
+        for country_code in country_codes:
+            if flags[country_code] & MEDICAL_ADVISORY:
+                return True
+        return False
+    if isinstance(person, Traveller):
+        return travelled_via_country_with_medical_advisory(person, CountryIndex(countries))
     location_fields_to_check = LOCATION_FIELDS[1:]     # Skips checking 'home'
     for item in location_fields_to_check:
         if item in person:
-            country_code = person[item]['country']
-            if countries[country_code]['medical_advisory'] != "":
-                travelled_through_country_with_medical_advisory = True
-    return travelled_through_country_with_medical_advisory
+            country = countries.get(person[item]['country'])
+            if country is not None and country['medical_advisory'] != "":
+                return True
+    return False
 
 
 def valid_visa_format(visa_code):
@@ -149,8 +595,7 @@ def valid_visa_format(visa_code):
     :return: Boolean; True if the format is valid, False otherwise
 
     """
-    valid_regex = re.compile(r'^[\dA-Za-z]{5}-[\dA-Za-z]{5}$')
-    valid_regex_match = valid_regex.search(visa_code)
+    valid_regex_match = VISA_REGEX.search(visa_code)
     valid = True
     if valid_regex_match is None:
         valid = False
@@ -163,8 +608,7 @@ def valid_date_format(date_string):
     :param date_string: date to be checked
     :return: Boolean True if the format is valid, False otherwise
     """
-    valid_regex = re.compile(r'^\d{4}(-\d{2}){2}$')
-    valid_regex_match = valid_regex.search(date_string)
+    valid_regex_match = DATE_REGEX.search(date_string)
     valid = True
     if valid_regex_match is None:
         valid = False
@@ -184,20 +628,23 @@ def valid_date_format(date_string):
     return valid
 
 
-def has_valid_visa(person):
+def has_valid_visa(person, reference_date=None):
     """
     This function checks to see if the traveller has a visa that is valid, as defined by having a visa number of five
     groups of alphanumeric characters (case-insensitive), separated by dashes, and a date within the past two years.
 
-    :param person: a person's application in the form of a dictionary. It is assumed that there is no missing
-    of required information.
+    :param person: a person's application in the form of a dictionary, or a Traveller. It is assumed that there is
+    no missing of required information.
+    :param reference_date: the date the visa is checked against; defaults to today
     :return: True, if the visa code is valid and the date is not more than 2 years, False otherwise.
     """
+    if isinstance(person, Traveller):
+        return person.visa_ok and person.visa_day > years_before(as_reference_date(reference_date), 2).toordinal()
     valid_visa = False
     if "visa" in person:
         if "code" in person["visa"] and "date" in person["visa"]:
             valid_visa = valid_visa_format(person["visa"]["code"]) and \
-                         not is_more_than_x_years_ago(2, person["visa"]["date"])
+                         not is_more_than_x_years_ago(2, person["visa"]["date"], reference_date)
     return valid_visa
 
 
@@ -205,12 +652,19 @@ def visitor_from_country_requiring_visa(person, countries):
     """
     Checks to see if the traveller requires a visa to enter as determined by the home country and the list of countries
     provided by the ministry. We assume that the person's home town is a valid country and is not from Kanadia.
-    :param person: a person's application in the form of a dictionary. It is assumed that there is no missing
-    of required information and that the locations they travelled from or through are valid locations (in countries)
-    :param countries: a dictionary of country_codes with information like if a country has a medical advisory or not.
+    :param person: a person's application in the form of a dictionary, or a Traveller. It is assumed that there is no
+    missing of required information and that the locations they travelled from or through are valid locations (in
+    countries)
+    :param countries: a dictionary of country_codes with information like if a country has a medical advisory or not,
+    or a CountryIndex.
     :return: Returns True if the person requires a visa to enter Kanadia, False otherwise.
     """
-    country_code = person["home"]["country"]
+    if isinstance(person, Traveller):
+        country_code = person.home_country
+    else:
+        country_code = person["home"]["country"]
+    if isinstance(countries, CountryIndex):
+        return countries.flags[country_code] & VISA_REQUIRED != 0
     return countries[country_code]["visitor_visa_required"] == "1"
 
 
@@ -218,31 +672,35 @@ def unknown_location_exists(person, countries):
     """
     Checks to see if the traveller has any location field be unknown. With the exception of Kanadia (KAN), the
     remaining countries should be listed in the dictionary of countries.
-    :param person: a person's application in the form of a dictionary. It is assumed that there is no missing
-    required information.
-    :param countries: a dictionary of country_codes.
+    :param person: a person's application in the form of a dictionary, or a Traveller. It is assumed that there is
+    no missing required information.
+    :param countries: a dictionary of country_codes, or a CountryIndex.
     :return: Returns True if the person has a location that is unknown, False otherwise.
     """
+    if isinstance(person, Traveller):
+        country_codes = (person.home_country,) + person.travel_countries()
+        return any(code not in countries and code != HOME_COUNTRY_CODE for code in country_codes)
     unknown_location_found = False
     for item in LOCATION_FIELDS:
         if item in person:
             country_code = person[item]["country"]
-            if country_code not in countries and country_code != "KAN":
+            if country_code not in countries and country_code != HOME_COUNTRY_CODE:
                 unknown_location_found = True
                 break
     return unknown_location_found
 
 
 def required_fields_exist(person):
-    satisfy = True
+    if isinstance(person, Traveller):
+        return True     # checked by parse_traveller
     for field in REQUIRED_FIELDS:
         if field not in person:
-            satisfy = False
-    for field in person:
-        if field in LOCATION_FIELDS:
+            return False
+    for field in LOCATION_FIELDS:
+        if field in person:
             if not valid_location_field(person[field]):
-                satisfy = False
-    return satisfy
+                return False
+    return True
 
 
 def valid_location_field(location):
@@ -260,3 +718,1486 @@ def valid_location_field(location):
             if item not in location:
                 valid = False
     return valid
+
+
+##################
+# COUNTRY INDEX ##
+##################
+class CountryIndex(object):
+    """
+    The countries table reduced to what decide needs: a dictionary mapping each known country code, including
+    Kanadia's, to an int of bit flags (VISA_REQUIRED, TRANSIT_VISA_REQUIRED, MEDICAL_ADVISORY and HOME_COUNTRY).
+
+    Example:
+    > index = CountryIndex(countries)
+    > index.flags["LUG"] & MEDICAL_ADVISORY != 0
+    True
+    """
+
+    def __init__(self, countries, version=0):
+        """
+        :param countries: a dictionary of country_codes with information like if a country has a medical advisory or
+          not, as read from countries.json
+        :param version: version of the countries table, see CountriesProvider
+        """
+        flags = {}
+        for code in countries:
+            country = countries[code]
+            country_flags = 0
+            if country.get("visitor_visa_required") == "1":
+                country_flags |= VISA_REQUIRED
+            if country.get("transit_visa_required") == "1":
+                country_flags |= TRANSIT_VISA_REQUIRED
+            if country.get("medical_advisory", "") != "":
+                country_flags |= MEDICAL_ADVISORY
+            flags[code] = country_flags
+        flags[HOME_COUNTRY_CODE] = flags.get(HOME_COUNTRY_CODE, 0) | HOME_COUNTRY
+        self.flags = flags
+        self.version = version
+        self.ids = None
+
+    @classmethod
+    def of(cls, countries):
+        """
+        :param countries: a CountryIndex, or a dictionary of country_codes
+        :return: countries itself if it is a CountryIndex, otherwise a new CountryIndex built from it
+        """
+        if isinstance(countries, cls):
+            return countries
+        return cls(countries)
+
+    def __contains__(self, country_code):
+        """
+        :param country_code: a country code
+        :return: True if the country is known (Kanadia always is)
+        """
+        return country_code in self.flags
+
+    def country_ids(self):
+        """
+        :return: a dictionary mapping each known country code to its id in COUNTRY_IDS, interning the codes the first
+          time it is called
+        """
+        if self.ids is None:
+            self.ids = dict((code, country_id(code)) for code in self.flags)
+        return self.ids
+
+
+class CountriesProvider(object):
+    """
+    Keeps the CountryIndex of a countries file up to date without restarting anything that uses it. The file's
+    inode, modification time and size are checked (at most every check_interval seconds); when they change, the file
+    is parsed into a new CountryIndex with the next version number, which then replaces the current one in a single
+    assignment. Callers holding an older index keep using it unchanged, so a batch started on one version finishes on
+    it. A file that cannot be parsed (e.g. half written) is ignored until the next check.
+
+    Example:
+    > provider = CountriesProvider("countries.json", check_interval=1.0)
+    > index = provider.current()    # take one snapshot per batch
+    """
+
+    def __init__(self, countries_file, check_interval=0.0):
+        """
+        :param countries_file: The name of a JSON formatted file that contains country data
+        :param check_interval: minimum number of seconds between two checks of the file
+        """
+        self.path = os.path.abspath(countries_file)
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.index = None
+        self.signature = None
+        self.version = 0
+        self.checked = None
+        self.refresh()
+
+    def current(self):
+        """
+        :return: the latest CountryIndex, reloading the file first if it has changed
+        """
+        if self.checked is None or time.monotonic() - self.checked >= self.check_interval:
+            self.refresh()
+        return self.index
+
+    def refresh(self):
+        """
+        Reload the file if it has changed.
+
+        :return: True if a new version was loaded, False otherwise
+        """
+        try:
+            signature = file_signature(self.path)
+        except OSError:
+            if self.index is None:
+                raise
+            return False
+        self.checked = time.monotonic()
+        if signature == self.signature:
+            return False
+
+        with self.lock:
+            if signature == self.signature:
+                return False
+            try:
+                countries = load_countries(self.path)
+                changed_while_reading = file_signature(self.path) != signature
+            except (OSError, ValueError):
+                if self.index is None:
+                    raise
+                return False
+            if changed_while_reading and self.index is not None:
+                return False
+            index = CountryIndex(countries, self.version + 1)
+            self.version = index.version
+            self.signature = signature
+            self.index = index
+        return True
+
+
+class Decision(str):
+    """
+    A decision ("Accept", "Reject" or "Quarantine"), which compares equal to the plain string, also recording the
+    version of the countries table it was made with.
+    """
+
+    def __new__(cls, value, version=0):
+        decision = str.__new__(cls, value)
+        decision.version = version
+        return decision
+
+    def __reduce__(self):
+        return Decision, (str(self), self.version)
+
+
+###################
+# DATE EVALUATOR ##
+###################
+class DateEvaluator(object):
+    """
+    Evaluates dates against one reference date, fixed when the evaluator is built, so that every traveller of a batch
+    is judged on the same day. Results are memoized in a bounded LRU cache, since many travellers share visa issue
+    dates.
+
+    Example:
+    > dates = DateEvaluator("2015-12-16")
+    > dates.is_more_than_x_years_ago(2, "2013-12-16")
+    True
+    """
+
+    def __init__(self, reference_date=None, cache_size=DATE_CACHE_SIZE):
+        """
+        :param reference_date: a datetime.date, a datetime.datetime or a "YYYY-mm-dd" string; defaults to today
+        :param cache_size: maximum number of results kept
+        """
+        self.reference_date = as_reference_date(reference_date)
+        self.cutoffs = {}
+        self.cached = functools.lru_cache(maxsize=cache_size)(self.evaluate)
+
+    def is_more_than_x_years_ago(self, x, date_string):
+        """
+        Same as the is_more_than_x_years_ago function, against the reference date.
+
+        :param x: int representing years
+        :param date_string: a date string in format "YYYY-mm-dd"
+        :return: True if date is more than x years ago; False otherwise.
+        """
+        return self.cached(x, date_string)
+
+    def evaluate(self, x, date_string):
+        """
+        Uncached is_more_than_x_years_ago.
+        """
+        if x not in self.cutoffs:
+            self.cutoffs[x] = years_before(self.reference_date, x)
+        return parse_date(date_string) <= self.cutoffs[x]
+
+
+#######################
+# COMPILED VALIDATOR ##
+#######################
+class CompiledValidator(object):
+    """
+    Decides travellers against a fixed countries table. Everything that does not depend on the traveller (the
+    required fields, and the CountryIndex telling which countries are known, require a visa or have a medical
+    advisory) is worked out once when the validator is built. The business rules are its methods missing_field,
+    unknown_location, missing_visa and advisory_location, which take an application as a dictionary or as a
+    Traveller; the RuleEngine of the validator applies them as the DECISION_RULES.
+    """
+
+    def __init__(self, countries, required_fields=REQUIRED_FIELDS, location_fields=LOCATION_FIELDS,
+                 required_fields_location=REQUIRED_FIELDS_LOCATION, reference_date=None, stats=None, engine=None):
+        """
+        :param countries: a CountryIndex, or a dictionary of country_codes with information like if a country has a
+          medical advisory or not.
+        :param required_fields: fields every traveller must have
+        :param location_fields: fields holding a location; the first one is the traveller's home
+        :param required_fields_location: fields every location must have
+        :param reference_date: the date visas are checked against; defaults to today
+        :param stats: a DecisionStats to record rule timings and decision reasons in; without one, decide runs with
+          no instrumentation at all
+        :param engine: the RuleEngine applying the rules; defaults to DECISION_ENGINE
+        """
+        self.required_fields = tuple(required_fields)
+        self.location_fields = tuple(location_fields)
+        self.travel_fields = self.location_fields[1:]
+        self.required_fields_location = tuple(required_fields_location)
+        index = CountryIndex.of(countries)
+        self.flags = index.flags
+        self.version = index.version
+        self.dates = DateEvaluator(reference_date)
+        self.cutoff = years_before(self.dates.reference_date, 2).toordinal()
+        self.id_flags = [0]
+        self.engine = DECISION_ENGINE if engine is None else engine
+        self.decisions = dict((outcome, Decision(outcome, index.version)) for outcome in DECISION_CODES)
+        self.stats = stats
+        if stats is not None:
+            self.decide = self.decide_instrumented
+
+    def decide(self, person):
+        """
+        Decides whether a traveller's entry into Kanadia should be accepted. See decide for the business rules.
+
+        :param person: a person's application in the form of a dictionary, or a Traveller
+        :return: a Decision: "Accept", "Reject" or "Quarantine"
+        """
+        return self.decisions[self.engine.decide(person, self)]
+
+    def decide_instrumented(self, person):
+        """
+        Same as decide, but times each rule and records the decision, with the reason for a Reject or Quarantine, in
+        the DecisionStats of the validator. Used in place of decide when the validator has one.
+
+        :param person: a person's application in the form of a dictionary, or a Traveller
+        :return: a Decision: "Accept", "Reject" or "Quarantine"
+        """
+        stats = self.stats
+        clock = time.perf_counter
+        outcome = self.engine.default
+        reason = None
+        for rule in self.engine.rules_in_order():
+            start = clock()
+            reason = rule.check(self, person)
+            stats.record_rule(rule.name, clock() - start)
+            if reason is not None:
+                outcome = rule.outcome
+                break
+        decision = self.decisions[outcome]
+        stats.record_decision(person, decision, reason)
+        return decision
+
+    def decide_batch(self, records):
+        """
+        Same as decide on each record. With NumPy, when the validator applies the DECISION_RULES of DECISION_ENGINE
+        without a DecisionStats, the Travellers among the records are decided together: their TravellerColumns are
+        looked up in an array of the flags of every country id, and the rules are array operations over the whole
+        batch (see decide_columns). Applications kept as dictionaries, which did not fit the schema of Traveller, go
+        through decide one by one.
+
+        :param records: list of Travellers, or of applications in the form of dictionaries
+        :return: list of Decisions, one per record
+        """
+        if numpy is None or self.stats is not None or self.engine is not DECISION_ENGINE:
+            return [self.decide(record) for record in records]
+        columns = TravellerColumns(records)
+        by_code = [None] * (max(DECISION_NAMES) + 1)
+        for code in DECISION_NAMES:
+            by_code[code] = self.decisions[DECISION_NAMES[code]]
+        decided = [by_code[code] for code in self.decide_columns(columns).tolist()]
+        if len(decided) == len(records):
+            return decided
+
+        decisions = [None] * len(records)
+        for position, decision in zip(columns.positions, decided):
+            decisions[position] = decision
+        for position, record in enumerate(records):
+            if decisions[position] is None:
+                decisions[position] = self.decide(record)
+        return decisions
+
+    def decide_columns(self, columns):
+        """
+        The DECISION_RULES over TravellerColumns: a location in a country that is not in the table, or a home country
+        requiring a visa (other than Kanadia) without a well formed visa dated after the cutoff, is a Reject;
+        otherwise a from or via country with a medical advisory is a Quarantine. The completeness of the
+        applications was checked by parse_traveller.
+
+        :param columns: the TravellerColumns of a batch
+        :return: a NumPy array of the DECISION_CODES of the decisions, one per traveller
+        """
+        id_flags = numpy.array(self.country_flags(), dtype=numpy.int64)
+        home = id_flags[columns.home]
+        travel = id_flags[columns.origin] | id_flags[columns.via]
+        unknown = (home | travel) & UNKNOWN_LOCATION != 0
+        no_visa = (home & VISA_REQUIRED != 0) & (home & HOME_COUNTRY == 0) & \
+            ~(columns.visa_ok & (columns.visa_day > self.cutoff))
+        codes = numpy.full(len(home), DECISION_CODES["Accept"], dtype=numpy.int8)
+        codes[travel & MEDICAL_ADVISORY != 0] = DECISION_CODES["Quarantine"]
+        codes[unknown | no_visa] = DECISION_CODES["Reject"]
+        return codes
+
+    def missing_field(self, person):
+        """
+        :param person: a person's application in the form of a dictionary, or a Traveller
+        :return: why the application is incomplete, or None if it is not
+        """
+        if type(person) is Traveller:
+            return None     # checked by parse_traveller
+        for field in self.required_fields:
+            if field not in person:
+                return "missing " + field
+        required_fields_location = self.required_fields_location
+        for field in self.location_fields:
+            if field in person:
+                location = person[field]
+                if len(location) != len(required_fields_location):
+                    return "incomplete " + field
+                for item in required_fields_location:
+                    if item not in location:
+                        return "incomplete " + field
+        return None
+
+    def unknown_location(self, person):
+        """
+        :param person: a person's application in the form of a dictionary, with no missing information, or a
+          Traveller
+        :return: which location is unknown, or None if all are known
+        """
+        if type(person) is Traveller:
+            id_flags = self.country_flags()
+            if not (id_flags[person.home] | id_flags[person.origin] | id_flags[person.via]) & UNKNOWN_LOCATION:
+                return None
+            for field, country in zip(LOCATION_FIELDS, (person.home, person.origin, person.via)):
+                if id_flags[country] & UNKNOWN_LOCATION:
+                    return "unknown " + field + " country " + COUNTRY_CODES[country]
+        flags = self.flags
+        for field in self.location_fields:
+            if field in person and person[field]["country"] not in flags:
+                return "unknown " + field + " country " + str(person[field]["country"])
+        return None
+
+    def missing_visa(self, person):
+        """
+        :param person: a person's application in the form of a dictionary, or a Traveller, with no missing
+          information and no unknown location
+        :return: "no valid visa" if the traveller's home country requires a visa and the traveller has no valid
+          one, or None. Kanadia's citizens never need one.
+        """
+        if type(person) is Traveller:
+            home_flags = self.country_flags()[person.home]
+        else:
+            home_flags = self.flags[person["home"]["country"]]
+        if home_flags & VISA_REQUIRED and not home_flags & HOME_COUNTRY and not self.has_valid_visa(person):
+            return "no valid visa"
+        return None
+
+    def advisory_location(self, person):
+        """
+        :param person: a person's application in the form of a dictionary, or a Traveller, with no missing
+          information and no unknown location
+        :return: which location the traveller came from or through has a medical advisory, or None
+        """
+        if type(person) is Traveller:
+            id_flags = self.country_flags()
+            if not (id_flags[person.origin] | id_flags[person.via]) & MEDICAL_ADVISORY:
+                return None
+            for field, country in zip(LOCATION_FIELDS[1:], (person.origin, person.via)):
+                if id_flags[country] & MEDICAL_ADVISORY:
+                    return "medical advisory in " + field + " country " + COUNTRY_CODES[country]
+        flags = self.flags
+        for field in self.travel_fields:
+            if field in person and flags[person[field]["country"]] & MEDICAL_ADVISORY:
+                return "medical advisory in " + field + " country " + person[field]["country"]
+        return None
+
+    def has_valid_visa(self, person):
+        """
+        Same as the has_valid_visa function, using the precompiled visa pattern.
+
+        :param person: a person's application in the form of a dictionary, or a Traveller
+        :return: True, if the visa code is valid and the date is not more than 2 years, False otherwise.
+        """
+        if type(person) is Traveller:
+            return person.visa_ok and person.visa_day > self.cutoff
+        if "visa" not in person:
+            return False
+        visa = person["visa"]
+        if "code" not in visa or "date" not in visa:
+            return False
+        return VISA_REGEX.search(visa["code"]) is not None and not self.dates.is_more_than_x_years_ago(2, visa["date"])
+
+    def country_flags(self):
+        """
+        :return: the flags of every country id of COUNTRY_IDS, as a list: UNKNOWN_LOCATION for countries not in the
+          table, and 0 for id 0 (no location)
+        """
+        if len(self.id_flags) < len(COUNTRY_CODES):
+            codes = COUNTRY_CODES[1:]
+            self.id_flags = [0] + [self.flags.get(code, UNKNOWN_LOCATION) for code in codes]
+        return self.id_flags
+
+
+class DecisionStats(object):
+    """
+    Counters and cumulative timers for the rules applied by decide, the number of each decision, and how often each
+    reason led to a Reject or Quarantine. Hooks are called with every decision.
+
+    Example:
+    > stats = DecisionStats()
+    > stats.add_hook(lambda person, decision, reason: log(decision, reason))
+    > decide("travellers.json", "countries.json", stats=stats)
+    > stats.snapshot()["rules"]["has_valid_visa"]
+    {"calls": 1234, "seconds": 0.0021}
+    """
+
+    def __init__(self):
+        self.rule_calls = dict((rule, 0) for rule in RULES)
+        self.rule_seconds = dict((rule, 0.0) for rule in RULES)
+        self.outcomes = {"Accept": 0, "Reject": 0, "Quarantine": 0}
+        self.reasons = {}
+        self.hooks = []
+
+    def add_hook(self, hook):
+        """
+        :param hook: a function called as hook(person, decision, reason) after each decision; reason is None for an
+          Accept
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """
+        :param hook: a function given to add_hook
+        """
+        self.hooks.remove(hook)
+
+    def record_rule(self, rule, seconds):
+        """
+        :param rule: name of the rule, one of RULES for the DECISION_RULES
+        :param seconds: time spent applying it to one traveller
+        """
+        self.rule_calls[rule] = self.rule_calls.get(rule, 0) + 1
+        self.rule_seconds[rule] = self.rule_seconds.get(rule, 0.0) + seconds
+
+    def record_decision(self, person, decision, reason):
+        """
+        :param person: the application that was decided
+        :param decision: "Accept", "Reject" or "Quarantine"
+        :param reason: why the traveller was rejected or quarantined, None for an Accept
+        """
+        self.outcomes[decision] += 1
+        if reason is not None:
+            key = decision + ": " + reason
+            self.reasons[key] = self.reasons.get(key, 0) + 1
+        for hook in self.hooks:
+            hook(person, decision, reason)
+
+    def snapshot(self):
+        """
+        :return: a copy of the statistics: {"rules": {rule: {"calls": n, "seconds": s}}, "outcomes": {decision: n},
+          "reasons": {"Reject: no valid visa": n, ...}}
+        """
+        rules = {}
+        for rule in self.rule_calls:
+            rules[rule] = {"calls": self.rule_calls[rule], "seconds": self.rule_seconds[rule]}
+        return {"rules": rules, "outcomes": dict(self.outcomes), "reasons": dict(self.reasons)}
+
+
+#######################
+# TRAVELLER RECORDS ##
+#######################
+class Traveller(object):
+    """
+    A traveller's application checked against the schema once, when it is read (see parse_traveller), and kept in a
+    compact form: the required text fields, the home, from and via countries as ids of COUNTRY_IDS (via is 0 if the
+    traveller came directly; see CountryIndex.country_ids), and the visa reduced to whether its code is well formed
+    and its date as a day number. Cities and regions, which no rule looks at, are not kept.
+    """
+    __slots__ = ("passport", "first_name", "last_name", "birth_date", "entry_reason", "home", "origin", "via",
+                 "visa_code", "visa_ok", "visa_day")
+
+    def __init__(self, passport, first_name, last_name, birth_date, entry_reason, home, origin, via=0,
+                 visa_code=None, visa_ok=False, visa_day=0):
+        self.passport = passport
+        self.first_name = first_name
+        self.last_name = last_name
+        self.birth_date = birth_date
+        self.entry_reason = entry_reason
+        self.home = home
+        self.origin = origin
+        self.via = via
+        self.visa_code = visa_code
+        self.visa_ok = visa_ok
+        self.visa_day = visa_day
+
+    @property
+    def home_country(self):
+        return COUNTRY_CODES[self.home]
+
+    def travel_countries(self):
+        """
+        :return: the codes of the countries the traveller came from and through
+        """
+        if self.via:
+            return COUNTRY_CODES[self.origin], COUNTRY_CODES[self.via]
+        return COUNTRY_CODES[self.origin],
+
+
+class TravellerColumns(object):
+    """
+    The fields the rules read of the Travellers of a batch, one NumPy array per field: home, origin and via (country
+    ids), visa_ok and visa_day. positions holds where each Traveller is in the batch; the other records, kept as
+    dictionaries, are not in the columns.
+    """
+
+    def __init__(self, records):
+        """
+        :param records: list of Travellers, or of applications in the form of dictionaries
+        """
+        travellers = [record for record in records if type(record) is Traveller]
+        if len(travellers) == len(records):
+            self.positions = range(len(records))
+        else:
+            self.positions = [position for position, record in enumerate(records) if type(record) is Traveller]
+        count = len(travellers)
+        self.home = numpy.fromiter(map(attrgetter("home"), travellers), numpy.int64, count)
+        self.origin = numpy.fromiter(map(attrgetter("origin"), travellers), numpy.int64, count)
+        self.via = numpy.fromiter(map(attrgetter("via"), travellers), numpy.int64, count)
+        self.visa_ok = numpy.fromiter(map(attrgetter("visa_ok"), travellers), bool, count)
+        self.visa_day = numpy.fromiter(map(attrgetter("visa_day"), travellers), numpy.int64, count)
+
+    def __len__(self):
+        return len(self.positions)
+
+
+def parse_traveller(person, countries):
+    """
+    Checks an application against the schema of Traveller and converts it. Applications that do not fit (missing
+    fields, incomplete locations, or anything a dictionary-based rule might fail on, such as a malformed visa date)
+    are returned unchanged, to be decided as dictionaries with the same result as before. So are applications with a
+    location in a country that is not in countries: their country codes are not interned, and are kept in the
+    dictionary for an IncrementalDecider to find them if the country is added later.
+
+    :param person: a person's application in the form of a dictionary
+    :param countries: the CountryIndex whose country codes are interned
+    :return: a Traveller, or person itself
+    """
+    if type(person) is not dict or not person.keys() >= TRAVELLER_FIELDS:
+        return person
+    ids = countries.country_ids()
+    home = location_id(person["home"], ids)
+    origin = location_id(person["from"], ids)
+    via = location_id(person["via"], ids) if "via" in person else 0
+    if home is None or origin is None or via is None:
+        return person
+
+    visa_code = None
+    visa_ok = False
+    visa_day = 0
+    if "visa" in person:
+        visa = person["visa"]
+        if type(visa) is not dict:
+            return person
+        if "code" in visa and "date" in visa:
+            visa_code = visa["code"]
+            if type(visa_code) is not str or type(visa["date"]) is not str:
+                return person
+            try:
+                visa_day = date_ordinal(visa["date"])
+            except ValueError:
+                return person
+            visa_ok = VISA_REGEX.search(visa_code) is not None
+
+    entry_reason = person["entry_reason"]
+    if type(entry_reason) is str:
+        entry_reason = sys.intern(entry_reason)
+    return Traveller(person["passport"], person["first_name"], person["last_name"], person["birth_date"], entry_reason,
+                     home, origin, via, visa_code, visa_ok, visa_day)
+
+
+def location_id(location, ids):
+    """
+    :param location: a location field of an application
+    :param ids: a dictionary mapping country codes to their ids, see CountryIndex.country_ids
+    :return: the id of its country code, or None if the location is incomplete or its country is not in ids
+    """
+    if type(location) is not dict or location.keys() != LOCATION_KEYS:
+        return None
+    code = location["country"]
+    if type(code) is not str:
+        return None
+    return ids.get(code)
+
+
+def country_id(country_code):
+    """
+    :param country_code: a country code
+    :return: the integer id of the country code in COUNTRY_IDS, adding it if it is new
+    """
+    country_id = COUNTRY_IDS.get(country_code)
+    if country_id is None:
+        with COUNTRY_IDS_LOCK:
+            country_id = COUNTRY_IDS.get(country_code)
+            if country_id is None:
+                country_id = len(COUNTRY_CODES)
+                COUNTRY_CODES.append(country_code)
+                COUNTRY_IDS[country_code] = country_id
+    return country_id
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def date_ordinal(date_string):
+    """
+    :param date_string: a date string in format "YYYY-mm-dd"
+    :return: the date as a day number (datetime.date.toordinal)
+    :raises ValueError: if the string is not a valid date
+    """
+    return parse_date(date_string).toordinal()
+
+
+def load_travellers(input_file, countries):
+    """
+    Reads a traveller file into Travellers, one application at a time, so that only the compact records are held in
+    memory.
+
+    :param input_file: The name of a JSON formatted file that contains cases to decide
+    :param countries: a CountryIndex, or a dictionary of country_codes; see parse_traveller
+    :return: list of Travellers (and dictionaries, for the applications that do not fit the schema)
+    """
+    countries = CountryIndex.of(countries)
+    with open(input_file, "r") as citizen_file:
+        return [parse_traveller(person, countries) for person in iter_json_array(citizen_file)]
+
+
+def decide_typed(input_file, countries_file, reference_date=None):
+    """
+    Same as decide, but each traveller is read into a Traveller first, and they are decided as a batch (see
+    CompiledValidator.decide_batch).
+
+    :param input_file: The name of a JSON formatted file that contains cases to decide
+    :param countries_file: The name of a JSON formatted file that contains country data
+    :param reference_date: the date visas are checked against; defaults to today. See decide.
+    :return: List of strings. Possible values of strings are: "Accept", "Reject", and "Quarantine"
+    """
+    index = load_country_index(countries_file)
+    validator = CompiledValidator(index, reference_date=reference_date)
+    return validator.decide_batch(load_travellers(input_file, index))
+
+
+###########################
+# INCREMENTAL DECISIONS ##
+###########################
+class IncrementalDecider(object):
+    """
+    Keeps the decisions for a day's travellers up to date as the countries table changes, without deciding everyone
+    again. An inverted index maps each country code to the travellers whose home, from or via location is in that
+    country; when countries change, only the travellers referring to a country whose flags (visa required, medical
+    advisory...) changed are decided again, so the cost is proportional to the number of travellers affected.
+    Travellers kept as dictionaries whose locations cannot be read (see parse_traveller) are decided again every time.
+
+    Example:
+    > countries = load_countries("countries.json")
+    > decider = IncrementalDecider(load_travellers("travellers.json", countries), countries)
+    > flips = decider.apply({"LUG": dict(countries["LUG"], medical_advisory="")})
+    > for position in flips:
+    >     print(position, flips[position], decider.decisions[position])
+    17 Quarantine Accept
+    """
+
+    def __init__(self, travellers, countries, reference_date=None):
+        """
+        :param travellers: list of Travellers, or of applications in the form of dictionaries
+        :param countries: a dictionary of country_codes, as read from countries.json
+        :param reference_date: the date visas are checked against, fixed for the life of the decider; defaults to
+          today
+        """
+        self.countries = dict(countries)
+        self.reference_date = as_reference_date(reference_date)
+        self.index = CountryIndex(self.countries)
+        self.travellers = [parse_traveller(person, self.index) for person in travellers]
+        self.validator = CompiledValidator(self.index, reference_date=self.reference_date)
+        self.decisions = self.validator.decide_batch(self.travellers)
+        self.recomputed = len(self.travellers)
+
+        self.by_country = {}
+        self.unindexed = []
+        for position, record in enumerate(self.travellers):
+            codes = traveller_countries(record)
+            if codes is None:
+                self.unindexed.append(position)
+            else:
+                for code in codes:
+                    positions = self.by_country.setdefault(code, [])
+                    if not positions or positions[-1] != position:
+                        positions.append(position)
+
+    @classmethod
+    def load(cls, input_file, countries_file, reference_date=None):
+        """
+        :param input_file: The name of a JSON formatted file that contains cases to decide
+        :param countries_file: The name of a JSON formatted file that contains country data
+        :param reference_date: the date visas are checked against; defaults to today
+        :return: an IncrementalDecider
+        """
+        countries = load_countries(countries_file)
+        return cls(load_travellers(input_file, countries), countries, reference_date)
+
+    def update(self, countries):
+        """
+        :param countries: the new dictionary of country_codes, as read from countries.json
+        :return: the decisions that changed, see apply
+        """
+        return self.apply(countries_diff(self.countries, countries))
+
+    def apply(self, changes):
+        """
+        Applies a diff to the countries table and decides again the travellers it may affect.
+
+        :param changes: a dictionary mapping each changed country code to its new entry, or to None if the country
+          was removed
+        :return: a dictionary mapping the position of each traveller whose decision changed, in order, to its old
+          decision; the new one is in decisions
+        """
+        countries = dict(self.countries)
+        for code, country in changes.items():
+            if country is None:
+                countries.pop(code, None)
+            else:
+                countries[code] = country
+        index = CountryIndex(countries, self.index.version + 1)
+        changed = [code for code in changes if self.index.flags.get(code) != index.flags.get(code)]
+
+        groups = [self.by_country[code] for code in changed if code in self.by_country]
+        if self.unindexed:
+            groups.append(self.unindexed)
+        if len(groups) == 1:
+            affected = groups[0]
+        else:
+            affected = sorted(set().union(*groups))
+
+        self.countries = countries
+        self.index = index
+        self.validator = CompiledValidator(index, reference_date=self.reference_date)
+        travellers = self.travellers
+        decisions = self.decisions
+        flips = {}
+        decided = self.validator.decide_batch([travellers[position] for position in affected])
+        for position, new in zip(affected, decided):
+            old = decisions[position]
+            if new != old:
+                flips[position] = old
+            decisions[position] = new
+        self.recomputed = len(affected)
+        return flips
+
+
+def traveller_countries(record):
+    """
+    :param record: a Traveller, or a person's application in the form of a dictionary
+    :return: the country codes of the record's locations, or None if they cannot be read
+    """
+    if type(record) is Traveller:
+        return (record.home_country,) + record.travel_countries()
+    codes = []
+    try:
+        for field in LOCATION_FIELDS:
+            if field in record:
+                code = record[field]["country"]
+                hash(code)
+                codes.append(code)
+    except (TypeError, LookupError):
+        return None
+    return codes
+
+
+def countries_diff(old_countries, new_countries):
+    """
+    :param old_countries: a dictionary of country_codes, as read from countries.json
+    :param new_countries: another one
+    :return: a dictionary mapping each country code whose entry differs to its new entry, or to None if it was
+      removed, as taken by IncrementalDecider.apply
+    """
+    changes = {}
+    for code in new_countries:
+        if old_countries.get(code) != new_countries[code]:
+            changes[code] = new_countries[code]
+    for code in old_countries:
+        if code not in new_countries:
+            changes[code] = None
+    return changes
+
+
+##########################
+# DUPLICATE TRAVELLERS ##
+##########################
+class PassportFilter(object):
+    """
+    Bloom filter of passport numbers: remembers a set of strings in a fixed number of bits, and tells for certain
+    that a string was never added, while a string that was may be mistaken for another one with a probability that
+    grows with the number of strings added. Each string sets hashes bits, a step apart, where the first bit and the
+    step are the two halves of its hash(); strings are hashed with hash(), so a filter is only meaningful in the
+    process that filled it.
+
+    Example:
+    > passports = PassportFilter()
+    > passports.add("JMZ0S-89IA9-OTCLY-MQILJ-P7CTY")
+    > "JMZ0S-89IA9-OTCLY-MQILJ-P7CTY" in passports
+    True
+    """
+
+    def __init__(self, bits=DEDUP_FILTER_BITS, hashes=DEDUP_FILTER_HASHES):
+        """
+        :param bits: number of bits of the filter
+        :param hashes: number of bits set for each string
+        """
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray((bits + 7) // 8)
+
+    def add(self, passport):
+        """
+        :param passport: a string to remember
+        """
+        value = hash(passport) & 0xFFFFFFFFFFFFFFFF
+        position = value & 0xFFFFFFFF
+        step = (value >> 32) | 1
+        bits = self.bits
+        array = self.array
+        for i in range(self.hashes):
+            position %= bits
+            array[position >> 3] |= 1 << (position & 7)
+            position += step
+
+    def __contains__(self, passport):
+        """
+        :param passport: a string
+        :return: False if passport was never added; True if it was, or, rarely, if it was not. Most passports that
+          were never added miss the first bit checked.
+        """
+        value = hash(passport) & 0xFFFFFFFFFFFFFFFF
+        position = value & 0xFFFFFFFF
+        step = (value >> 32) | 1
+        bits = self.bits
+        array = self.array
+        for i in range(self.hashes):
+            position %= bits
+            if not array[position >> 3] & (1 << (position & 7)):
+                return False
+            position += step
+        return True
+
+
+class Deduplicator(object):
+    """
+    Finds applications whose passport was already seen in a stream, such as those kiosks submit again after a
+    timeout. An application equal to the last one with the same passport (dictionaries are compared with ==, so the
+    order of their keys does not matter) is a duplicate and gets the same decision again, while a different
+    application with the same passport is a conflict, decided on its own and listed in conflicts.
+
+    Only the last max_passports passports (the least recently seen are dropped first) are kept with their application
+    and decision. Dropped passports go to a PassportFilter, so an application whose passport is no longer kept, but
+    was seen, is still noticed: it is a possible duplicate (the filter has rare false positives, and the earlier
+    application is gone), decided again and listed in possible_duplicates. Applications are only compared when their
+    passport is kept, and the filter is only asked when it is not, so new passports cost one dictionary lookup and
+    one filter lookup.
+
+    counts holds how many applications were found to be DUPLICATE_NEW, DUPLICATE_EXACT, DUPLICATE_CONFLICT and
+    DUPLICATE_POSSIBLE.
+
+    Example:
+    > deduplicator = Deduplicator()
+    > decide_deduplicated("travellers.json", "countries.json", deduplicator=deduplicator)
+    > deduplicator.counts
+    {"new": 9510, "duplicate": 470, "conflict": 10, "possible duplicate": 10}
+    """
+
+    def __init__(self, max_passports=DEDUP_MAX_PASSPORTS, filter_bits=DEDUP_FILTER_BITS):
+        """
+        :param max_passports: number of passports kept with their application and decision
+        :param filter_bits: number of bits of the PassportFilter of passports no longer kept
+        """
+        self.max_passports = max_passports
+        self.seen = OrderedDict()
+        self.dropped = PassportFilter(filter_bits)
+        self.counts = {DUPLICATE_NEW: 0, DUPLICATE_EXACT: 0, DUPLICATE_CONFLICT: 0, DUPLICATE_POSSIBLE: 0}
+        self.conflicts = []
+        self.possible_duplicates = []
+
+    def decide(self, person, validator, position=None):
+        """
+        Counts the application as DUPLICATE_NEW, DUPLICATE_EXACT, DUPLICATE_CONFLICT or DUPLICATE_POSSIBLE, and
+        remembers its decision in place of any earlier one with the same passport. Applications are kept as they are,
+        so they must not be changed afterwards.
+
+        :param person: an application in the form of a dictionary
+        :param validator: the CompiledValidator deciding applications that are not duplicates
+        :param position: index of the application in its file, listed in conflicts or possible_duplicates if it is
+          one
+        :return: "Accept", "Reject" or "Quarantine"
+        """
+        passport = person.get("passport") if isinstance(person, dict) else None
+        if not isinstance(passport, str):
+            self.counts[DUPLICATE_NEW] += 1
+            return validator.decide(person)
+
+        seen = self.seen
+        earlier = seen.get(passport)
+        if earlier is None:
+            if passport in self.dropped:
+                self.counts[DUPLICATE_POSSIBLE] += 1
+                self.possible_duplicates.append((position, passport))
+            else:
+                self.counts[DUPLICATE_NEW] += 1
+        else:
+            seen.move_to_end(passport)
+            if earlier[0] == person:
+                self.counts[DUPLICATE_EXACT] += 1
+                return earlier[1]
+            self.counts[DUPLICATE_CONFLICT] += 1
+            self.conflicts.append((position, passport))
+
+        decision = validator.decide(person)
+        seen[passport] = (person, decision)
+        if len(seen) > self.max_passports:
+            self.dropped.add(seen.popitem(last=False)[0])
+        return decision
+
+
+def decide_deduplicated(input_file, countries_file, reference_date=None, deduplicator=None):
+    """
+    Version of decide that streams the input file and decides an application identical to the last one with the
+    same passport only once. See Deduplicator.
+
+    :param input_file: The name of a JSON formatted file that contains cases to decide
+    :param countries_file: The name of a JSON formatted file that contains country data
+    :param reference_date: the date visas are checked against; defaults to today. See decide.
+    :param deduplicator: the Deduplicator to use, to read its counts and conflicts afterwards; defaults to a new one
+    :return: List of strings. Possible values of strings are: "Accept", "Reject", and "Quarantine"
+    """
+    if deduplicator is None:
+        deduplicator = Deduplicator()
+    validator = CompiledValidator(load_country_index(countries_file), reference_date=reference_date)
+    decisions = []
+    with open(input_file, "r") as citizen_file:
+        for position, person in enumerate(iter_json_array(citizen_file)):
+            decisions.append(deduplicator.decide(person, validator, position))
+    return decisions
+
+
+################
+# RULE ENGINE ##
+################
+class Rule(object):
+    """
+    A business rule of the RuleEngine: a check and the decision it leads to when it fires. Rules with a lower
+    priority are applied first, so the outcome of the first rule to fire is final. A check may assume that every rule
+    of a lower priority did not fire, but must not depend on rules of its own priority, which are reordered freely.
+
+    Example:
+    > Rule("unknown_location_exists", 1, "Reject", CompiledValidator.unknown_location)
+    """
+
+    def __init__(self, name, priority, outcome, check):
+        """
+        :param name: name of the rule
+        :param priority: int; rules are applied in increasing order of priority
+        :param outcome: "Reject", "Quarantine" or "Accept"
+        :param check: a function called as check(validator, person), where validator is the CompiledValidator
+          deciding; returns why the rule fires, as a string, or None if it does not
+        """
+        if outcome not in DECISION_CODES:
+            raise ValueError("Unknown outcome: " + str(outcome))
+        self.name = name
+        self.priority = priority
+        self.outcome = outcome
+        self.check = check
+        self.calls = 0
+        self.fires = 0
+        self.seconds = 0.0
+
+    def rank(self):
+        """
+        :return: sort key putting first the rules that, on average, settle a decision for the least time spent, i.e.
+          by seconds per fire; rules that never fired go last, cheapest first
+        """
+        if self.fires:
+            return 0, self.seconds / self.fires
+        return 1, self.seconds / max(self.calls, 1)
+
+
+class RuleEngine(object):
+    """
+    Applies Rules by priority and stops at the first one that fires; if none does, the default outcome is returned.
+    The first sample_size decisions apply every rule of a priority, to count how often each one fires and time it.
+    The rules of each priority are then reordered to put the most selective and cheapest first, and later decisions
+    stop as soon as the outcome is known.
+
+    Example:
+    > engine = RuleEngine(DECISION_RULES)
+    > CompiledValidator(countries, engine=engine).decide(person)
+    "Accept"
+    """
+
+    def __init__(self, rules, default="Accept", sample_size=RULE_SAMPLE_SIZE):
+        """
+        :param rules: iterable of Rules
+        :param default: the outcome when no rule fires
+        :param sample_size: number of decisions observed before the rules are reordered; 0 keeps the given order
+        """
+        self.rules = tuple(rules)
+        self.default = default
+        self.sample_size = sample_size
+        self.sampled = 0
+        self.tiers = self.group(sorted(self.rules, key=lambda rule: rule.priority))
+        self.steps = self.compile_steps()
+        if sample_size > 0:
+            self.decide = self.decide_sampling
+
+    @staticmethod
+    def group(rules):
+        """
+        :param rules: list of Rules sorted by priority
+        :return: tuple of lists of Rules, one list per priority
+        """
+        tiers = []
+        for rule in rules:
+            if tiers and tiers[-1][0].priority == rule.priority:
+                tiers[-1].append(rule)
+            else:
+                tiers.append([rule])
+        return tuple(tiers)
+
+    def compile_steps(self):
+        """
+        :return: tuple of the (check, outcome) of every rule, in the order they are applied
+        """
+        return tuple((rule.check, rule.outcome) for rule in self.rules_in_order())
+
+    def decide(self, person, validator):
+        """
+        :param person: a person's application in the form of a dictionary, or a Traveller
+        :param validator: the CompiledValidator the rules are checked with
+        :return: the outcome of the first rule to fire, or the default outcome
+        """
+        for check, outcome in self.steps:
+            if check(validator, person) is not None:
+                return outcome
+        return self.default
+
+    def decide_sampling(self, person, validator):
+        """
+        Same as decide, but applies every rule of a priority and records how often each fires and how long it takes.
+        Used in place of decide for the first sample_size decisions.
+        """
+        clock = time.perf_counter
+        outcome = None
+        for tier in self.tiers:
+            for rule in tier:
+                start = clock()
+                fired = rule.check(validator, person) is not None
+                rule.seconds += clock() - start
+                rule.calls += 1
+                if fired:
+                    rule.fires += 1
+                    if outcome is None:
+                        outcome = rule.outcome
+            if outcome is not None:
+                break
+
+        self.sampled += 1
+        if self.sampled >= self.sample_size:
+            self.reorder()
+        return self.default if outcome is None else outcome
+
+    def reorder(self):
+        """
+        Sorts the rules of each priority by Rule.rank, and stops sampling.
+        """
+        self.tiers = tuple(sorted(tier, key=Rule.rank) for tier in self.tiers)
+        self.steps = self.compile_steps()
+        vars(self).pop("decide", None)  # back to the short-circuiting RuleEngine.decide
+
+    def rules_in_order(self):
+        """
+        :return: list of the Rules, in the order they are applied
+        """
+        return [rule for tier in self.tiers for rule in tier]
+
+    def order(self):
+        """
+        :return: list of the names of the rules, in the order they are applied
+        """
+        return [rule.name for rule in self.rules_in_order()]
+
+
+# The business rules of decide: incomplete applications are rejected, then unknown locations, then missing visas,
+# then travellers from or through a country with a medical advisory are quarantined. Each rule relies on the ones
+# before it not firing (unknown_location reads locations that missing_field found complete, missing_visa looks up
+# the flags of a home country that unknown_location found known, and a Quarantine must not hide a Reject), so each
+# has its own priority and a RuleEngine never reorders them.
+DECISION_RULES = (Rule("required_fields_exist", 0, "Reject", CompiledValidator.missing_field),
+                  Rule("unknown_location_exists", 1, "Reject", CompiledValidator.unknown_location),
+                  Rule("has_valid_visa", 2, "Reject", CompiledValidator.missing_visa),
+                  Rule("travelled_via_country_with_medical_advisory", 3, "Quarantine",
+                       CompiledValidator.advisory_location))
+
+# Rule engine of every CompiledValidator not given one; it does not sample, so it never changes and every call
+# applies the rules in order
+DECISION_ENGINE = RuleEngine(DECISION_RULES, sample_size=0)
+
+
+###################
+# DECISION SINKS ##
+###################
+class DecisionSink(object):
+    """
+    Base class of the decision output sinks. Records are collected in memory and written out in blocks of about
+    buffer_size bytes, so that output costs a few large writes instead of one write per decision.
+    """
+    mode = "w"
+
+    def __init__(self, file_name, buffer_size=SINK_BUFFER_SIZE):
+        """
+        :param file_name: name of the file to write
+        :param buffer_size: approximate number of bytes collected before each write
+        """
+        self.file = open(file_name, self.mode, buffering=buffer_size)
+        self.buffer_size = buffer_size
+        self.pending = []
+        self.pending_size = 0
+        self.count = 0
+        self.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        """
+        Write whatever comes before the first record.
+        """
+        pass
+
+    def write(self, index, passport, decision):
+        """
+        :param index: position of the traveller in the input
+        :param passport: the traveller's passport number, or None if it is missing
+        :param decision: "Accept", "Reject" or "Quarantine"
+        """
+        record = self.format(index, passport, decision)
+        self.pending.append(record)
+        self.pending_size += len(record)
+        self.count += 1
+        if self.pending_size >= self.buffer_size:
+            self.flush()
+
+    def format(self, index, passport, decision):
+        """
+        :return: the record of one decision, as written to the file
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """
+        Write the collected records to the file.
+        """
+        if self.pending:
+            self.file.write(self.pending[0][:0].join(self.pending))
+            self.pending = []
+            self.pending_size = 0
+
+    def close(self):
+        """
+        Write the remaining records and close the file.
+        """
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+class JsonLinesSink(DecisionSink):
+    """
+    Writes one JSON object per line: {"index": 0, "passport": "...", "decision": "Accept", "version": 1}.
+    """
+
+    def format(self, index, passport, decision):
+        return json.dumps({"index": index, "passport": passport, "decision": str(decision),
+                           "version": getattr(decision, "version", 0)}) + "\n"
+
+
+class CsvSink(DecisionSink):
+    """
+    Writes a CSV file with the columns index, passport, decision and version.
+    """
+
+    def __init__(self, file_name, buffer_size=SINK_BUFFER_SIZE):
+        self.line = CsvLine()
+        self.writer = csv.writer(self.line, lineterminator="\n")
+        DecisionSink.__init__(self, file_name, buffer_size)
+
+    def start(self):
+        self.file.write("index,passport,decision,version\n")
+
+    def format(self, index, passport, decision):
+        self.writer.writerow((index, "" if passport is None else passport, decision,
+                              getattr(decision, "version", 0)))
+        return self.line.pop()
+
+
+class CsvLine(object):
+    """
+    File-like object keeping the last line written by a csv.writer.
+    """
+
+    def __init__(self):
+        self.text = ""
+
+    def write(self, text):
+        self.text += text
+
+    def pop(self):
+        text = self.text
+        self.text = ""
+        return text
+
+
+class BinarySink(DecisionSink):
+    """
+    Writes the BINARY_MAGIC header followed by one byte per decision (see DECISION_CODES), in input order. Passport
+    numbers are not stored: a record's position in the file is the traveller's index.
+    """
+    mode = "wb"
+
+    def start(self):
+        self.file.write(BINARY_MAGIC)
+        self.pending = bytearray()
+
+    def write(self, index, passport, decision):
+        self.pending.append(DECISION_CODES[decision])
+        self.count += 1
+        if len(self.pending) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.file.write(self.pending)
+            self.pending = bytearray()
+
+
+def read_binary_decisions(file_name, chunk_size=SINK_BUFFER_SIZE):
+    """
+    Reads a file written by BinarySink.
+
+    :param file_name: name of the file
+    :param chunk_size: number of bytes read at a time
+    :return: a generator of the decisions, in input order
+    :raises ValueError: if the file does not start with BINARY_MAGIC
+    """
+    with open(file_name, "rb") as binary_file:
+        if binary_file.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError("Not a binary decisions file")
+        chunk = binary_file.read(chunk_size)
+        while chunk:
+            for code in chunk:
+                yield DECISION_NAMES[code]
+            chunk = binary_file.read(chunk_size)
+
+
+# Output sinks by format name
+SINKS = {"jsonl": JsonLinesSink, "csv": CsvSink, "binary": BinarySink}
+
+
+#####################
+# DECISION SERVICE ##
+#####################
+class DecisionService(object):
+    """
+    An asyncio service deciding travellers as they arrive, e.g. from border kiosks. Submissions are queued and
+    decided in micro-batches of up to batch_size travellers, each batch waiting at most batch_delay seconds for more
+    submissions, so latency stays bounded while the per-batch overhead is shared. The countries table is loaded once.
+
+    Example:
+    > async with DecisionService(load_country_index("countries.json")) as service:
+    >     decision = await service.submit(person)
+    """
+
+    def __init__(self, countries, batch_size=SERVICE_BATCH_SIZE, batch_delay=SERVICE_BATCH_DELAY,
+                 max_pending=SERVICE_MAX_PENDING, reference_date=None, stats=None):
+        """
+        :param countries: a CountriesProvider, whose latest version is taken for each batch, a CountryIndex, or a
+          dictionary of country_codes
+        :param batch_size: maximum number of travellers decided together
+        :param batch_delay: longest time, in seconds, a batch waits to fill up
+        :param max_pending: maximum number of queued submissions; submit waits while the queue is full
+        :param reference_date: the date visas are checked against; defaults to the current day, re-read every batch
+        :param stats: an optional DecisionStats. See decide.
+        """
+        if isinstance(countries, CountriesProvider):
+            self.provider = countries
+            countries = countries.current()
+        else:
+            self.provider = None
+        self.countries = CountryIndex.of(countries)
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_pending = max_pending
+        self.reference_date = reference_date
+        self.stats = stats
+        self.validator = CompiledValidator(self.countries, reference_date=reference_date, stats=stats)
+        self.queue = None
+        self.worker = None
+        self.failure = None
+        self.batches = 0
+        self.decided = 0
+
+    async def start(self):
+        """
+        Start deciding submissions. Must be called from within the event loop.
+        """
+        if self.worker is None:
+            self.queue = asyncio.Queue(self.max_pending)
+            self.worker = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        """
+        Decide the submissions already queued, then stop. Raises the error that stopped the service, if any.
+        """
+        if self.worker is not None:
+            try:
+                if not self.worker.done():
+                    await self.queue.put(None)
+                await self.worker
+            finally:
+                self.worker = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.stop()
+
+    async def submit(self, person):
+        """
+        Decide one traveller.
+
+        :param person: a person's application in the form of a dictionary
+        :return: "Accept", "Reject" or "Quarantine"
+        """
+        if self.worker is None:
+            raise RuntimeError("DecisionService is not started")
+        if self.failure is not None:
+            raise RuntimeError("DecisionService stopped on an error") from self.failure
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((person, future))
+        if self.failure is not None and not future.done():
+            # Queued after the service failed, so nothing will take it off the queue
+            future.set_exception(RuntimeError("DecisionService stopped on an error"))
+        return await future
+
+    async def run(self):
+        """
+        Take submissions off the queue in batches and decide them, until stop is called.
+        """
+        loop = asyncio.get_running_loop()
+        stopping = False
+        batch = []
+        try:
+            while not stopping:
+                batch = []
+                item = await self.queue.get()
+                if item is None:
+                    break
+                batch.append(item)
+                deadline = loop.time() + self.batch_delay
+                while len(batch) < self.batch_size:
+                    timeout = deadline - loop.time()
+                    try:
+                        if timeout > 0:
+                            item = await asyncio.wait_for(self.queue.get(), timeout)
+                        else:
+                            item = self.queue.get_nowait()
+                    except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(item)
+                self.decide_batch(batch)
+        except BaseException as error:
+            self.failure = error
+            self.fail_pending(batch, error)
+            raise
+
+    def fail_pending(self, batch, error):
+        """
+        Resolve the submissions of the current batch and of the queue, which will not be decided, with an error.
+
+        :param batch: list of (person, future) pairs taken off the queue
+        :param error: the exception that stopped the service; a cancellation cancels the futures instead
+        """
+        pending = list(batch)
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if item is not None:
+                pending.append(item)
+        for person, future in pending:
+            if future.done():
+                continue
+            if isinstance(error, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(error)
+
+    def decide_batch(self, batch):
+        """
+        :param batch: list of (person, future) pairs; each future gets the decision, or the error raised deciding it
+        """
+        if self.provider is not None:
+            self.countries = self.provider.current()
+        if self.countries.version != self.validator.version or \
+                (self.reference_date is None and self.validator.dates.reference_date != datetime.date.today()):
+            self.validator = CompiledValidator(self.countries, reference_date=self.reference_date, stats=self.stats)
+        for person, future in batch:
+            if future.cancelled():
+                continue
+            try:
+                future.set_result(self.validator.decide(person))
+            except Exception as error:
+                future.set_exception(error)
+        self.batches += 1
+        self.decided += len(batch)
+
+    async def serve(self, host="127.0.0.1", port=0):
+        """
+        Accept travellers over a local TCP socket: each line sent is one traveller as JSON, and each line sent back is
+        its decision, in the same order. A line that is not valid JSON gets "Error" back.
+
+        :param host: address to listen on
+        :param port: port to listen on; 0 picks a free port
+        :return: an asyncio Server; its sockets tell the port actually used
+        """
+        await self.start()
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serve one connection opened on the socket of serve.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    decision = await self.submit(json.loads(line.decode("utf-8")))
+                except (ValueError, LookupError, TypeError):
+                    decision = "Error"
+                writer.write(decision.encode("utf-8") + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
@@ -6,7 +6,15 @@ Test module for exercise3.py
 
 """
 
-from exercise1 import selection, projection, cross_product, UnknownAttributeException
+from exercise1 import selection, projection, cross_product, UnknownAttributeException, join, hash_join, merge_join, \
+    Table, query, union, intersection, difference, iter_union, iter_intersection, iter_difference,\
+    IncompatibleSchemaException, cross_product_view, materialize, order_by, top_k, iter_order_by,\
+    group_by, iter_group_by, Condition, IndexedTable, write_table, read_table, MappedTable,\
+    parallel_product_selection, iter_parallel_product_selection, init_product_worker, product_partition, sorted_on
+from operator import itemgetter
+import json
+import struct
+import exercise1
 
 __author__ = "Darius Chow and Ryan Prance, Adopted from: Susan Sim"
 __email__ = "darius.chow@mail.utoronto.ca, ryan.prance@mail.utoronto.ca, ses@drsusansim.org"
@@ -247,26 +255,26 @@ def test_cross_product_one_row_table():
     Test cross product operation using the a table with only one row.
     """
     table_with_one_row = [["ID Number", "Date of Birth"],
-                          [0001, "01/01/2001"]]
+                          [1, "01/01/2001"]]
 
     result_1 = [["ID Number", "Date of Birth", "Surname", "FirstName", "Age", "Salary"],
-                [0001, "01/01/2001", "Smith", "Mary", 25, 2000],
-                [0001, "01/01/2001", "Black", "Lucy", 40, 3000],
-                [0001, "01/01/2001", "Verdi", "Nico", 36, 4500],
-                [0001, "01/01/2001", "Smith", "Mark", 40, 3900]]
+                [1, "01/01/2001", "Smith", "Mary", 25, 2000],
+                [1, "01/01/2001", "Black", "Lucy", 40, 3000],
+                [1, "01/01/2001", "Verdi", "Nico", 36, 4500],
+                [1, "01/01/2001", "Smith", "Mark", 40, 3900]]
 
     assert is_equal(result_1, cross_product(table_with_one_row, EMPLOYEES))
 
     result_2 = [["Surname", "FirstName", "Age", "Salary", "ID Number", "Date of Birth"],
-                ["Smith", "Mary", 25, 2000, 0001, "01/01/2001"],
-                ["Black", "Lucy", 40, 3000, 0001, "01/01/2001"],
-                ["Verdi", "Nico", 36, 4500, 0001, "01/01/2001"],
-                ["Smith", "Mark", 40, 3900, 0001, "01/01/2001"]]
+                ["Smith", "Mary", 25, 2000, 1, "01/01/2001"],
+                ["Black", "Lucy", 40, 3000, 1, "01/01/2001"],
+                ["Verdi", "Nico", 36, 4500, 1, "01/01/2001"],
+                ["Smith", "Mark", 40, 3900, 1, "01/01/2001"]]
 
     assert is_equal(result_2, cross_product(EMPLOYEES, table_with_one_row))
 
     result_3 = [["ID Number", "Date of Birth", "ID Number", "Date of Birth"],
-                [0001, "01/01/2001", 0001, "01/01/2001"]]
+                [1, "01/01/2001", 1, "01/01/2001"]]
 
     assert is_equal(result_3, cross_product(table_with_one_row, table_with_one_row))
 
@@ -280,3 +288,530 @@ def test_cross_product_empty_table():
     assert cross_product(empty_table, R2) is None
     assert cross_product(R1, empty_table) is None
     assert cross_product(R2, empty_table) is None
+
+
+def test_join_department():
+    """
+    Test join operation matches selection over the cross product.
+    """
+    result = [["Employee", "Department", "Department", "Head"],
+              ["Smith", "sales", "sales", "Brown"],
+              ["Black", "production", "production", "Mori"],
+              ["White", "production", "production", "Mori"]]
+
+    assert is_equal(result, selection(cross_product(R1, R2), lambda row: row[1] == row[2]))
+    assert is_equal(result, join(R1, R2, "Department"))
+    assert is_equal(result, hash_join(R1, R2, ["Department"]))
+    assert is_equal(result, merge_join(R1, R2, "Department"))
+    assert is_equal(result, join(R1, R2, "Department", engine="merge"))
+
+    result_2 = [["Department", "Head", "Employee", "Department"],
+                ["sales", "Brown", "Smith", "sales"],
+                ["production", "Mori", "Black", "production"],
+                ["production", "Mori", "White", "production"]]
+    assert is_equal(result_2, hash_join(R2, R1, "Department"))
+    assert is_equal(result_2, merge_join(R2, R1, "Department"))
+
+
+def test_join_engine():
+    """
+    Test join merges tables already sorted on the join attributes, and hashes the others, including keys that cannot
+    be compared with each other.
+    """
+    left = [["Id", "A"], [1, "a"], [2, "b"], [2, "c"]]
+    right = [["Id", "B"], [2, "x"], [1, "y"]]
+    assert sorted_on(left, itemgetter(0)) and not sorted_on(right, itemgetter(0))
+    assert sorted_on([["Id"]], itemgetter(0)) and not sorted_on([["Id"], [1], ["a"]], itemgetter(0))
+    assert join(left, right, "Id") == hash_join(left, right, "Id")
+    ordered = [right[0]] + sorted(right[1:])
+    assert join(left, ordered, "Id") == merge_join(left, ordered, "Id")
+
+    mixed = [["Id", "A"], [1, "a"], ["2", "b"]]
+    assert join(mixed, mixed, "Id") == hash_join(mixed, mixed, "Id")
+    try:
+        merge_join(mixed, mixed, "Id")
+        assert False
+    except TypeError:
+        assert True
+
+
+def test_join_multiple_attributes():
+    """
+    Test join operation on several attributes at once.
+    """
+    result = [["Surname", "FirstName", "Age", "Salary", "Surname", "FirstName", "Age", "Salary"],
+              ["Smith", "Mary", 25, 2000, "Smith", "Mary", 25, 2000],
+              ["Black", "Lucy", 40, 3000, "Black", "Lucy", 40, 3000],
+              ["Verdi", "Nico", 36, 4500, "Verdi", "Nico", 36, 4500],
+              ["Smith", "Mark", 40, 3900, "Smith", "Mark", 40, 3900]]
+
+    assert is_equal(result, hash_join(EMPLOYEES, EMPLOYEES, ["Surname", "FirstName"]))
+    assert is_equal(result, merge_join(EMPLOYEES, EMPLOYEES, ["Surname", "FirstName"]))
+
+
+def test_join_no_results():
+    """
+    Test join operation where no rows match, or one table is empty.
+    """
+    other = [["Department", "Budget"], ["marketing", 100]]
+    assert join(R1, other, "Department") is None
+    assert merge_join(R1, other, "Department") is None
+    assert join([["Department", "Head"]], R1, "Department") is None
+
+
+def test_join_attribute_not_found():
+    """
+    Test join operation with an attribute missing from one of the tables.
+    """
+    try:
+        join(R1, EMPLOYEES, "Department")
+        assert False
+    except UnknownAttributeException:
+        assert True
+
+
+def test_table_round_trip():
+    """
+    Test converting tables to columns and back.
+    """
+    assert Table.from_rows(EMPLOYEES).to_rows() == EMPLOYEES
+    assert Table.from_rows(R1).to_rows() == R1
+    assert Table.from_rows([["ID Number", "Date of Birth"]]).to_rows() == [["ID Number", "Date of Birth"]]
+    assert list(Table.from_rows(EMPLOYEES)["Age"]) == [25, 40, 36, 40]
+
+    mixed = [["Count", "Score", "Big", "Flag"],
+             [3, 2.5, 2 ** 60 + 1, True],
+             [4.0, 3, 2 ** 64, 1]]
+    copy = Table.from_rows(mixed).to_rows()
+    assert copy == mixed
+    assert [[type(value) for value in row] for row in copy] == [[type(value) for value in row] for row in mixed]
+    assert Table.from_rows([["Big"], [2 ** 60 + 1]]).to_rows() == [["Big"], [2 ** 60 + 1]]
+
+
+def test_table_project():
+    """
+    Test columnar projection shares the columns of the original table.
+    """
+    table = Table.from_rows(EMPLOYEES)
+    result = [["Surname", "Age"],
+              ["Smith", 25],
+              ["Black", 40],
+              ["Verdi", 36],
+              ["Smith", 40]]
+
+    projected = table.project(["Surname", "Age", "Surname"])
+    assert projected.to_rows() == result
+    assert projected["Age"] is table["Age"]
+    assert table.project([]) is None
+    try:
+        table.project(["LastName"])
+        assert False
+    except UnknownAttributeException:
+        assert True
+
+
+def test_table_select():
+    """
+    Test columnar selection with a boolean mask.
+    """
+    table = Table.from_rows(EMPLOYEES)
+    result = [["Surname", "FirstName", "Age", "Salary"],
+              ["Verdi", "Nico", 36, 4500],
+              ["Smith", "Mark", 40, 3900]]
+
+    def mask(t):
+        return [age >= 30 and salary > 3500 for age, salary in zip(t["Age"], t["Salary"])]
+
+    assert table.select(mask).to_rows() == result
+    assert table.select(mask(table)).to_rows() == selection(EMPLOYEES, filter_employees)
+    assert table.select([False] * len(table)) is None
+
+
+def test_query_matches_eager_operators():
+    """
+    Test lazy queries return the same tables as the eager operators.
+    """
+    q = query(R1).product(EMPLOYEES).select(filter_employees)
+    assert is_equal(q.run(), selection(cross_product(R1, EMPLOYEES), filter_employees))
+
+    q = query(R1).product(EMPLOYEES).select(lambda age, salary: age >= 30 and salary > 3500, on=["Age", "Salary"])
+    q = q.select(lambda department: department == "production", on=["Department"]).project(["FirstName", "Employee"])
+    expected = projection(selection(selection(cross_product(R1, EMPLOYEES), filter_employees),
+                                    lambda row: row[1] == "production"), ["FirstName", "Employee"])
+    assert is_equal(q.run(), expected)
+
+    q = query(R1).join(R2, "Department").project(["Employee", "Head"])
+    assert is_equal(q.run(), projection(join(R1, R2, "Department"), ["Employee", "Head"]))
+
+    assert query(EMPLOYEES).select(lambda age: age > 100, on=["Age"]).run() is None
+    assert query(EMPLOYEES).project([]).run() is None
+
+
+def test_query_explain():
+    """
+    Test the explained plan shows the pushed down selections and the dropped columns.
+    """
+    q = query(EMPLOYEES).product(R1).select(lambda age: age > 30, on=["Age"]).project(["Surname", "Employee"])
+    plan = q.explain()
+    assert "select[Age] pushed into left input of product" in plan
+    assert "dropped columns FirstName, Age, Salary from left input of product" in plan
+    assert "dropped columns Department from right input of product" in plan
+    assert plan.index("product") < plan.index("select[Age]\n")
+
+    assert "(none)" in query(EMPLOYEES).select(filter_employees).explain()
+
+
+def test_query_attribute_not_found():
+    """
+    Test lazy queries check attribute names as the plan is built.
+    """
+    try:
+        query(EMPLOYEES).project(["Department"])
+        assert False
+    except UnknownAttributeException:
+        assert True
+    try:
+        query(EMPLOYEES).select(lambda department: True, on=["Department"])
+        assert False
+    except UnknownAttributeException:
+        assert True
+
+
+def test_set_operations():
+    """
+    Test union, intersection and difference, including tables with the same attributes in a different order.
+    """
+    smiths = selection(EMPLOYEES, lambda row: row[0] == "Smith")
+    over_thirty = selection(EMPLOYEES, lambda row: row[2] > 30)
+    reordered = projection(over_thirty, ["Age", "Salary", "Surname", "FirstName"])
+
+    assert is_equal(union(smiths, over_thirty), list(EMPLOYEES))
+    assert is_equal(union(smiths, reordered), list(EMPLOYEES))
+    assert is_equal(intersection(smiths, reordered), [["Surname", "FirstName", "Age", "Salary"],
+                                                      ["Smith", "Mark", 40, 3900]])
+    assert is_equal(difference(smiths, reordered), [["Surname", "FirstName", "Age", "Salary"],
+                                                    ["Smith", "Mary", 25, 2000]])
+    assert difference(smiths, EMPLOYEES) is None
+    assert union(R1 + R1[1:], [R1[0]]) == R1
+
+
+def test_set_operations_streaming():
+    """
+    Test the streaming set operations give the same rows as the in-memory ones.
+    """
+    smiths = selection(EMPLOYEES, lambda row: row[0] == "Smith")
+    over_thirty = selection(EMPLOYEES, lambda row: row[2] > 30)
+
+    assert is_equal(list(iter_union(iter(smiths), iter(over_thirty), partitions=3)), union(smiths, over_thirty))
+    assert is_equal(list(iter_intersection(smiths, over_thirty, partitions=2)), intersection(smiths, over_thirty))
+    assert is_equal(list(iter_difference(smiths, over_thirty)), difference(smiths, over_thirty))
+    assert list(iter_difference(smiths, EMPLOYEES)) == [EMPLOYEES[0]]
+
+
+def test_set_operations_incompatible_tables():
+    """
+    Test set operations on tables with different attributes.
+    """
+    try:
+        union(EMPLOYEES, R1)
+        assert False
+    except IncompatibleSchemaException:
+        assert True
+    try:
+        list(iter_intersection(R1, R2))
+        assert False
+    except UnknownAttributeException:
+        assert True
+
+
+def test_cross_product_does_not_modify_inputs():
+    """
+    Test cross product operation leaves the input tables unchanged.
+    """
+    left = [["Employee", "Department"], ["Smith", "sales"]]
+    right = [["Department", "Head"], ["sales", "Brown"]]
+    result = cross_product(left, right)
+    result[0].append("Extra")
+    result[1][0] = "Black"
+
+    assert left == [["Employee", "Department"], ["Smith", "sales"]]
+    assert right == [["Department", "Head"], ["sales", "Brown"]]
+
+
+def test_cross_product_view():
+    """
+    Test the cross product view has the same rows as the cross product, without copying the input rows, and can be
+    passed on to another product or join.
+    """
+    view = cross_product_view(R1, R2)
+
+    assert len(view) == 7
+    assert materialize(view) == cross_product(R1, R2)
+    assert view.to_rows() == cross_product(R1, R2)
+    assert view[1] == ["Smith", "sales", "production", "Mori"]
+    assert view[-1][-1] == "Brown"
+    assert view[1].left is R1[1] and view[1].right is R2[1]
+    assert is_equal(materialize(selection(view, lambda row: row[1] == row[2])), join(R1, R2, "Department"))
+    assert projection(view, ["Employee", "Head"]) == projection(cross_product(R1, R2), ["Employee", "Head"])
+    assert cross_product_view(R1, [["Department", "Head"]]) is None
+
+    floors = [["Head", "Floor"], ["Mori", 1], ["Brown", 2]]
+    product = cross_product(R1, R2)
+    assert cross_product(view, floors) == cross_product(product, floors)
+    assert cross_product(floors, view) == cross_product(floors, product)
+    assert all(type(row) is list for row in cross_product(view, floors))
+    assert view[1] + ["x"] == product[1] + ["x"] and ["x"] + view[1] == ["x"] + product[1]
+    for join_function in (join, hash_join, merge_join):
+        assert join_function(view, floors, "Head") == join_function(product, floors, "Head")
+        assert join_function(floors, view, "Head") == join_function(floors, product, "Head")
+
+
+def test_order_by():
+    """
+    Test sorting a table on one or more attributes, keeping the header first and ties in their original order.
+    """
+    result = [["Surname", "FirstName", "Age", "Salary"],
+              ["Black", "Lucy", 40, 3000],
+              ["Smith", "Mark", 40, 3900],
+              ["Verdi", "Nico", 36, 4500],
+              ["Smith", "Mary", 25, 2000]]
+
+    assert order_by(EMPLOYEES, ["Age", "Surname"], descending=[True, False]) == result
+    assert order_by(EMPLOYEES, "Age", descending=True) == result
+    assert order_by(EMPLOYEES, "Surname") == [EMPLOYEES[0], EMPLOYEES[2], EMPLOYEES[1], EMPLOYEES[4], EMPLOYEES[3]]
+    assert order_by([["Surname"]], "Surname") is None
+    try:
+        order_by(EMPLOYEES, ["Age", "Department"])
+        assert False
+    except UnknownAttributeException:
+        assert True
+
+
+def test_top_k():
+    """
+    Test keeping the k highest (or lowest) ranked rows of a table or a stream of rows.
+    """
+    assert top_k(EMPLOYEES, "Salary", 2) == [EMPLOYEES[0], EMPLOYEES[3], EMPLOYEES[4]]
+    assert top_k(iter(EMPLOYEES), "Salary", 1, descending=False) == [EMPLOYEES[0], EMPLOYEES[1]]
+    assert top_k(EMPLOYEES, ["Age", "Salary"], 10, descending=[True, False]) == \
+        order_by(EMPLOYEES, ["Age", "Salary"], descending=[True, False])
+    assert top_k([["Surname"]], "Surname", 3) is None
+
+
+def test_iter_order_by():
+    """
+    Test the external merge sort, spilling runs of two rows and merging them two at a time, gives the same order as
+    order_by.
+    """
+    employees = [EMPLOYEES[0]] + [[surname, first_name, age % 7, age * 100]
+                                  for surname, first_name in zip("ABCDEFGHIJK", "LMNOPQRSTUV")
+                                  for age in (3, 11, 5)]
+
+    for descending in (False, True, [False, True]):
+        expected = order_by(employees, ["Age", "Surname"], descending=descending)
+        assert list(iter_order_by(iter(employees), ["Age", "Surname"], descending, run_size=2, fan_in=2)) == expected
+        assert list(iter_order_by(employees, ["Age", "Surname"], descending)) == expected
+    assert list(iter_order_by([], "Age")) == []
+
+
+def test_group_by():
+    """
+    Test aggregating the rows of each group, and of the whole table.
+    """
+    result = [["Surname", "avg(Salary)", "count(*)", "min(Age)", "max(FirstName)", "sum(Salary)"],
+              ["Smith", 2950.0, 2, 25, "Mary", 5900],
+              ["Black", 3000.0, 1, 40, "Lucy", 3000],
+              ["Verdi", 4500.0, 1, 36, "Nico", 4500]]
+    aggregates = [("avg", "Salary"), ("count", "*"), ("min", "Age"), ("max", "FirstName"), ("sum", "Salary")]
+
+    assert group_by(EMPLOYEES, "Surname", aggregates) == result
+    assert group_by(EMPLOYEES, ["Age", "Surname"], [("count", "Age")]) == \
+        [["Age", "Surname", "count(Age)"], [25, "Smith", 1], [40, "Black", 1], [36, "Verdi", 1], [40, "Smith", 1]]
+    assert group_by(EMPLOYEES, [], [("max", "Salary")]) == [["max(Salary)"], [4500]]
+    assert group_by([["Surname", "Salary"]], "Surname", [("sum", "Salary")]) is None
+
+
+def test_group_by_attribute_not_found():
+    """
+    Test group by with an unknown key or aggregated attribute.
+    """
+    try:
+        group_by(EMPLOYEES, "Department", [("count", "*")])
+        assert False
+    except UnknownAttributeException:
+        assert True
+    try:
+        list(iter_group_by(EMPLOYEES, "Surname", [("sum", "Bonus")]))
+        assert False
+    except UnknownAttributeException:
+        assert True
+
+
+def test_iter_group_by_spills():
+    """
+    Test the streaming group by gives the same groups when partial aggregates are spilled to disk.
+    """
+    employees = [EMPLOYEES[0]] + [[surname, "", age, age * 100] for surname in "ABCDEFG" for age in range(20, 30)]
+    aggregates = [("avg", "Salary"), ("count", "*"), ("min", "Age"), ("max", "Age")]
+    expected = group_by(employees, "Age", aggregates)
+
+    assert list(iter_group_by(iter(employees), "Age", aggregates)) == expected
+    spilled = list(iter_group_by(iter(employees), "Age", aggregates, max_groups=3, partitions=4))
+    assert spilled[0] == expected[0]
+    assert sorted(spilled[1:]) == sorted(expected[1:])
+
+
+def test_selection_condition():
+    """
+    Test selection with a condition, with and without an index, gives the same rows as with a function.
+    """
+    employees = IndexedTable(EMPLOYEES)
+    employees.create_index("Surname")
+    employees.create_index("Age", "sorted")
+    cases = [(Condition("Surname", "==", "Smith"), lambda row: row[0] == "Smith"),
+             (Condition("Age", ">=", 36), lambda row: row[2] >= 36),
+             (Condition("Age", "<", 36), lambda row: row[2] < 36),
+             (Condition("Age", "between", (30, 40)), lambda row: 30 <= row[2] <= 40),
+             (Condition("Surname", "<=", "Smith"), lambda row: row[0] <= "Smith"),
+             (Condition("Salary", "!=", 3000), lambda row: row[3] != 3000)]
+
+    for condition, f in cases:
+        assert selection(employees, condition) == selection(EMPLOYEES, f)
+        assert selection(EMPLOYEES, condition) == selection(EMPLOYEES, f)
+    assert selection(employees, Condition("Age", ">", 40)) is None
+    try:
+        selection(EMPLOYEES, Condition("Department", "==", "sales"))
+        assert False
+    except UnknownAttributeException:
+        assert True
+
+
+def test_indexed_table_changes():
+    """
+    Test indexes follow rows appended to the table, and are rebuilt after other changes.
+    """
+    employees = IndexedTable(EMPLOYEES)
+    employees.create_index("Surname")
+    employees.create_index("Age", "sorted")
+    employees.append(["Smith", "Anna", 36, 5000])
+    assert selection(employees, Condition("Surname", "==", "Smith")) == \
+        [EMPLOYEES[0], EMPLOYEES[1], EMPLOYEES[4], ["Smith", "Anna", 36, 5000]]
+    assert selection(employees, Condition("Age", "==", 36)) == [EMPLOYEES[0], EMPLOYEES[3], ["Smith", "Anna", 36, 5000]]
+
+    del employees[1]
+    employees[1] = ["White", "Lea", 36, 2500]
+    assert selection(employees, Condition("Surname", "==", "Smith")) == \
+        [EMPLOYEES[0], EMPLOYEES[4], ["Smith", "Anna", 36, 5000]]
+    assert selection(employees, Condition("Age", "==", 36)) == \
+        [EMPLOYEES[0], ["White", "Lea", 36, 2500], EMPLOYEES[3], ["Smith", "Anna", 36, 5000]]
+
+
+def test_binary_table_round_trip(tmpdir):
+    """
+    Test tables read back from a binary file are the tables written, value types included.
+    """
+    mixed = [["Id", "Score", "Name", "Flag"],
+             [1, 2.5, "Smith", True],
+             [2, -1.0, "Black", 1],
+             [2 ** 70, 0.5, "Smith", None]]
+    for t in [EMPLOYEES, mixed, [["A", "B"]]]:
+        file_name = str(tmpdir.join("t.tbl"))
+        write_table(t, file_name)
+        copy = read_table(file_name)
+        assert copy == t
+        assert [[type(value) for value in row] for row in copy] == [[type(value) for value in row] for row in t]
+    try:
+        write_table([["Pair"], [(1, 2)]], str(tmpdir.join("pair.tbl")))
+        assert False
+    except TypeError:
+        assert True
+
+
+def test_binary_table_dictionary(tmpdir, monkeypatch):
+    """
+    Test the header of a binary table is JSON, dictionary values are only decoded when read, and a column with more
+    distinct values than its codes can tell apart is refused.
+    """
+    file_name = str(tmpdir.join("employees.tbl"))
+    write_table(EMPLOYEES, file_name)
+    with open(file_name, "rb") as table_file:
+        table_file.seek(4)
+        header = json.loads(table_file.read(struct.unpack("<Q", table_file.read(8))[0]).decode("utf-8"))
+    assert header["attributes"] == EMPLOYEES[0]
+    assert [column["kind"] for column in header["columns"]] == ["I", "I", "q", "q"]
+    with MappedTable(file_name) as employees:
+        surnames = employees["Surname"].values
+        assert len(surnames) == 3
+        assert surnames.decoded == {}
+        assert employees["Surname"][1] == "Black"
+        assert surnames.decoded == {1: "Black"}
+        assert list(surnames) == ["Smith", "Black", "Verdi"]
+        try:
+            surnames[3]
+            assert False
+        except IndexError:
+            assert True
+
+    monkeypatch.setattr(exercise1, "DICTIONARY_MAX_VALUES", 2)
+    write_table([["Surname"], ["Smith"], ["Black"], ["Smith"]], file_name)
+    try:
+        write_table(EMPLOYEES, file_name)
+        assert False
+    except ValueError:
+        assert True
+
+
+def test_mapped_table(tmpdir):
+    """
+    Test selection and projection on a MappedTable give the same tables as on the list of lists.
+    """
+    file_name = str(tmpdir.join("employees.tbl"))
+    write_table(EMPLOYEES, file_name)
+    with MappedTable(file_name) as employees:
+        for condition in [Condition("Age", ">=", 36), Condition("Surname", "==", "Smith"),
+                          Condition("Salary", "between", (2500, 4000)), Condition("Age", "<", 20)]:
+            assert selection(employees, condition) == selection(EMPLOYEES, condition)
+        assert selection(employees, lambda row: row[-1] > 3500) == selection(EMPLOYEES, lambda row: row[-1] > 3500)
+        assert projection(employees, ["Salary", "Surname", "Salary"]) == \
+            projection(EMPLOYEES, ["Salary", "Surname", "Salary"])
+        assert projection(employees, []) is None
+        try:
+            selection(employees, Condition("Department", "==", "sales"))
+            assert False
+        except UnknownAttributeException:
+            assert True
+
+
+def test_parallel_product_selection(tmpdir, monkeypatch):
+    """
+    Test the parallel filtered cross-product returns the rows of selection over cross_product, in the same order,
+    including when workers read the right table in several chunks.
+    """
+    products = [[["Id", "Name"]] + [[i, "n" + str(i % 7)] for i in range(50)],
+                [["Code", "Rate"]] + [["c" + str(i), i * 0.5] for i in range(9)]]
+    expected = cross_product(products[0], products[1])
+    condition = Condition("Rate", "between", (1, 3))
+    assert parallel_product_selection(products[0], products[1], condition, processes=2, partition_rows=8) == \
+        selection(expected, condition)
+    assert list(iter_parallel_product_selection(R1, R2, lambda row: True, processes=2)) == cross_product(R1, R2)
+    assert parallel_product_selection(R1, R2, Condition("Head", "==", "Sim"), processes=2) is None
+
+    file_name = str(tmpdir.join("right.tbl"))
+    write_table(products[1], file_name)
+    monkeypatch.setattr(exercise1, "MAPPED_CHUNK_ROWS", 2)
+    monkeypatch.setattr(exercise1, "PRODUCT_WORKER", None)
+    init_product_worker(file_name, expected[0], condition)
+    assert product_partition(products[0][1:]) == selection(expected, condition)[1:]
+    exercise1.PRODUCT_WORKER[0].close()
+    assert parallel_product_selection(R1, [["Department", "Head"]], Condition("Head", "==", "Mori"),
+                                      processes=2) is None
+    try:
+        parallel_product_selection(R1, R2, None, processes=2)
+        assert False
+    except ValueError:
+        assert True
+    try:
+        parallel_product_selection(R1, R2, Condition("Salary", ">", 0), processes=2)
+        assert False
+    except UnknownAttributeException:
+        assert True
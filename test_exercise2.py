@@ -3,12 +3,26 @@
 """ Module to test papers.py  """
 
 # imports one per line
+import io
 import os
+import shutil
+import csv
+import asyncio
+import tempfile
 import json
+import datetime
+
+import exercise2
 
 from exercise2 import decide, valid_passport_format, valid_date_format, has_valid_visa,\
     valid_visa_format, travelled_via_country_with_medical_advisory, visitor_from_country_requiring_visa,\
-    unknown_location_exists, required_fields_exist, valid_location_field
+    unknown_location_exists, required_fields_exist, valid_location_field, decide_iter, iter_json_array,\
+    decide_parallel, decide_person, CompiledValidator, CountryIndex, load_country_index, VISA_REQUIRED,\
+    TRANSIT_VISA_REQUIRED, MEDICAL_ADVISORY, HOME_COUNTRY, DateEvaluator, is_more_than_x_years_ago, parse_date,\
+    DecisionService, CountriesProvider, decide_to_sink, JsonLinesSink, CsvSink, BinarySink,\
+    read_binary_decisions, DecisionStats, Rule, RuleEngine, Traveller, parse_traveller, load_travellers, decide_typed,\
+    IncrementalDecider, countries_diff, Deduplicator, decide_deduplicated, DUPLICATE_NEW,\
+    DUPLICATE_EXACT, DUPLICATE_CONFLICT, DUPLICATE_POSSIBLE, PassportFilter, TravellerColumns
 
 __author__ = "Darius Chow and Ryan Prance, Adopted from: Susan Sim"
 __email__ = "darius.chow@mail.utoronto.ca, ryan.prance@mail.utoronto.ca, ses@drsusansim.org"
@@ -159,7 +173,7 @@ def test_decide_visitors_require_visas_valid_visas_file():
         assert COUNTRIES[country_code]['visitor_visa_required'] == "1"
         valid = False
         assert "visa" in person
-        if has_valid_visa(person):
+        if has_valid_visa(person, DATE_TODAY):
             valid = True
         assert valid
         for item in LOCATION_FIELDS:
@@ -174,7 +188,8 @@ def test_decide_visitors_require_visas_valid_visas():
     countries, they require a visa to enter. Their visas are valid. These travellers did not travel from or through
     a country with a medical advisory and all required information is present.
     """
-    assert decide("test_decide_visitors_require_visas_valid_visas.json", COUNTRIES_FILE) == ["Accept"] * 4
+    assert decide("test_decide_visitors_require_visas_valid_visas.json", COUNTRIES_FILE,
+                  reference_date=DATE_TODAY) == ["Accept"] * 4
 
 
 def test_decide_visitors_require_visas_invalid_visas_file():
@@ -289,7 +304,7 @@ def test_decide_visitors_via_country_with_medical_advisory_file():
         if COUNTRIES[country_code]['visitor_visa_required'] == "1":
             visa_valid = False
             assert "visa" in person
-            if has_valid_visa(person):
+            if has_valid_visa(person, DATE_TODAY):
                 visa_valid = True
             assert visa_valid
         traveled_via_medical_advisory_country = False
@@ -307,8 +322,8 @@ def test_decide_visitors_via_country_with_medical_advisory():
     Testing for visitors that are approved thus far (no required information missing, everything is valid, visa is
     present if required), but travelled from or via a country with a medical advisory.
     """
-    assert decide("test_decide_visitors_via_country_with_medical_advisory.json", COUNTRIES_FILE) ==\
-        ["Quarantine"] * 4
+    assert decide("test_decide_visitors_via_country_with_medical_advisory.json", COUNTRIES_FILE,
+                  reference_date=DATE_TODAY) == ["Quarantine"] * 4
 
 
 def test_decide_visitors_invalid_visa_via_country_with_medical_advisory_file():
@@ -396,7 +411,7 @@ def test_has_valid_visa():
           "from": {"city": "Wumpus",
                    "region": "Headdeskia",
                    "country": "JIK"}}
-    assert has_valid_visa(p1) is True
+    assert has_valid_visa(p1, DATE_TODAY) is True
     p2 = {"passport": "6P294-42HR2-95PSF-93NFF-2T5WF",
           "first_name": "JACK",
           "last_name": "DOE",
@@ -408,7 +423,7 @@ def test_has_valid_visa():
           "from": {"city": "Wumpus",
                    "region": "Headdeskia",
                    "country": "JIK"}}
-    assert has_valid_visa(p2) is False
+    assert has_valid_visa(p2, DATE_TODAY) is False
     p3 = {"passport": "6P294-42HR2-95PSF-93NFF-2T5WF",
           "first_name": "JACK",
           "last_name": "DOE",
@@ -422,7 +437,7 @@ def test_has_valid_visa():
           "from": {"city": "Wumpus",
                    "region": "Headdeskia",
                    "country": "JIK"}}
-    assert has_valid_visa(p3) is False
+    assert has_valid_visa(p3, DATE_TODAY) is False
     p4 = {"passport": "6P294-42HR2-95PSF-93NFF-2T5WF",
           "first_name": "JACK",
           "last_name": "DOE",
@@ -436,7 +451,7 @@ def test_has_valid_visa():
           "from": {"city": "Wumpus",
                    "region": "Headdeskia",
                    "country": "JIK"}}
-    assert has_valid_visa(p4) is False
+    assert has_valid_visa(p4, DATE_TODAY) is False
 
 
 def test_valid_passport():
@@ -866,3 +881,605 @@ def test_required_fields_exist():
                    "date": "2014-03-29"},
           "entry_reason": "returning"}
     assert required_fields_exist(p8) is False
+
+
+TEST_FILES = ["test_decide_no_citizens.json",
+              "test_decide_missing_required_information.json",
+              "test_decide_unknown_locations.json",
+              "test_decide_KAN_citizens.json",
+              "test_decide_visitors_require_visas_valid_visas.json",
+              "test_decide_visitors_require_visas_invalid_visas.json",
+              "test_decide_visitors_visas_not_needed.json",
+              "test_decide_KAN_citizens_via_country_with_medical_advisory.json",
+              "test_decide_visitors_via_country_with_medical_advisory.json",
+              "test_decide_visitors_invalid_visa_via_country_with_medical_advisory.json"]
+
+
+def test_decide_iter_matches_decide():
+    """
+    Streaming decisions are identical to the batch decisions, however small the read chunks are.
+    """
+    for file_name in TEST_FILES:
+        expected = decide(file_name, COUNTRIES_FILE)
+        assert list(decide_iter(file_name, COUNTRIES_FILE)) == expected
+        assert list(decide_iter(file_name, COUNTRIES_FILE, chunk_size=7)) == expected
+
+
+def test_iter_json_array():
+    assert list(iter_json_array(io.StringIO("[]"))) == []
+    assert list(iter_json_array(io.StringIO(" [ ] "), chunk_size=1)) == []
+    assert list(iter_json_array(io.StringIO('[12345, {"a": [1, 2]}, "x,]"]'), chunk_size=2)) == \
+        [12345, {"a": [1, 2]}, "x,]"]
+    for text in ['[1.5e10, 2]', '[true, null, -0.5E-3 ,12345]', '["a\\"b", {"k": ["]", "}"]}, [[1], [2, [3]]]]']:
+        for chunk_size in range(1, 8):
+            assert list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)) == json.loads(text)
+    large = [{"name": "x" * 10000, "values": list(range(1000))}, 7]
+    assert list(iter_json_array(io.StringIO(json.dumps(large)), chunk_size=16)) == large
+    assert list(iter_json_array(io.StringIO("[1] \n\t "), chunk_size=1)) == [1]
+    for bad in ["", "{}", "[1,]", "[1 2]", "[1, 2", '[{"a": 1', "[1x]", "[1.]", '["abc', "[1] x", "[1][2]",
+                '[{"a":1}]]', "[]" + " " * 10 + "0"]:
+        for chunk_size in (1, 3, 1024):
+            try:
+                list(iter_json_array(io.StringIO(bad), chunk_size=chunk_size))
+                assert False, bad
+            except ValueError:
+                pass
+
+
+def test_decide_parallel_matches_decide():
+    """
+    Parallel decisions come back in input order and are identical to the batch decisions.
+    """
+    for file_name in TEST_FILES:
+        expected = decide(file_name, COUNTRIES_FILE)
+        assert decide_parallel(file_name, COUNTRIES_FILE, processes=2, chunk_size=3) == expected
+        assert decide_parallel(file_name, COUNTRIES_FILE, processes=2, chunk_size=200) == expected
+
+
+def test_decide_parallel_splits_inside_travellers():
+    """
+    A comma and '{' inside a string or a nested array does not split a traveller in two.
+    """
+    people = []
+    for file_name in TEST_FILES:
+        with open(file_name, "r") as citizen_file:
+            people.extend(json.loads(citizen_file.read()))
+    people[0] = dict(people[0], first_name='A", {"x": 1}, {')
+    people[1] = dict(people[1], notes=[{"a": 1}, {"b": [2, {"c": 3}]}])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, "travellers.json")
+        with open(input_file, "w") as citizen_file:
+            citizen_file.write("  \n" + json.dumps(people, indent=1) + "\n")
+        expected = decide(input_file, COUNTRIES_FILE)
+        for chunk_size in [1, 7, 100, 1000, 100000]:
+            assert decide_parallel(input_file, COUNTRIES_FILE, processes=2, chunk_size=chunk_size) == expected
+
+
+def test_compiled_validator_matches_rule_helpers():
+    """
+    The compiled validator decides every traveller the same way as the rule helper functions, applied in the order
+    of the business rules.
+    """
+    def helper_decision(person):
+        if not required_fields_exist(person) or unknown_location_exists(person, COUNTRIES):
+            return "Reject"
+        if person["home"]["country"] != "KAN" and visitor_from_country_requiring_visa(person, COUNTRIES) and \
+                not has_valid_visa(person, DATE_TODAY):
+            return "Reject"
+        if travelled_via_country_with_medical_advisory(person, COUNTRIES):
+            return "Quarantine"
+        return "Accept"
+
+    validator = CompiledValidator(COUNTRIES, reference_date=DATE_TODAY)
+    for file_name in TEST_FILES:
+        with open(file_name, "r") as citizen_file:
+            citizen_json = json.loads(citizen_file.read())
+        for person in citizen_json:
+            assert validator.decide(person) == helper_decision(person)
+            assert decide_person(person, COUNTRIES, DATE_TODAY) == helper_decision(person)
+
+
+def test_compiled_validator_from_kan():
+    """
+    Travellers coming from or through Kanadia are not quarantined.
+    """
+    person = {"passport": "6P294-42HR2-95PSF-93NFF-2TEWF",
+              "first_name": "JACK",
+              "last_name": "DOE",
+              "birth_date": "1938-12-21",
+              "home": {"city": "Bala", "region": "ON", "country": "KAN"},
+              "entry_reason": "returning",
+              "from": {"city": "Bala", "region": "ON", "country": "KAN"},
+              "via": {"city": "Wumpus", "region": "Headdeskia", "country": "KAN"}}
+    assert CompiledValidator(COUNTRIES).decide(person) == "Accept"
+
+
+
+def test_kan_citizen_needs_no_visa():
+    """
+    Returning Kanadians are accepted without a visa, even if the countries table lists Kanadia as requiring one.
+    """
+    person = {"passport": "6P294-42HR2-95PSF-93NFF-2TEWF",
+              "first_name": "JACK",
+              "last_name": "DOE",
+              "birth_date": "1938-12-21",
+              "home": {"city": "Bala", "region": "ON", "country": "KAN"},
+              "entry_reason": "returning",
+              "from": {"city": "Bala", "region": "ON", "country": "KAN"}}
+    countries = dict(COUNTRIES, KAN={"code": "KAN", "name": "Kanadia", "visitor_visa_required": "1",
+                                     "transit_visa_required": "0", "medical_advisory": ""})
+    assert decide_person(person, countries, DATE_TODAY) == "Accept"
+    index = CountryIndex(countries)
+    validator = CompiledValidator(index, reference_date=DATE_TODAY, stats=DecisionStats())
+    assert validator.decide(person) == "Accept"
+    assert validator.decide(parse_traveller(person, index)) == "Accept"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, "travellers.json")
+        countries_file = os.path.join(tmp_dir, "countries.json")
+        with open(input_file, "w") as citizen_file:
+            json.dump([person], citizen_file)
+        with open(countries_file, "w") as countries_output:
+            json.dump(countries, countries_output)
+        assert decide(input_file, countries_file, DATE_TODAY) == ["Accept"]
+        assert decide_typed(input_file, countries_file, DATE_TODAY) == ["Accept"]
+
+def test_country_index():
+    index = CountryIndex(COUNTRIES)
+    assert index.flags["ALB"] == 0
+    assert index.flags["BRD"] == VISA_REQUIRED | TRANSIT_VISA_REQUIRED
+    assert index.flags["CFR"] == VISA_REQUIRED
+    assert index.flags["LUG"] & MEDICAL_ADVISORY
+    assert index.flags["KAN"] == HOME_COUNTRY
+    assert "KAN" in index and "ALB" in index and "XYZ" not in index
+    assert CountryIndex.of(index) is index
+    assert load_country_index(COUNTRIES_FILE) is load_country_index(COUNTRIES_FILE)
+    assert load_country_index(COUNTRIES_FILE).flags == index.flags
+
+
+def test_is_more_than_x_years_ago():
+    assert is_more_than_x_years_ago(2, "2013-12-15", DATE_TODAY) is True
+    assert is_more_than_x_years_ago(2, "2013-12-16", DATE_TODAY) is True
+    assert is_more_than_x_years_ago(2, "2013-12-17", DATE_TODAY) is False
+    assert is_more_than_x_years_ago(1, "2015-02-28", "2016-02-29") is True
+    assert is_more_than_x_years_ago(2, datetime.date.today().isoformat()) is False
+
+
+def test_date_evaluator():
+    dates = DateEvaluator(DATE_TODAY, cache_size=3)
+    for date_string in ["2013-12-16", "2013-12-17", "2014-06-01", "2013-12-16", "2010-01-01"]:
+        assert dates.is_more_than_x_years_ago(2, date_string) == is_more_than_x_years_ago(2, date_string, DATE_TODAY)
+    assert dates.cached.cache_info().hits == 1
+    assert dates.cached.cache_info().currsize == 3
+    assert parse_date("2015-2-4") == parse_date("2015-02-04")
+    for bad in ["2015-02-30", "2015-+1-01", "15-02-01"]:
+        try:
+            parse_date(bad)
+            assert False, bad
+        except ValueError:
+            pass
+
+
+def test_decision_service():
+    """
+    Concurrent submissions to the service get the same decisions as decide, in micro-batches.
+    """
+    with open("test_decide_visitors_via_country_with_medical_advisory.json", "r") as citizen_file:
+        people = json.loads(citizen_file.read())
+    with open("test_decide_missing_required_information.json", "r") as citizen_file:
+        people += json.loads(citizen_file.read())
+    expected = ["Quarantine"] * 4 + ["Reject"] * 17
+
+    async def submit_all():
+        async with DecisionService(COUNTRIES, batch_size=8, reference_date=DATE_TODAY) as service:
+            decisions = await asyncio.gather(*[service.submit(person) for person in people * 50])
+            assert service.batches >= len(people) * 50 / 8
+        return decisions
+
+    assert asyncio.run(submit_all()) == expected * 50
+
+
+def test_decision_service_failure():
+    """
+    When the batching loop fails, pending and later submissions get the error instead of waiting forever.
+    """
+    with open("test_decide_KAN_citizens.json", "r") as citizen_file:
+        people = json.loads(citizen_file.read())
+
+    def broken_batch(batch):
+        raise OSError("countries file is gone")
+
+    async def submit_all():
+        service = DecisionService(COUNTRIES, batch_size=2)
+        service.decide_batch = broken_batch
+        await service.start()
+        results = await asyncio.wait_for(
+            asyncio.gather(*[service.submit(person) for person in people * 3], return_exceptions=True), 5)
+        try:
+            await service.submit(people[0])
+            assert False
+        except RuntimeError:
+            pass
+        try:
+            await service.stop()
+            assert False
+        except OSError:
+            pass
+        return results
+
+    results = asyncio.run(submit_all())
+    assert len(results) == len(people) * 3
+    assert all(isinstance(result, (OSError, RuntimeError)) for result in results)
+
+
+def test_decision_service_socket():
+    """
+    Travellers sent as JSON lines over the local socket get their decisions back in order.
+    """
+    with open("test_decide_KAN_citizens.json", "r") as citizen_file:
+        people = json.loads(citizen_file.read())
+
+    async def send_all():
+        service = DecisionService(COUNTRIES)
+        server = await service.serve()
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for person in people:
+            writer.write(json.dumps(person).encode("utf-8") + b"\n")
+        writer.write(b"not json\n")
+        await writer.drain()
+        decisions = [(await reader.readline()).decode("utf-8").strip() for _ in range(len(people) + 1)]
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        await service.stop()
+        return decisions
+
+    assert asyncio.run(send_all()) == ["Accept"] * len(people) + ["Error"]
+
+
+def test_countries_provider_reload():
+    """
+    A changed countries file is picked up as a new version; indexes already handed out are left unchanged.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        countries_file = os.path.join(tmp_dir, "countries.json")
+        shutil.copy(COUNTRIES_FILE, countries_file)
+        provider = CountriesProvider(countries_file)
+        first = provider.current()
+        assert first.version == 1
+        assert provider.current() is first
+
+        countries = json.loads(json.dumps(COUNTRIES))
+        countries["JIK"]["medical_advisory"] = "MEASLES"
+        with open(countries_file, "w") as new_file:
+            new_file.write(json.dumps(countries))
+        os.utime(countries_file, ns=(0, 10 ** 9))
+        second = provider.current()
+        assert second.version == 2
+        assert second.flags["JIK"] & MEDICAL_ADVISORY
+        assert not first.flags["JIK"] & MEDICAL_ADVISORY
+        decisions = decide("test_decide_visitors_visas_not_needed.json", countries_file)
+        assert [decision.version for decision in decisions] == [1] * len(decisions)
+
+        with open(countries_file, "w") as new_file:
+            new_file.write('{"JIK": ')
+        os.utime(countries_file, ns=(0, 2 * 10 ** 9))
+        assert provider.current() is second
+
+
+def test_decision_service_reloads_countries():
+    """
+    The service decides each batch with the latest version of the countries file.
+    """
+    person = {"passport": "6P294-42HR2-95PSF-93NFF-2TEWF",
+              "first_name": "JACK",
+              "last_name": "DOE",
+              "birth_date": "1938-12-21",
+              "home": {"city": "Bala", "region": "ON", "country": "KAN"},
+              "entry_reason": "returning",
+              "from": {"city": "Wumpus", "region": "Headdeskia", "country": "JIK"}}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        countries_file = os.path.join(tmp_dir, "countries.json")
+        shutil.copy(COUNTRIES_FILE, countries_file)
+
+        async def submit_twice():
+            async with DecisionService(CountriesProvider(countries_file)) as service:
+                before = await service.submit(person)
+                countries = json.loads(json.dumps(COUNTRIES))
+                countries["JIK"]["medical_advisory"] = "MEASLES"
+                with open(countries_file, "w") as new_file:
+                    new_file.write(json.dumps(countries))
+                os.utime(countries_file, ns=(0, 10 ** 9))
+                after = await service.submit(person)
+            return before, after
+
+        before, after = asyncio.run(submit_twice())
+        assert (before, before.version) == ("Accept", 1)
+        assert (after, after.version) == ("Quarantine", 2)
+
+
+def test_decide_to_sink():
+    """
+    Each output sink writes the same decisions as decide, with the travellers' indexes and passports.
+    """
+    file_name = "test_decide_missing_required_information.json"
+    expected = decide(file_name, COUNTRIES_FILE, reference_date=DATE_TODAY)
+    with open(file_name, "r") as citizen_file:
+        passports = [person.get("passport") for person in json.loads(citizen_file.read())]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        jsonl_file = os.path.join(tmp_dir, "decisions.jsonl")
+        assert decide_to_sink(file_name, COUNTRIES_FILE, JsonLinesSink(jsonl_file), DATE_TODAY) == len(expected)
+        with open(jsonl_file, "r") as output_file:
+            records = [json.loads(line) for line in output_file]
+        assert [record["decision"] for record in records] == expected
+        assert [record["passport"] for record in records] == passports
+        assert [record["index"] for record in records] == list(range(len(expected)))
+
+        csv_file = os.path.join(tmp_dir, "decisions.csv")
+        decide_to_sink(file_name, COUNTRIES_FILE, CsvSink(csv_file, buffer_size=64), DATE_TODAY)
+        with open(csv_file, "r") as output_file:
+            rows = list(csv.DictReader(output_file))
+        assert [row["decision"] for row in rows] == expected
+        assert [row["passport"] or None for row in rows] == passports
+
+        binary_file = os.path.join(tmp_dir, "decisions.bin")
+        decide_to_sink(file_name, COUNTRIES_FILE, BinarySink(binary_file, buffer_size=4), DATE_TODAY)
+        assert os.path.getsize(binary_file) == 4 + len(expected)
+        assert list(read_binary_decisions(binary_file, chunk_size=3)) == expected
+
+
+def test_binary_sink_codes():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        binary_file = os.path.join(tmp_dir, "decisions.bin")
+        with BinarySink(binary_file) as sink:
+            for index, decision in enumerate(["Accept", "Reject", "Quarantine", "Accept"]):
+                sink.write(index, None, decision)
+        with open(binary_file, "rb") as output_file:
+            assert output_file.read() == b"KDEC\x01\x02\x03\x01"
+
+
+def test_decision_stats():
+    """
+    Instrumented decisions are the same as plain ones, and every Reject and Quarantine is given a reason.
+    """
+    stats = DecisionStats()
+    seen = []
+    stats.add_hook(lambda person, decision, reason: seen.append((decision, reason)))
+    total = 0
+    for file_name in TEST_FILES:
+        expected = decide(file_name, COUNTRIES_FILE, reference_date=DATE_TODAY)
+        assert decide(file_name, COUNTRIES_FILE, reference_date=DATE_TODAY, stats=stats) == expected
+        total += len(expected)
+
+    snapshot = stats.snapshot()
+    assert len(seen) == total
+    assert sum(snapshot["outcomes"].values()) == total
+    assert snapshot["rules"]["required_fields_exist"]["calls"] == total
+    assert snapshot["rules"]["has_valid_visa"]["calls"] <= snapshot["rules"]["unknown_location_exists"]["calls"]
+    assert snapshot["reasons"]["Reject: unknown via country APD"] == 1
+    assert snapshot["reasons"]["Reject: missing passport"] == 3
+    for decision, reason in seen:
+        assert (reason is None) == (decision == "Accept")
+    assert sum(snapshot["reasons"].values()) == total - snapshot["outcomes"]["Accept"]
+
+
+def test_rule_engine():
+    """
+    Rules are applied by priority and stop at the first that fires; after sampling, the rules of each priority are
+    reordered to put the most selective first, without changing any decision.
+    """
+    calls = []
+
+    def check(name, fires):
+        def rule_check(validator, person):
+            calls.append(name)
+            return name if person.get(name, fires) else None
+        return rule_check
+
+    rules = [Rule("rare", 1, "Reject", check("rare", False)),
+             Rule("common", 1, "Reject", check("common", True)),
+             Rule("advisory", 2, "Quarantine", check("advisory", True)),
+             Rule("first", 0, "Reject", check("first", False))]
+    engine = RuleEngine(rules, sample_size=2)
+    assert engine.order() == ["first", "rare", "common", "advisory"]
+
+    assert engine.decide({}, None) == "Reject"
+    assert calls == ["first", "rare", "common"]
+    assert engine.decide({"common": False}, None) == "Quarantine"
+    assert engine.order() == ["first", "common", "rare", "advisory"]
+
+    del calls[:]
+    assert engine.decide({}, None) == "Reject"
+    assert calls == ["first", "common"]
+    assert engine.decide({"common": False, "advisory": False}, None) == "Accept"
+    assert calls == ["first", "common", "first", "common", "rare", "advisory"]
+
+    del calls[:]
+    validator = CompiledValidator(COUNTRIES, engine=engine)
+    assert validator.decide({}) == "Reject"
+    assert calls == ["first", "common"]
+
+
+def test_decide_person_unknown_location_before_visa():
+    """
+    A visitor via an unknown country is rejected before their visa date is parsed, whatever engine decides.
+    """
+    with open("test_decide_visitors_require_visas_valid_visas.json", "r") as citizen_file:
+        person = json.loads(citizen_file.read())[0]
+    person = dict(person, via=[{"city": "Nowhere", "region": "NA", "country": "ZZZ"}],
+                  visa={"code": "IDOW3-UT3RE", "date": "not-a-date"})
+    assert decide_person(person, COUNTRIES, DATE_TODAY) == "Reject"
+    engine = RuleEngine(exercise2.DECISION_RULES, sample_size=5)
+    assert decide_person(person, COUNTRIES, DATE_TODAY, engine) == "Reject"
+    assert decide_person(person, CountryIndex(COUNTRIES), DATE_TODAY, engine) == "Reject"
+
+
+def test_decide_typed_matches_decide():
+    """
+    Travellers read into records are decided the same way as dictionaries, by the validator and the rule helpers.
+    """
+    for file_name in TEST_FILES:
+        assert decide_typed(file_name, COUNTRIES_FILE, reference_date=DATE_TODAY) == \
+            decide(file_name, COUNTRIES_FILE, reference_date=DATE_TODAY)
+        with open(file_name, "r") as citizen_file:
+            people = json.loads(citizen_file.read())
+        for person, record in zip(people, load_travellers(file_name, COUNTRIES)):
+            assert decide_person(record, COUNTRIES, DATE_TODAY) == decide_person(person, COUNTRIES, DATE_TODAY)
+            if isinstance(record, Traveller):
+                assert record.passport == person["passport"]
+                assert unknown_location_exists(record, COUNTRIES) == unknown_location_exists(person, COUNTRIES)
+            else:
+                assert record == person
+
+
+def test_parse_traveller():
+    """
+    Applications that do not fit the schema, or refer to a country that is not in the table, are kept as
+    dictionaries.
+    """
+    person = {"passport": "6P294-42HR2-95PSF-93NFF-2TEWF",
+              "first_name": "JACK",
+              "last_name": "DOE",
+              "birth_date": "1938-12-21",
+              "home": {"city": "Bala", "region": "ON", "country": "LUG"},
+              "entry_reason": "visiting",
+              "from": {"city": "Bala", "region": "ON", "country": "KAN"},
+              "visa": {"code": "CFR6X-XSMVA", "date": "2015-01-01"}}
+    index = CountryIndex(COUNTRIES)
+    record = parse_traveller(person, index)
+    assert isinstance(record, Traveller)
+    assert record.home_country == "LUG" and record.travel_countries() == ("KAN",)
+    assert has_valid_visa(record, DATE_TODAY) and not has_valid_visa(record, "2017-01-01")
+    assert visitor_from_country_requiring_visa(record, COUNTRIES) == visitor_from_country_requiring_visa(person,
+                                                                                                          COUNTRIES)
+    assert travelled_via_country_with_medical_advisory(record, COUNTRIES) is False
+
+    for broken in (dict(person, visa={"code": "CFR6X-XSMVA", "date": "2015-02-30"}), dict(person, via={}),
+                   dict(person, home={"country": "LUG"}), dict((key, person[key]) for key in person if key != "from"),
+                   dict(person, via={"city": "Nowhere", "region": "NA", "country": "QQQ"})):
+        assert parse_traveller(broken, index) is broken
+    assert "QQQ" not in exercise2.COUNTRY_IDS
+
+    decider = IncrementalDecider([broken], COUNTRIES, DATE_TODAY)
+    assert decider.decisions == ["Reject"]
+    assert decider.apply({"QQQ": dict(COUNTRIES["LUG"], medical_advisory="")}) == {0: "Reject"}
+    assert decider.decisions == ["Accept"]
+
+
+def test_decide_batch(monkeypatch):
+    """
+    A batch of Travellers decided over their columns gets the decisions of deciding each record, including visas
+    dated on the cutoff, countries removed from the table after the Travellers were read, and applications kept as
+    dictionaries.
+    """
+    index = CountryIndex(COUNTRIES)
+    records = []
+    for file_name in TEST_FILES:
+        records += load_travellers(file_name, index)
+    person = {"passport": "6P294-42HR2-95PSF-93NFF-2TEWF",
+              "first_name": "JACK",
+              "last_name": "DOE",
+              "birth_date": "1938-12-21",
+              "home": {"city": "Bala", "region": "ON", "country": "LUG"},
+              "entry_reason": "visiting",
+              "from": {"city": "Bala", "region": "ON", "country": "KAN"}}
+    for date in ("2013-12-16", "2013-12-17"):
+        records.append(parse_traveller(dict(person, visa={"code": "CFR6X-XSMVA", "date": date}), index))
+    records.append(parse_traveller(dict(person, home={"city": "Bala", "region": "ON", "country": "ELE"}), index))
+    columns = TravellerColumns(records)
+    assert len(columns) == sum(1 for record in records if isinstance(record, Traveller))
+    assert 0 < len(columns) < len(records)
+
+    for countries in (COUNTRIES, dict((code, COUNTRIES[code]) for code in COUNTRIES if code != "ELE")):
+        validator = CompiledValidator(countries, reference_date=DATE_TODAY)
+        expected = [validator.decide(record) for record in records]
+        assert validator.decide_batch(records) == expected
+        assert validator.decide_batch([record for record in records if isinstance(record, Traveller)]) == \
+            [decision for record, decision in zip(records, expected) if isinstance(record, Traveller)]
+        monkeypatch.setattr(exercise2, "numpy", None)
+        assert validator.decide_batch(records) == expected
+        monkeypatch.undo()
+    assert expected[-3:] == ["Reject", "Accept", "Reject"]
+
+
+def test_incremental_decider():
+    """
+    After a change to the countries table, only the travellers referring to a changed country are decided again, and
+    the decisions are those of deciding everyone against the new table.
+    """
+    people = []
+    for file_name in TEST_FILES:
+        with open(file_name, "r") as citizen_file:
+            people.extend(json.loads(citizen_file.read()))
+    decider = IncrementalDecider(people, COUNTRIES, DATE_TODAY)
+    assert decider.decisions == [decide_person(person, COUNTRIES, DATE_TODAY) for person in people]
+
+    countries = dict(COUNTRIES)
+    countries["LUG"] = dict(COUNTRIES["LUG"], medical_advisory="")
+    countries["ELE"] = dict(COUNTRIES["ELE"], name="Renamed")
+    del countries["JIK"]
+    assert sorted(countries_diff(COUNTRIES, countries)) == ["ELE", "JIK", "LUG"]
+
+    old = list(decider.decisions)
+    flips = decider.update(countries)
+    expected = [decide_person(person, countries, DATE_TODAY) for person in people]
+    assert decider.decisions == expected
+    assert flips == dict((position, old[position]) for position in range(len(people))
+                         if old[position] != expected[position])
+    assert list(flips) == sorted(flips)
+    assert len(flips) > 0
+    assert decider.recomputed < len(people)
+
+    assert decider.apply({"ELE": COUNTRIES["ELE"]}) == {}
+    assert decider.recomputed == len(decider.unindexed)
+
+
+def test_decide_deduplicated():
+    """
+    Applications submitted again get the decision of the first copy, and different applications with the same
+    passport are decided on their own and reported as conflicts. Passports seen before the last max_passports are
+    reported as possible duplicates.
+    """
+    with open("test_decide_visitors_require_visas_valid_visas.json", "r") as citizen_file:
+        people = json.loads(citizen_file.read())
+    reordered = dict(reversed(list(people[0].items())))
+    changed = dict(people[1], visa={"code": "IDOW3-UT3RE", "date": "2010-01-01"})
+    people = people + [reordered, changed, people[1], {"first_name": "NO PASSPORT"}]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, "travellers.json")
+        with open(input_file, "w") as citizen_file:
+            json.dump(people, citizen_file)
+        deduplicator = Deduplicator()
+        decisions = decide_deduplicated(input_file, COUNTRIES_FILE, DATE_TODAY, deduplicator)
+        assert decisions == decide(input_file, COUNTRIES_FILE, DATE_TODAY)
+        assert decisions[-4] is decisions[0]
+        assert deduplicator.counts == {DUPLICATE_NEW: len(people) - 3, DUPLICATE_EXACT: 1, DUPLICATE_CONFLICT: 2,
+                                       DUPLICATE_POSSIBLE: 0}
+        assert deduplicator.conflicts == [(len(people) - 3, people[1]["passport"]),
+                                          (len(people) - 2, people[1]["passport"])]
+
+        deduplicator = Deduplicator(max_passports=1)
+        assert decide_deduplicated(input_file, COUNTRIES_FILE, DATE_TODAY, deduplicator) == decisions
+        assert deduplicator.counts == {DUPLICATE_NEW: len(people) - 3, DUPLICATE_EXACT: 0, DUPLICATE_CONFLICT: 1,
+                                       DUPLICATE_POSSIBLE: 2}
+        assert deduplicator.possible_duplicates == [(len(people) - 4, people[0]["passport"]),
+                                                    (len(people) - 3, people[1]["passport"])]
+        assert len(deduplicator.seen) == 1
+
+
+def test_passport_filter():
+    """
+    A PassportFilter finds every passport added to it, and few of the others.
+    """
+    passports = PassportFilter(bits=2 ** 16, hashes=5)
+    added = ["%05d-AAAAA-BBBBB-CCCCC-DDDDD" % i for i in range(1000)]
+    for passport in added:
+        passports.add(passport)
+    assert all(passport in passports for passport in added)
+    others = sum(1 for i in range(1000, 11000) if "%05d-AAAAA-BBBBB-CCCCC-DDDDD" % i in passports)
+    assert others < 100
+    assert "AAAAA-BBBBB-CCCCC-DDDDD-EEEEE" not in PassportFilter()